@@ -1,14 +1,153 @@
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
 import os
+import gzip
+import multiprocessing
+import functools
+import json
+import time
+import logging
+import math
+import numpy as np
 from datetime import datetime, timezone
 import simulate
-from config import GEFS_DIR, SERVER_STATUS_FILE, BASE_DIR
+import cache
+import metrics
+import montecarlo
+import workers
+import optimize
+import pathformat
+import sweep
+from config import GEFS_DIR, SERVER_STATUS_FILE, BASE_DIR, LOG_LEVEL, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_DIR
 import elev
 
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)
 
+# Not in the worker processes themselves, which import this module when it is run as __main__;
+# they reload cycles as tasks arrive (see workers.use_version)
+if multiprocessing.current_process().name == 'MainProcess':
+    # Picks up newly published cycles in the background
+    simulate.start_refresh_daemon()
+    workers.start()
+
+REQUESTS = metrics.Counter("habsim_requests_total", "HTTP requests handled.", ("endpoint", "status"))
+REQUEST_SECONDS = metrics.Histogram("habsim_request_seconds", "HTTP request latency.", ("endpoint",))
+
+@app.before_request
+def start_timer():
+    request.start_time = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or "unknown"
+    REQUEST_SECONDS.observe(time.perf_counter() - request.start_time, endpoint)
+    REQUESTS.inc(endpoint, response.status_code)
+    return response
+
+PENDING_RETRY_SECONDS = 10
+
+@app.errorhandler(simulate.DataPending)
+def data_pending(e):
+    """Forecast hours a request needs are still being fetched on demand; the client should retry."""
+    logger.info("%s", e)
+    return "pending", 503, {'Retry-After': str(PENDING_RETRY_SECONDS)}
+
+# Responses of the prediction endpoints by (endpoint, canonical args, gzip, cycle) -> (body, mimetype, headers)
+resultcache = cache.LRUCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, sizeof=lambda entry: len(entry[0]))
+resultstore = cache.DiskStore(RESULT_CACHE_DIR) if RESULT_CACHE_DIR else None
+CACHED_HEADERS = ('Content-Encoding', 'Vary')
+
+for stat in ('entries', 'bytes'):
+    metrics.Gauge(f"habsim_result_cache_{stat}", f"Prediction result cache {stat}.", lambda stat=stat: resultcache.stats()[stat])
+metrics.Gauge("habsim_result_cache_events_total", "Prediction result cache hits, misses and evictions.",
+              lambda: {(event,): resultcache.stats()[event] for event in ('hits', 'misses', 'evictions')},
+              labels=("event",), kind="counter")
+
+@simulate.on_refresh
+def invalidate_results(cycle):
+    resultcache.discard(lambda key: key[-1] != cycle)
+    if resultstore is not None:
+        resultstore.retain(cycle)
+
+def canonical(value):
+    """Normalize a query value so equivalent spellings ("5", "5.0", "5e0") give the same cache key."""
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value
+
+def cached_result(func):
+    """
+    Serve repeated requests to a prediction endpoint from resultcache (and resultstore if
+    configured). Keys include the cycle and its manifest revision, so neither a new cycle nor
+    forecast hours written into the current one leave stale results being served.
+    """
+    @functools.wraps(func)
+    def wrapper(**view_args):
+        with simulate.use_snapshot() as snapshot:
+            if snapshot is None:
+                return func(**view_args)
+            args = list(request.args.items()) + [(name, str(value)) for name, value in view_args.items()]
+            args = tuple(sorted((name, canonical(value)) for name, value in args))
+            key = (request.endpoint, args, 'gzip' in request.headers.get('Accept-Encoding', ''), snapshot.revision, snapshot.cycle)
+            entry = resultcache.get(key)
+            if entry is None and resultstore is not None:
+                entry = resultstore.get(snapshot.cycle, key)
+                if entry is not None:
+                    resultcache.put(key, entry)
+            if entry is None:
+                response = app.make_response(func(**view_args))
+                if response.status_code != 200 or response.get_data().strip() in (b'error', b'"error"', b'["error"]'):
+                    return response
+                entry = (response.get_data(), response.mimetype, {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers})
+                resultcache.put(key, entry)
+                if resultstore is not None:
+                    resultstore.put(snapshot.cycle, key, entry)
+                return response
+            body, mimetype, headers = entry
+            return Response(body, mimetype=mimetype, headers=headers)
+    return wrapper
+
+MIN_GZIP_BYTES = 1024
+MAX_TILE_ZOOM = 7  # Tiles of 2.8 x 1.4 degrees, a few grid points each
+
+def path_options():
+    """The (fields, max_points, simplify) path options of the request, or None if none are given."""
+    args = request.args
+    if not any(name in args for name in ('format', 'fields', 'max_points', 'simplify')):
+        return None
+    max_points = int(args['max_points']) if 'max_points' in args else None
+    simplify = float(args['simplify']) if 'simplify' in args else None
+    return args.get('fields'), max_points, simplify
+
+def path_response(result):
+    """
+    Respond with a path result. If any of `format`, `fields`, `max_points` or `simplify` is given,
+    the paths are decimated and encoded by pathformat and gzipped when the client accepts it.
+    """
+    options = path_options()
+    if isinstance(result, str) or options is None:
+        return jsonify(result)
+    try:
+        body, mimetype = pathformat.encode(result, request.args.get('format', 'json'), *options)
+    except ValueError as e:
+        logger.error("Error encoding paths: %s", e)
+        return "error"
+    return compressed_response(body, mimetype)
+
+def compressed_response(body, mimetype):
+    """Respond with body, gzipped when the client accepts it and it is worth compressing."""
+    response = Response(body, mimetype=mimetype)
+    if len(body) >= MIN_GZIP_BYTES and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 @app.route('/')
 def home():  # pragma: no cover
     return Response(open(os.path.join(BASE_DIR, "interface/home.html")).read(), mimetype="text/html")
@@ -37,6 +176,14 @@ def status():
     except FileNotFoundError:
         return "Error: Status file not found"
 
+'''
+Prometheus metrics: request counts and latency per endpoint, time per hot-path stage
+(file_load, interpolation, elevation), steps per simulation and GEFS data cache statistics.
+'''
+@app.route('/metrics')
+def metricsh():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/ls')
 def ls():
     try:
@@ -55,6 +202,7 @@ u-wind is wind towards the EAST: wind vector in the positive X direction
 v-wind is wind towards the NORTH: wind vector in the positve Y direction
 '''
 @app.route('/singlepredicth')
+@cached_result
 def singlepredicth():
     args = request.args
     yr, mo, day, hr, mn = int(args['yr']), int(args['mo']), int(args['day']), int(args['hr']), int(args['mn'])
@@ -63,14 +211,19 @@ def singlepredicth():
     model = int(args['model'])
     coeff = float(args['coeff'])
     alt = float(args['alt'])
+    method, tol = args.get('method', 'euler'), float(args.get('tol', simulate.ADAPTIVE_TOLERANCE))
     try:
-        path = simulate.simulate(datetime(yr, mo, day, hr, mn).replace(tzinfo=timezone.utc), lat, lon, rate, step, dur, alt, model, coefficient=coeff)
+        path = simulate.simulate(datetime(yr, mo, day, hr, mn).replace(tzinfo=timezone.utc), lat, lon, rate, step, dur, alt, model,
+                                 coefficient=coeff, method=method, tolerance=tol)
+    except simulate.DataPending:
+        raise
     except Exception as e:
-        print(f"Error in simulation: {str(e)}")
+        logger.error("Error in simulation: %s", e)
         return "error"
-    return jsonify(path)
+    return path_response(path)
 
 @app.route('/singlepredict')
+@cached_result
 def singlepredict():
     args = request.args
     timestamp = datetime.utcfromtimestamp(float(args['timestamp'])).replace(tzinfo=timezone.utc)
@@ -79,13 +232,17 @@ def singlepredict():
     model = int(args['model'])
     coeff = float(args['coeff'])
     alt = float(args['alt'])
+    method, tol = args.get('method', 'euler'), float(args.get('tol', simulate.ADAPTIVE_TOLERANCE))
     try:
-        path = simulate.simulate(timestamp, lat, lon, rate, step, dur, alt, model, coefficient=coeff)
+        path = simulate.simulate(timestamp, lat, lon, rate, step, dur, alt, model, coefficient=coeff, method=method, tolerance=tol)
+    except simulate.DataPending:
+        raise
     except Exception as e:
-        print(f"Error in simulation: {str(e)}")
+        logger.error("Error in simulation: %s", e)
         return "error"
-    return jsonify(path)
+    return path_response(path)
 
+@simulate.pin_snapshot
 def singlezpb(timestamp, lat, lon, alt, equil, eqtime, asc, desc, model):
     try:
         dur = 0 if equil == alt else (equil - alt) / asc / 3600
@@ -102,11 +259,39 @@ def singlezpb(timestamp, lat, lon, alt, equil, eqtime, asc, desc, model):
         dur = (alt) / desc / 3600
         fall = simulate.simulate(timestamp, lat, lon, -desc, 240, dur, alt, model)
         return (rise, coast, fall)
+    except simulate.DataPending:
+        raise
     except Exception as e:
-        print(f"Error in ZPB simulation: {str(e)}")
+        logger.error("Error in ZPB simulation: %s", e)
+        return "error"
+
+@simulate.pin_snapshot
+def ensemblezpb(timestamp, lat, lon, alt, equil, eqtime, asc, desc, models):
+    """Vectorized singlezpb over a list of models; returns one (rise, coast, fall) per model."""
+    try:
+        dur = 0 if equil == alt else (equil - alt) / asc / 3600
+        rise = workers.simulate_ensemble(timestamp, lat, lon, asc, 240, dur, alt, models, elevation=False)
+        if rise == "error":
+            return "error"
+        timestamp, lat, lon, alt = np.array([path[-1][:4] for path in rise]).T
+
+        coast = workers.simulate_ensemble(timestamp, lat, lon, 0, 240, eqtime, alt, models)
+        if coast == "error":
+            return "error"
+        timestamp, lat, lon, alt = np.array([path[-1][:4] for path in coast]).T
+
+        fall = workers.simulate_ensemble(timestamp, lat, lon, -desc, 240, alt / desc / 3600, alt, models)
+        if fall == "error":
+            return "error"
+        return list(zip(rise, coast, fall))
+    except simulate.DataPending:
+        raise
+    except Exception as e:
+        logger.error("Error in ensemble ZPB simulation: %s", e)
         return "error"
 
 @app.route('/singlezpb')
+@cached_result
 def singlezpbh():
     args = request.args
     timestamp = datetime.utcfromtimestamp(float(args['timestamp'])).replace(tzinfo=timezone.utc)
@@ -117,9 +302,76 @@ def singlezpbh():
     asc, desc = float(args['asc']), float(args['desc'])
     model = int(args['model'])
     path = singlezpb(timestamp, lat, lon, alt, equil, eqtime, asc, desc, model)
-    return jsonify(path)
+    return path_response(path)
+
+'''
+Streaming variants of /singlepredict and /singlezpb: same args, with the model replaced by an
+optional comma-separated list of `models` (default 1-20). Responds with newline-delimited JSON,
+one line {"model": model, "path": path} per model as soon as its simulation finishes, where path
+is as returned by the single-model endpoint (or "error"). Accepts `fields`, `max_points` and `simplify`.
+'''
+@app.route('/singlepredict/stream')
+def singlepredictstream():
+    args = request.args
+    timestamp = datetime.utcfromtimestamp(float(args['timestamp'])).replace(tzinfo=timezone.utc)
+    lat, lon = float(args['lat']), float(args['lon'])
+    rate, dur, step = float(args['rate']), float(args['dur']), float(args['step'])
+    coeff = float(args['coeff'])
+    alt = float(args['alt'])
+    method, tol = args.get('method', 'euler'), float(args.get('tol', simulate.ADAPTIVE_TOLERANCE))
+
+    def run(model):
+        try:
+            return simulate.simulate(timestamp, lat, lon, rate, step, dur, alt, model, coefficient=coeff, method=method, tolerance=tol)
+        except simulate.DataPending:
+            raise
+        except Exception as e:
+            logger.error("Error in simulation: %s", e)
+            return "error"
+
+    return stream_paths(run)
+
+@app.route('/singlezpb/stream')
+def singlezpbstream():
+    args = request.args
+    timestamp = datetime.utcfromtimestamp(float(args['timestamp'])).replace(tzinfo=timezone.utc)
+    lat, lon = float(args['lat']), float(args['lon'])
+    alt = float(args['alt'])
+    equil = float(args['equil'])
+    eqtime = float(args['eqtime'])
+    asc, desc = float(args['asc']), float(args['desc'])
+    return stream_paths(lambda model: singlezpb(timestamp, lat, lon, alt, equil, eqtime, asc, desc, model))
+
+def stream_paths(run):
+    """Stream run(model) for each requested model as NDJSON, all on one cycle snapshot."""
+    args = request.args
+    models = [int(m) for m in args['models'].split(',')] if 'models' in args else range(1, 21)
+    # Checked before streaming starts, since an encoding error mid-stream would cut it off
+    try:
+        options = path_options()
+        if options is not None:
+            pathformat.parse_fields(options[0])
+    except ValueError as e:
+        logger.error("Error encoding paths: %s", e)
+        return "error"
+
+    def generate():
+        with simulate.use_snapshot():
+            for model in models:
+                try:
+                    path = run(model)
+                except simulate.DataPending:
+                    path = "pending"
+                if isinstance(path, str) or options is None:
+                    body = json.dumps(path).encode()
+                else:
+                    body = pathformat.encode(path, 'json', *options)[0]
+                yield b'{"model": %d, "path": ' % model + body + b'}\n'
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 @app.route('/spaceshot')
+@cached_result
 def spaceshot():
     args = request.args
     timestamp = datetime.utcfromtimestamp(float(args['timestamp'])).replace(tzinfo=timezone.utc)
@@ -128,19 +380,142 @@ def spaceshot():
     equil = float(args['equil'])
     eqtime = float(args['eqtime'])
     asc, desc = float(args['asc']), float(args['desc'])
-    paths = []
-    for model in range(1, 21):
-        result = singlezpb(timestamp, lat, lon, alt, equil, eqtime, asc, desc, model)
-        if result == "error":
-            return jsonify(["error"])
-        paths.append(result)
-    return jsonify(paths)
+    paths = ensemblezpb(timestamp, lat, lon, alt, equil, eqtime, asc, desc, range(1, 21))
+    if paths == "error":
+        return jsonify(["error"])
+    return path_response(paths)
+
+'''
+Monte Carlo landing prediction. Takes the /spaceshot arguments plus the number of flights per
+GEFS member (`samples`, default 100), a drift coefficient (`coeff`, default 1) and optional standard
+deviations `equil_sd`, `eqtime_sd`, `asc_sd`, `desc_sd` and `coeff_sd` for normally distributed
+perturbations. Optional: `models` (comma separated, default 1-20), density cell size in degrees
+(`res`, default 0.05) and a random `seed`.
+
+Returns the landing summary: flight count, mean landing [lat, lon], percentiles of landing lat, lon,
+UNIX time and distance from the mean (m), a 95% ellipse (semi-axes in m, azimuth in degrees from north)
+and density cells [lat, lon, probability].
+'''
+@app.route('/montecarlo')
+def montecarloh():
+    args = request.args
+    timestamp = datetime.utcfromtimestamp(float(args['timestamp'])).replace(tzinfo=timezone.utc)
+    lat, lon = float(args['lat']), float(args['lon'])
+    alt = float(args['alt'])
+    equil = float(args['equil'])
+    eqtime = float(args['eqtime'])
+    asc, desc = float(args['asc']), float(args['desc'])
+    models = [int(m) for m in args['models'].split(',')] if 'models' in args else range(1, 21)
+    spreads = {name: float(args.get(name, 0)) for name in ('equil_sd', 'eqtime_sd', 'asc_sd', 'desc_sd', 'coeff_sd')}
+    seed = int(args['seed']) if 'seed' in args else None
+    try:
+        landings = montecarlo.run(timestamp, lat, lon, alt, equil, eqtime, asc, desc, models, int(args.get('samples', 100)),
+                                  coeff=float(args.get('coeff', 1)), seed=seed, **spreads)
+    except simulate.DataPending:
+        raise
+    except Exception as e:
+        logger.error("Error in Monte Carlo simulation: %s", e)
+        return "error"
+    if isinstance(landings, str):
+        return "error"
+    return jsonify(montecarlo.summarize(landings, float(args.get('res', 0.05))))
+
+'''
+Launch-window sweep. Takes launch times from UNIX `start` to `end` (default `start`) every `interval`
+hrs (default 1), sites as comma-separated `lats`, `lons` and optional `alts` (default 0), and the
+/spaceshot flight profile (`equil`, `eqtime`, `asc`, `desc`). Optional: `models` (comma separated,
+default 1-20). At most 20000 flights (launch times x sites x models) per request.
+
+Returns one entry per launch, ordered by time and then site: {timestamp, site [lat, lon, alt],
+landings [[UNIX time, lat, lon] per model], mean landing [lat, lon], flight_time (hrs), drift (m from
+the site to the mean landing), spread (95th percentile distance in m from the mean landing)}, or
+"error" for launches whose flight would run past the forecast.
+'''
+@app.route('/sweep')
+@cached_result
+def sweeph():
+    args = request.args
+    start = float(args['start'])
+    end = float(args.get('end', start))
+    interval = float(args.get('interval', 1)) * 3600
+    timestamps = np.arange(start, end + 1, interval) if interval > 0 else np.array([start])
+    lats = [float(x) for x in args['lats'].split(',')]
+    lons = [float(x) for x in args['lons'].split(',')]
+    alts = [float(x) for x in args['alts'].split(',')] if 'alts' in args else [0] * len(lats)
+    if not len(lats) == len(lons) == len(alts):
+        return "error"
+    equil = float(args['equil'])
+    eqtime = float(args['eqtime'])
+    asc, desc = float(args['asc']), float(args['desc'])
+    models = [int(m) for m in args['models'].split(',')] if 'models' in args else range(1, 21)
+    try:
+        launches = sweep.run(timestamps, list(zip(lats, lons, alts)), models, equil, eqtime, asc, desc)
+    except simulate.DataPending:
+        raise
+    except Exception as e:
+        logger.error("Error in launch sweep: %s", e)
+        return "error"
+    if isinstance(launches, str):
+        return "error"
+    return jsonify(launches)
+
+'''
+Launch optimizer. Takes the launch site (`lat`, `lon`, `alt`), the target (`tlat`, `tlon`) and a
+target radius in m (`radius`, default 5000), launch times from UNIX `start` to `end` (default `start`),
+and `asc`, `equil` and `eqtime` each as a fixed value or a "min,max" range, with a fixed `desc`.
+Optional: `models` (comma separated, default 1-20) and the number of `candidates` (default 5).
+
+Returns up to `candidates` launches, nearest first: {launch (UNIX time), asc, equil, eqtime,
+landings [[UNIX time, lat, lon] per model], mean landing [lat, lon], miss (m from the mean landing
+to the target), spread (95th percentile distance in m from the mean landing), hit_fraction (share
+of models landing within radius)}.
+'''
+@app.route('/optimize')
+@cached_result
+def optimizeh():
+    args = request.args
+
+    def value_range(name):
+        values = [float(x) for x in args[name].split(',')]
+        return values[0], values[-1]
+
+    site = float(args['lat']), float(args['lon']), float(args['alt'])
+    target = float(args['tlat']), float(args['tlon'])
+    start = float(args['start'])
+    ranges = {'launch': (start, float(args.get('end', start))), 'asc': value_range('asc'),
+              'equil': value_range('equil'), 'eqtime': value_range('eqtime')}
+    models = [int(m) for m in args['models'].split(',')] if 'models' in args else range(1, 21)
+    try:
+        results = optimize.run(site, target, ranges, float(args['desc']), models,
+                               candidates=int(args.get('candidates', 5)), radius=float(args.get('radius', 5000)))
+    except simulate.DataPending:
+        raise
+    except Exception as e:
+        logger.error("Error in launch optimization: %s", e)
+        return "error"
+    return jsonify(results)
 
 @app.route('/elev')
 def elevation():
     lat, lon = float(request.args['lat']), float(request.args['lon'])
     return str(elev.getElevation(lat, lon))
 
+'''
+Batched elevation lookup. POST a JSON object with equal-length lists (or scalars) `lats` and `lons`,
+and optionally `interpolate` (true for bilinear interpolation between grid points).
+
+Returns a list of elevations in meters.
+'''
+@app.route('/elev/batch', methods=['POST'])
+def elevationbatch():
+    args = request.get_json(force=True)
+    try:
+        elevations = elev.getElevation_batch(args['lats'], args['lons'], interpolate=bool(args.get('interpolate', False)))
+    except Exception as e:
+        logger.error("Error getting batch elevation data: %s", e)
+        return "error"
+    return jsonify(np.atleast_1d(elevations).tolist())
+
 @app.route('/windensemble')
 def windensemble():
     args = request.args
@@ -148,25 +523,64 @@ def windensemble():
     alt = float(args['alt'])
     yr, mo, day, hr, mn = int(args['yr']), int(args['mo']), int(args['day']), int(args['hr']), int(args['mn'])
     time = datetime(yr, mo, day, hr, mn).replace(tzinfo=timezone.utc)
-    uList = []
-    vList = []
-    duList = []
-    dvList = []
-
     levels = simulate.GFSHIST if yr < 2019 else simulate.GEFS
 
-    for i in range(1, 21):
-        try:
-            u, v, du, dv = simulate.get_wind(time, lat, lon, alt, i, levels)
-            uList.append(u)
-            vList.append(v)
-            duList.append(du)
-            dvList.append(dv)
-        except Exception as e:
-            print(f"Error getting wind data for model {i}: {str(e)}")
+    try:
+        winds = workers.get_wind_batch(time.timestamp(), lat, lon, alt, np.arange(1, 21), levels)
+    except simulate.DataPending:
+        raise
+    except Exception as e:
+        logger.error("Error getting wind data: %s", e)
+        return "error"
+
+    return jsonify([["error" if np.isnan(x) else x for x in values.tolist()] for values in winds])
+
+'''
+Wind field over a lat/lon box. Takes the UNIX `timestamp`, altitude (`alt`, m), GEFS model (`model`,
+default 1) and the box in whole degrees: `lat1`, `lat2`, `lon1`, `lon2` (inclusive; lon2 may exceed 180
+to cross the antimeridian). Optional: `stride` (every nth 1-degree grid point, default 1) and `format`
+(`json` or `binary`, see pathformat.py).
+
+Returns the grid's `lats` (north to south) and `lons` with `u` and `v` winds in m/s, one row per lat.
+
+/windfield/<z>/<x>/<y> serves the same field in tiles: at zoom z the globe is split into 2^z by 2^z
+tiles of 360/2^z degrees of longitude (x = 0 at 180 W) by 180/2^z degrees of latitude (y = 0 at the
+north pole), each including the grid points on its edges. Tiles take the same args except the box and
+are cached per cycle.
+'''
+@app.route('/windfield')
+def windfield():
+    args = request.args
+    box = (float(args['lat1']), float(args['lat2'])), (float(args['lon1']), float(args['lon2']))
+    return field_response(*box)
+
+@app.route('/windfield/<int:z>/<int:x>/<int:y>')
+@cached_result
+def windfieldtile(z, x, y):
+    if not (0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return "error", 404
+    width, height = 360 / 2 ** z, 180 / 2 ** z
+    north, west = 90 - y * height, -180 + x * width
+    lats = (math.ceil(north - height), math.floor(north))
+    lons = (math.ceil(west), math.floor(west + width))
+    return field_response(lats, lons)
+
+def field_response(lat_range, lon_range):
+    args = request.args
+    timestamp = datetime.utcfromtimestamp(float(args['timestamp'])).replace(tzinfo=timezone.utc)
+    alt = float(args['alt'])
+    model = int(args.get('model', 1))
+    stride = max(1, int(args.get('stride', 1)))
+    try:
+        field = simulate.get_wind_field(timestamp, lat_range, lon_range, alt, model, stride=stride)
+        if field is None:
             return "error"
-    
-    return jsonify([uList, vList, duList, dvList])
+        lats, lons, u, v = field
+        body, mimetype = pathformat.encode_grid(lats, lons, {'u': u, 'v': v}, args.get('format', 'json'))
+    except ValueError as e:
+        logger.error("Error getting wind field: %s", e)
+        return "error"
+    return compressed_response(body, mimetype)
 
 @app.route('/wind')
 def wind():
@@ -179,10 +593,30 @@ def wind():
     time = datetime(yr, mo, day, hr, mn).replace(tzinfo=timezone.utc)
     try:
         u, v, du, dv = simulate.get_wind(time, lat, lon, alt, model, levels)
+    except simulate.DataPending:
+        raise
     except Exception as e:
-        print(f"Error getting wind data: {str(e)}")
+        logger.error("Error getting wind data: %s", e)
         return "error"
     return jsonify([u, v, du, dv])
 
+'''
+Batched wind lookup. POST a JSON object with equal-length lists (or scalars) `times`
+(UNIX timestamps), `lats`, `lons`, `alts` and `models`.
+
+Returns [u-wind, v-wind, du/dh, dv/dh] as lists, with null for points outside the data range.
+'''
+@app.route('/wind/batch', methods=['POST'])
+def windbatch():
+    args = request.get_json(force=True)
+    try:
+        winds = workers.get_wind_batch(args['times'], args['lats'], args['lons'], args['alts'], args['models'])
+    except simulate.DataPending:
+        raise
+    except Exception as e:
+        logger.error("Error getting batch wind data: %s", e)
+        return "error"
+    return jsonify([[None if np.isnan(x) else x for x in values.tolist()] for values in winds])
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
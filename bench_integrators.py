@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+import math
+import sys
+import simulate
+
+def distance(a, b):
+    """Great-circle distance in meters between two (lat, lon) points."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * simulate.EARTH_RADIUS * math.asin(math.sqrt(h))
+
+def landing(launch_time, method, step, tolerance=simulate.ADAPTIVE_TOLERANCE):
+    """Run the benchmark descent; returns (landing (lat, lon), wind evaluations) from the simulate metrics."""
+    before = simulate.WIND_EVALUATIONS.get(method)
+    path = simulate.simulate(launch_time, 37.4275, -122.1697, -5, step, 2, 25000, 1,
+                             method=method, tolerance=tolerance)
+    if path == "error":
+        sys.exit("Simulation failed; check that GEFS data covers the launch time")
+    return path[-1][1:3], simulate.WIND_EVALUATIONS.get(method) - before
+
+def benchmark_integrators(launch_time):
+    """Compare landing-point error against wind evaluations for each integrator."""
+    reference, __ = landing(launch_time, "rk4", 2)
+    print(f"Reference landing (rk4, 2 s steps): {reference[0]:.5f}, {reference[1]:.5f}")
+    print(f"{'method':<10}{'step/tol':>10}{'evaluations':>14}{'error (m)':>12}")
+    runs = [("euler", step) for step in (240, 120, 60, 30, 10)]
+    runs += [(method, step) for method in ("midpoint", "rk4") for step in (480, 240, 120)]
+    for method, step in runs:
+        point, evaluations = landing(launch_time, method, step)
+        print(f"{method:<10}{step:>10}{evaluations:>14}{distance(point, reference):>12.1f}")
+    for tolerance in (100, 10, 1):
+        point, evaluations = landing(launch_time, "adaptive", 240, tolerance)
+        print(f"{'adaptive':<10}{tolerance:>10}{evaluations:>14}{distance(point, reference):>12.1f}")
+
+if __name__ == "__main__":
+    start = simulate.get_valid_range()[0]
+    benchmark_integrators(datetime.fromtimestamp(start.timestamp() + 3600, timezone.utc))
@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+import statistics
+import sys
+import elev
+import simulate
+
+FLIGHTS = [  # (name, lat, lon, rate, hours, start altitude)
+    ("ascent", 37.4275, -122.1697, 5, 1.5, 0),
+    ("float", 37.4275, -122.1697, 0, 6, 20000),
+    ("descent", 39.5, -106.0, -5, 2, 25000),
+]
+REPEATS = 5  # Timed runs of each variant per flight; the median is reported
+
+def run_flight(launch_time, lat, lon, rate, hours, alt, step):
+    """Run one flight; returns its (lookups, skips, elevation seconds) from the simulate metrics."""
+    def read():
+        return (simulate.TERRAIN_CHECKS.get("performed"), simulate.TERRAIN_CHECKS.get("skipped"),
+                simulate.STAGE_SECONDS.total("elevation"))
+    before = read()
+    path = simulate.simulate(launch_time, lat, lon, rate, step, hours, alt, 1)
+    if path == "error":
+        sys.exit("Simulation failed; check that GEFS data covers the launch time")
+    return tuple(after - start for after, start in zip(read(), before))
+
+def run_variant(pyramid, *flight):
+    """run_flight with or without the max-elevation pyramid."""
+    levels = elev.pyramid.levels
+    if not pyramid:
+        elev.pyramid.levels = []
+    try:
+        return run_flight(*flight)
+    finally:
+        elev.pyramid.levels = levels
+
+def benchmark_terrain(launch_time, step=10, repeats=REPEATS):
+    """
+    Compare elevation lookups and time per flight with and without the max-elevation pyramid.
+    A warm-up flight without the pyramid first loads every elevation tile the flight touches,
+    then the two variants alternate, so neither is timed against a colder tile cache.
+    """
+    print(f"{'flight':<10}{'checks':>8}{'lookups':>9}{'avoided':>9}{'elev ms':>10}{'no pyramid ms':>15}")
+    for name, lat, lon, rate, hours, alt in FLIGHTS:
+        flight = (launch_time, lat, lon, rate, hours, alt, step)
+        run_variant(False, *flight)
+        times = {True: [], False: []}
+        for i in range(repeats):
+            for pyramid in ((True, False) if i % 2 == 0 else (False, True)):
+                lookups, skips, elapsed = run_variant(pyramid, *flight)
+                times[pyramid].append(elapsed)
+                if pyramid:
+                    counts = lookups, skips
+        lookups, skips = counts
+        checks = lookups + skips
+        print(f"{name:<10}{checks:>8}{lookups:>9}{skips / checks:>9.1%}"
+              f"{statistics.median(times[True]) * 1000:>10.2f}{statistics.median(times[False]) * 1000:>15.2f}")
+
+if __name__ == "__main__":
+    start = simulate.get_valid_range()[0]
+    benchmark_terrain(datetime.fromtimestamp(start.timestamp() + 3600, timezone.utc))
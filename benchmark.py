@@ -0,0 +1,292 @@
+"""
+Reproducible benchmarks of the simulator, server and ingest paths on synthetic data.
+
+The first run generates, under --data, a GEFS cycle (a datacube of smooth, deterministic
+winds), global elevation tiles with a few mountain ranges, and a GRIB2 file of u/v winds.
+Later runs reuse them. The server modules are pointed at this data through
+HABSIM_GEFS_ROOT and HABSIM_ELEVATION_DIR, so nothing under /gefs is read or written.
+
+Each benchmark runs once to warm up, then --repeat times. Results (seconds per run) are
+written as JSON to --output. With --baseline, a benchmark whose median is more than
+--threshold slower than the baseline's is flagged as a regression, and the exit status is 1.
+
+Usage: python benchmark.py [--data DIR] [--output FILE] [--baseline FILE] [--threshold 0.2]
+                           [--repeat 5] [--workers 0] [--only name,name...]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import struct
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+DATA_VERSION = 1  # Bump when the generated data changes, so old data directories are regenerated
+CYCLE = datetime(2024, 1, 1, 0)
+HOURS = range(0, 49, 6)
+SLOTS = 2  # Distinct members in the synthetic cube; model numbers alternate between them
+LEVELS = [10, 20, 30, 50, 70, 100, 150, 200, 250, 300, 350, 400, 450,
+          500, 550, 600, 650, 700, 750, 800, 850, 900, 925, 950, 975, 1000]
+LAUNCH = CYCLE.replace(tzinfo=timezone.utc) + timedelta(hours=1)
+SITE = (37.4275, -122.1697)
+RIDGES = [  # (lat, lon, peak height m, width in degrees) of synthetic mountain ranges
+    (39.5, -106.0, 4000, 3.0),
+    (46.5, 9.0, 3500, 2.0),
+    (30.0, 85.0, 7000, 4.0),
+    (-25.0, -68.0, 5500, 2.5),
+]
+
+def synthetic_winds(time_index, slot):
+    """(2, levels, 181, 360) winds: a jet peaking mid-column plus travelling waves."""
+    lat = np.radians(90 - np.arange(181)).reshape(1, 181, 1)
+    lon = np.radians(np.arange(360)).reshape(1, 1, 360)
+    lev = np.linspace(0, 1, len(LEVELS)).reshape(-1, 1, 1)
+    phase = time_index / 2 + slot
+    u = 5 + 25 * np.sin(np.pi * lev) * np.cos(lat) + 8 * np.sin(3 * lon + phase + 2 * lev) * np.cos(2 * lat)
+    v = 6 * np.cos(2 * lon - phase + 3 * lev) * np.sin(3 * lat) + 3 * lev
+    return np.stack([u, v])
+
+def write_cycle(root):
+    """Write the synthetic cycle as a published datacube under root/gefs, and root/whichgefs."""
+    import manifest
+    gefs_dir = os.path.join(root, 'gefs')
+    os.makedirs(gefs_dir, exist_ok=True)
+    cycle = CYCLE.strftime("%Y%m%d%H")
+    times = [(CYCLE + timedelta(hours=hour)).strftime("%Y%m%d%H") for hour in HOURS]
+    members = {str(model).zfill(2): (model - 1) % SLOTS for model in range(1, 21)}
+    encoding = manifest.new_encoding('int16')
+    cube_file = f"{cycle}_cube.npy"
+    shape = (SLOTS, len(times), 2, len(LEVELS), 181, 360)
+    cube = np.lib.format.open_memmap(os.path.join(gefs_dir, cube_file), mode='w+', dtype=encoding["dtype"], shape=shape)
+    for slot in range(SLOTS):
+        for i in range(len(times)):
+            cube[slot, i] = manifest.encode(synthetic_winds(i, slot), encoding)
+    cube.flush()
+    data = manifest.new_cube_manifest(cycle, cube_file, times, members, encoding)
+    data["complete"] = times
+    manifest.save_manifest(gefs_dir, cycle, data)
+    with open(os.path.join(root, 'whichgefs'), 'w') as f:
+        f.write(cycle)
+
+def synthetic_band(ty, tile, cols):
+    """Rows ty*tile:(ty+1)*tile of the synthetic elevation grid: sea level plus gaussian ridges."""
+    lat = 90 - (np.arange(ty * tile, (ty + 1) * tile) + 1) / 120
+    lon = np.arange(cols) / 120 - 180
+    band = np.zeros((tile, cols), dtype=np.float32)
+    for ridge_lat, ridge_lon, height, width in RIDGES:
+        rows = np.abs(lat - ridge_lat) < 3 * width
+        columns = np.abs(lon - ridge_lon) < 3 * width
+        if rows.any():
+            dy = ((lat[rows] - ridge_lat) / width)[:, None]
+            dx = ((lon[columns] - ridge_lon) / width)[None, :]
+            hills = height * np.exp(-dy ** 2 - dx ** 2) * (0.8 + 0.2 * np.sin(40 * dx) * np.cos(40 * dy))
+            band[np.ix_(rows, columns)] = np.maximum(band[np.ix_(rows, columns)], hills)
+    return np.rint(band)
+
+def write_elevation(directory):
+    import convert_elev
+    shape = (180 * 120, 360 * 120)
+    convert_elev.write_store(os.path.join(directory, 'elevtiles'), shape, np.int16,
+                             lambda ty: synthetic_band(ty, convert_elev.TILE, shape[1]))
+
+def grib2_message(discipline_param, level, values, forecast_hour):
+    """
+    One GRIB2 message on a global 0.5 degree grid (north to south, from 0 E), isobaric
+    level in hPa, simple packing at 0.01 precision.
+    """
+    nj, ni = values.shape
+    scaled = np.rint(values * 100).astype(np.int64)
+    reference = int(scaled.min())
+    packed = (scaled - reference).astype('>u2').tobytes()
+    signed = lambda x: x if x >= 0 else 0x80000000 | -x  # GRIB2 sign-and-magnitude
+    sections = [
+        struct.pack('>IBHHBBBHBBBBBBB', 21, 1, 7, 0, 2, 1, 1, CYCLE.year, CYCLE.month, CYCLE.day, CYCLE.hour, 0, 0, 0, 1),
+        struct.pack('>IBBIBBH', 72, 3, 0, ni * nj, 0, 0, 0)
+        + struct.pack('>BBIBIBIIIIIIIBIIIIB', 6, 0, 0, 0, 0, 0, 0, ni, nj, 0, 0xFFFFFFFF,
+                      signed(90000000), 0, 48, signed(-90000000), 359500000, 500000, 500000, 0),
+        struct.pack('>IBHH', 34, 4, 0, 0)
+        + struct.pack('>BBBBBHBBIBBIBBI', 2, discipline_param, 2, 0, 0, 0, 0, 1, forecast_hour,
+                      100, 0, level * 100, 255, 0, 0),
+        struct.pack('>IBIH', 21, 5, ni * nj, 0) + struct.pack('>fHHBB', reference, 0, 2, 16, 0),
+        struct.pack('>IBB', 6, 6, 255),
+        struct.pack('>IB', 5 + len(packed), 7) + packed,
+    ]
+    body = b''.join(sections) + b'7777'
+    return b'GRIB' + struct.pack('>HBBQ', 0, 0, 2, 16 + len(body)) + body
+
+def write_grib(path, forecast_hour=6):
+    """A GRIB2 file of u and v winds on every pressure level, at 0.5 degrees like GEFS pgrb2ap5."""
+    winds = synthetic_winds(forecast_hour // 6, 0)
+    lat = np.arange(361) / 2
+    lon = np.arange(720) / 2
+    with open(path, 'wb') as f:
+        for component, param in ((0, 2), (1, 3)):  # UGRD, VGRD
+            for i, level in enumerate(LEVELS):
+                # Upsample the 1 degree winds to 0.5 degrees by linear interpolation in both directions
+                grid = winds[component, i]
+                rows = np.array([np.interp(lon, np.arange(361), np.append(row, row[0])) for row in grid])
+                values = np.array([np.interp(lat, np.arange(181), rows[:, j]) for j in range(720)]).T
+                f.write(grib2_message(param, level, values, forecast_hour))
+
+def prepare_data(directory):
+    """Generate the synthetic data under directory unless it is already there."""
+    version_file = os.path.join(directory, 'version.json')
+    try:
+        with open(version_file) as f:
+            if json.load(f)['version'] == DATA_VERSION:
+                return
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    print(f"Generating synthetic data in {directory}...")
+    write_cycle(os.path.join(directory, 'gefsroot'))
+    write_elevation(directory)
+    write_grib(os.path.join(directory, 'winds.grib2'))
+    with open(version_file, 'w') as f:
+        json.dump({'version': DATA_VERSION}, f)
+    print(f"Generated synthetic data in {time.perf_counter() - start:.1f}s")
+
+def get_benchmarks(directory):
+    """(name, function) pairs; each function runs one repetition of its benchmark."""
+    import app
+    import elev
+    import simulate
+
+    rng = np.random.default_rng(0)
+    points = [(LAUNCH + timedelta(seconds=float(s)), lat, lon, alt) for s, lat, lon, alt in zip(
+        rng.uniform(0, 24 * 3600, 1000), rng.uniform(-80, 80, 1000), rng.uniform(-180, 180, 1000), rng.uniform(0, 30000, 1000))]
+    batch = [rng.uniform(0, 24 * 3600, 100000) + LAUNCH.timestamp(), rng.uniform(-80, 80, 100000),
+             rng.uniform(0, 360, 100000), rng.uniform(0, 30000, 100000), rng.integers(1, 21, 100000)]
+    terrain = [rng.uniform(35, 45, 100000), rng.uniform(-115, -100, 100000)]  # Around the Rockies ridge
+    client = app.app.test_client()
+    zpb = dict(timestamp=LAUNCH.timestamp(), lat=SITE[0], lon=SITE[1], alt=0, equil=25000, eqtime=2, asc=5, desc=6)
+    spaceshot_url = '/spaceshot?' + '&'.join(f'{key}={value}' for key, value in zpb.items())
+    windensemble_url = f'/windensemble?lat={SITE[0]}&lon={SITE[1]}&alt=10000&yr={LAUNCH.year}&mo={LAUNCH.month}&day={LAUNCH.day}&hr=3&mn=30'
+
+    def check(response):
+        if response.status_code != 200 or b'error' in response.data[:20]:
+            raise RuntimeError(f"Request failed: {response.status_code} {response.data[:200]}")
+
+    def get_wind():
+        for t, lat, lon, alt in points:
+            simulate.get_wind(t, lat, lon, alt, 1, simulate.GEFS)
+
+    def spaceshot():
+        app.resultcache.clear()
+        check(client.get(spaceshot_url))
+
+    def windensemble():
+        for __ in range(20):
+            check(client.get(windensemble_url))
+
+    benchmarks = [
+        ('get_wind x1000', get_wind),
+        ('get_wind_batch x100000', lambda: simulate.get_wind_batch(*batch, simulate.GEFS)),
+        ('simulate euler 2h/60s', lambda: simulate.simulate(LAUNCH, *SITE, 5, 60, 2, 0, 1)),
+        ('simulate adaptive 2h', lambda: simulate.simulate(LAUNCH, *SITE, 5, 240, 2, 0, 1, method="adaptive")),
+        ('simulate descent over terrain', lambda: simulate.simulate(LAUNCH, 39.5, -106.0, -5, 10, 2, 25000, 1)),
+        ('singlezpb', lambda: app.singlezpb(LAUNCH, SITE[0], SITE[1], 0, 25000, 2, 5, 6, 1)),
+        ('/spaceshot', spaceshot),
+        ('/spaceshot cached', lambda: check(client.get(spaceshot_url))),
+        ('/windensemble x20', windensemble),
+        ('getElevation_batch x100000', lambda: elev.getElevation_batch(*terrain)),
+    ]
+
+    try:
+        import downloader
+    except ImportError as e:
+        print(f"Skipping grib_to_array: {e}")
+        return benchmarks
+    downloader.logger.setLevel('WARNING')
+    ingest = os.path.join(directory, 'ingest')
+    gefs = downloader.GEFSDownloader(data_dir=os.path.join(ingest, 'gefs'), temp_dir=os.path.join(ingest, 'temp'),
+                                     staging_dir=os.path.join(ingest, 'staging'))
+    gefs.base_time = CYCLE
+    gefs.open_cube([6])
+    grib_file = os.path.join(directory, 'winds.grib2')
+
+    def grib_to_array():
+        if not gefs.grib_to_array(grib_file, CYCLE + timedelta(hours=6)):
+            raise RuntimeError("grib_to_array failed")
+
+    benchmarks.append(('grib_to_array', grib_to_array))
+    return benchmarks
+
+def run(benchmarks, repeat):
+    results = {}
+    for name, fn in benchmarks:
+        fn()  # Warm up caches and lazy loads
+        times = []
+        for __ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        results[name] = {'median': statistics.median(times), 'min': min(times), 'runs': times}
+        print(f"{name:<32}{results[name]['median'] * 1000:>12.3f} ms")
+    return results
+
+def compare(results, baseline, threshold):
+    """Print each benchmark against the baseline; returns the names of regressions."""
+    regressions = []
+    print(f"\n{'benchmark':<32}{'median ms':>12}{'baseline ms':>13}{'change':>9}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['median']
+        change = result['median'] / before - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<32}{result['median'] * 1000:>12.3f}{before * 1000:>13.3f}{change:>+9.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HABSIM on synthetic data.")
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'habsim-benchmark'),
+                        help="directory for the generated data (reused across runs)")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="slowdown that counts as a regression (0.2 = 20%%)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=0, help="worker processes for ensemble requests")
+    parser.add_argument('--only', help="comma-separated benchmark names to run")
+    args = parser.parse_args()
+
+    data = os.path.abspath(args.data)
+    # Read by config.py, so set before importing any of the server modules
+    os.environ['HABSIM_GEFS_ROOT'] = os.path.join(data, 'gefsroot')
+    os.environ['HABSIM_ELEVATION_DIR'] = data
+    os.environ['HABSIM_WORKERS'] = str(args.workers)
+    os.environ.setdefault('HABSIM_LOG_LEVEL', 'WARNING')
+    os.environ.pop('HABSIM_RESULT_CACHE_DIR', None)
+    prepare_data(data)
+
+    benchmarks = get_benchmarks(data)
+    if args.only:
+        names = args.only.split(',')
+        benchmarks = [(name, fn) for name, fn in benchmarks if name in names]
+    results = run(benchmarks, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'meta': {'time': datetime.now(timezone.utc).isoformat(), 'python': platform.python_version(),
+                     'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                     'repeat': args.repeat, 'workers': args.workers, 'data_version': DATA_VERSION},
+            'results': results,
+        }, f, indent=1)
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
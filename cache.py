@@ -0,0 +1,137 @@
+"""
+Thread-safe bounded LRU cache with hit/miss/eviction counters, and a simple on-disk store.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+
+_missing = object()
+
+def nbytes(value):
+    return getattr(value, 'nbytes', 0)
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by entry count and/or total size in bytes
+    (None for no bound). sizeof(value) gives an entry's size and defaults to the
+    value's nbytes. Safe to use from Flask worker threads and the refresh thread.
+    """
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=nbytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, _missing)
+            if entry is _missing:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            self.evict()
+
+    def get_or_load(self, key, load):
+        """Return the cached value for key, calling load() on a miss. None results are not cached."""
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = load()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def evict(self):
+        # Caller holds the lock. The newest entry is kept even if it alone exceeds max_bytes.
+        while len(self.entries) > 1 and (
+                (self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            __, (__, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def discard(self, predicate):
+        """Remove every entry whose key satisfies predicate."""
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
+
+class DiskStore:
+    """
+    Pickled values on disk under directory/{group}/, e.g. one group per GEFS cycle, so a
+    group can be dropped at once. Writes are atomic; unreadable entries count as missing.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, group, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, str(group), name + '.pkl')
+
+    def get(self, group, key, default=None):
+        try:
+            with open(self.path(group, key), 'rb') as f:
+                stored_key, value = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError, ValueError):
+            return default
+        return value if stored_key == key else default
+
+    def put(self, group, key, value):
+        path = self.path(group, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump((key, value), f)
+        os.replace(tmp, path)
+
+    def retain(self, group):
+        """Remove every group except group."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name != str(group):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
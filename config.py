@@ -3,13 +3,47 @@ import os
 # Base configuration
 MOUNT_ENABLED = True
 
-# Directory paths
+# Directory paths (HABSIM_GEFS_ROOT and HABSIM_ELEVATION_DIR point the server elsewhere, e.g. at benchmark.py's synthetic data)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-GEFS_DIR = '/gefs/gefs' if MOUNT_ENABLED else os.path.join(BASE_DIR, 'gefs')
-WHICH_GEFS_FILE = '/gefs/whichgefs' if MOUNT_ENABLED else os.path.join(BASE_DIR, 'whichgefs')
-STATUS_FILE = '/gefs/serverstatus' if MOUNT_ENABLED else os.path.join(BASE_DIR, 'serverstatus')
+GEFS_ROOT = os.environ.get('HABSIM_GEFS_ROOT', '/gefs' if MOUNT_ENABLED else BASE_DIR)
+GEFS_DIR = os.path.join(GEFS_ROOT, 'gefs')
+WHICH_GEFS_FILE = os.path.join(GEFS_ROOT, 'whichgefs')
+STATUS_FILE = os.path.join(GEFS_ROOT, 'serverstatus')
 SERVER_STATUS_FILE = STATUS_FILE  # Alias for app.py
-ELEVATION_FILE = os.path.join(BASE_DIR, 'worldelev.npy')
+ELEVATION_DIR = os.environ.get('HABSIM_ELEVATION_DIR', BASE_DIR)
+ELEVATION_FILE = os.path.join(ELEVATION_DIR, 'worldelev.npy')
+ELEVATION_TILES_DIR = os.path.join(ELEVATION_DIR, 'elevtiles')  # Preferred over ELEVATION_FILE; see convert_elev.py
+ELEVATION_CACHE_BYTES = 256 * 1024**2  # Decompressed elevation tiles kept in memory
+ELEVATION_PYRAMID_BLOCKS = (600, 60, 20)  # Grid points per side of each max-elevation pyramid level, coarsest first
+
+# Bounds on simulate's GEFS data cache (None for unbounded). Sizes count mapped bytes.
+DATA_CACHE_MAX_ENTRIES = 2048
+DATA_CACHE_MAX_BYTES = 16 * 1024**3
+# Page in the next 6 h timestep in the background as a simulation approaches it
+DATA_PREFETCH = True
+
+# On-demand ingest, for cycles published before every forecast hour is written (see downloader.py's
+# GEFS_PUBLISH_HOURS): a lookup of an unwritten hour queues it in INGEST_QUEUE_DIR for the downloader
+# and waits up to INGEST_WAIT_SECONDS for it, after which the request responds "pending". The next
+# INGEST_LOOKAHEAD hours after a miss are queued at a lower priority.
+# The downloader and downloaderd.py read INGEST_ON_DEMAND and INGEST_QUEUE_DIR from here too, so run
+# them with the same HABSIM_GEFS_ROOT and HABSIM_INGEST_ON_DEMAND as the server. GEFS_PUBLISH_HOURS
+# (default 24) sets how many hours are written up front; hours after it are only written on request.
+INGEST_ON_DEMAND = os.environ.get('HABSIM_INGEST_ON_DEMAND', '0') == '1'
+INGEST_QUEUE_DIR = os.path.join(GEFS_ROOT, 'ingest')
+INGEST_WAIT_SECONDS = float(os.environ.get('HABSIM_INGEST_WAIT', 30))
+INGEST_LOOKAHEAD = 2
+
+# Bounds on the server's prediction result cache, and a directory to persist it across restarts (None to keep it in memory only)
+RESULT_CACHE_MAX_ENTRIES = 10000
+RESULT_CACHE_MAX_BYTES = 512 * 1024**2
+RESULT_CACHE_DIR = os.environ.get('HABSIM_RESULT_CACHE_DIR')
+
+# Worker processes for ensemble and batch requests (0 runs everything in the request thread)
+WORKER_PROCESSES = int(os.environ.get('HABSIM_WORKERS', os.cpu_count() or 1))
+
+# Server log level; DEBUG enables the per-lookup simulation logs
+LOG_LEVEL = os.environ.get('HABSIM_LOG_LEVEL', 'INFO')
 
 # Create directories if they don't exist
 os.makedirs(GEFS_DIR, exist_ok=True)
@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+import zlib
+import numpy as np
+from config import ELEVATION_FILE, ELEVATION_TILES_DIR, ELEVATION_PYRAMID_BLOCKS
+
+# Converts the single-array elevation file into the tiled store read by elev.py,
+# along with its max-elevation pyramid (max_{block}.npy for each of ELEVATION_PYRAMID_BLOCKS).
+# Usage: python convert_elev.py [worldelev.npy] [output directory]
+
+TILE = 600  # 5 degrees at 120 points per degree
+
+def write_store(target, shape, dtype, get_band):
+    """
+    Write a tiled store for a grid of the given shape and dtype. get_band(ty) returns
+    rows ty*TILE:(ty+1)*TILE of the grid. Returns the compressed size in bytes.
+    """
+    rows, cols = shape
+    os.makedirs(target, exist_ok=True)
+    offsets = np.zeros((-(-rows // TILE), -(-cols // TILE), 2), dtype=np.int64)
+    pyramid = {block: [] for block in ELEVATION_PYRAMID_BLOCKS}
+    offset = 0
+    with open(os.path.join(target, 'tiles.bin.tmp'), 'wb') as f:
+        for ty in range(offsets.shape[0]):
+            band = np.asarray(get_band(ty)).astype(dtype)
+            for block, levels in pyramid.items():
+                band_max = np.maximum.reduceat(band, np.arange(0, len(band), block), axis=0)
+                levels.append(np.maximum.reduceat(band_max, np.arange(0, cols, block), axis=1))
+            for tx in range(offsets.shape[1]):
+                blob = zlib.compress(np.ascontiguousarray(band[:, tx*TILE:(tx+1)*TILE]).tobytes(), 6)
+                f.write(blob)
+                offsets[ty, tx] = offset, len(blob)
+                offset += len(blob)
+    np.save(os.path.join(target, 'offsets.npy'), offsets)
+    for block, levels in pyramid.items():
+        np.save(os.path.join(target, f'max_{block}.npy'), np.concatenate(levels).astype(np.float32))
+    os.replace(os.path.join(target, 'tiles.bin.tmp'), os.path.join(target, 'tiles.bin'))
+    with open(os.path.join(target, 'index.json'), 'w') as f:
+        json.dump({'shape': [rows, cols], 'tile': TILE, 'dtype': np.dtype(dtype).str}, f)
+    return offset
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else ELEVATION_FILE
+    target = sys.argv[2] if len(sys.argv) > 2 else ELEVATION_TILES_DIR
+    data = np.load(source, 'r')
+    rows, cols = data.shape
+
+    # Whole meters fit in int16 (half the size of float32, and compress better)
+    dtype = data.dtype
+    if all(np.array_equal(band, np.round(band)) and band.min() >= -2**15 and band.max() < 2**15
+           for band in (data[i:i+TILE] for i in range(0, rows, TILE))):
+        dtype = np.dtype('int16')
+
+    size = write_store(target, data.shape, dtype, lambda ty: data[ty*TILE:(ty+1)*TILE])
+    tiles = -(-rows // TILE) * -(-cols // TILE)
+    print(f"Wrote {tiles} tiles ({size / 1024**2:.1f} MB, {dtype}) to {target}")
@@ -5,10 +5,16 @@ from botocore import UNSIGNED
 from botocore.client import Config
 from datetime import datetime, timedelta
 import logging
+import multiprocessing
 import time
 import numpy as np
 import pygrib
 import shutil
+import zlib
+import config
+import ingest
+import manifest
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 # Configure logging
 logging.basicConfig(
@@ -25,22 +31,159 @@ logger = logging.getLogger(__name__)
 PRESSURE_LEVELS = [10, 20, 30, 50, 70, 100, 150, 200, 250, 300, 350, 400, 450,
                   500, 550, 600, 650, 700, 750, 800, 850, 900, 925, 950, 975, 1000]
 
+# How wind values are stored on disk: 'float64', 'float32' or scaled 'int16' (see manifest.py)
+STORAGE_DTYPE = os.environ.get('GEFS_STORAGE_DTYPE', 'int16')
+
+# GRIB inventory names of the u and v wind messages
+WIND_VARIABLES = ('UGRD', 'VGRD')
+
+# Ingest pipeline: concurrent S3 transfers, GRIB decode processes, and forecast horizon (hrs)
+DOWNLOAD_WORKERS = int(os.environ.get('GEFS_DOWNLOAD_WORKERS', 8))
+DECODE_WORKERS = int(os.environ.get('GEFS_DECODE_WORKERS', os.cpu_count() or 1))
+MAX_FORECAST_HOUR = int(os.environ.get('GEFS_MAX_FORECAST_HOUR', 384))
+
+# A new cycle is published once forecast hours 0 through this are all written, so the server switches
+# to it as soon as the first day is in; later hours are then filled in to the published cycle as NOAA
+# uploads them. Raising it delays every switch until that hour is on S3.
+PUBLISH_HOURS = int(os.environ.get('GEFS_PUBLISH_HOURS', 24))
+
+# On-demand mode: past PUBLISH_HOURS, only the forecast hours the server has queued in INGEST_QUEUE_DIR
+# are written, most urgent (lowest priority number) and then earliest first. Both settings come from
+# config.py so the server and the downloader agree on them.
+ON_DEMAND = config.INGEST_ON_DEMAND
+INGEST_QUEUE_DIR = config.INGEST_QUEUE_DIR
+
+# Datacube member slot for each model number. Only geavg is downloaded, so all share slot 0.
+MEMBERS = {str(model_num).zfill(2): 0 for model_num in range(1, 21)}
+
+def parse_idx(text):
+    """
+    Parse a wgrib2 .idx inventory ("1:0:d=2024123012:UGRD:10 mb:anl:ENS=mean" per line)
+    into (offset, variable, level, next offset) tuples; next offset is None for the last message.
+    Sub-message lines ("3.1", "3.2") share their message's offset, so the next offset is the next
+    distinct one.
+    """
+    entries = []
+    for line in text.splitlines():
+        fields = line.split(':')
+        if len(fields) < 5:
+            continue
+        entries.append((int(fields[1]), fields[3], fields[4]))
+    entries.sort()
+    offsets = sorted({offset for offset, __, __ in entries})
+    following = dict(zip(offsets, offsets[1:] + [None]))
+    return [(offset, variable, level, following[offset]) for offset, variable, level in entries]
+
+def select_ranges(entries, variables, levels):
+    """
+    Select inventory entries by variable and level and return inclusive (start, end) byte
+    ranges, merging adjacent messages and sub-messages into one range. end is None for "to end of file".
+    """
+    ranges = []
+    for offset, variable, level, next_offset in entries:
+        if variable not in variables or level not in levels:
+            continue
+        end = None if next_offset is None else next_offset - 1
+        if ranges and (ranges[-1][1] is None or offset <= ranges[-1][1] + 1):
+            # Adjacent to the previous range, or a sub-message sharing its bytes
+            start, last_end = ranges[-1]
+            ranges[-1] = (start, None if last_end is None or end is None else max(last_end, end))
+        else:
+            ranges.append((offset, end))
+    return ranges
+
+def decode_grib(grib_file):
+    """
+    Decode the u/v isobaric winds of a GRIB2 file into a (2, levels, 181, 360) array.
+    Module-level so it can run in a decoding worker process.
+    """
+    grbs = pygrib.open(grib_file)
+    
+    # Initialize array with shape (2, 26, 181, 360) for u and v winds
+    dataset = np.zeros((2, len(PRESSURE_LEVELS), 181, 360))
+    
+    # Get all messages for u and v components
+    u_messages = sorted([(g.level, g) for g in grbs.select(shortName='u', typeOfLevel='isobaricInhPa')])
+    grbs.seek(0)  # Reset file pointer
+    v_messages = sorted([(g.level, g) for g in grbs.select(shortName='v', typeOfLevel='isobaricInhPa')])
+    
+    # Log available levels
+    available_levels = sorted(list(set([u[0] for u in u_messages])))
+    logger.info(f"Available pressure levels in file: {available_levels}")
+    
+    # Create a mapping from PRESSURE_LEVELS indices to available data indices
+    level_map = {}
+    for i, target_level in enumerate(PRESSURE_LEVELS):
+        # Find closest available level
+        closest_level = min(available_levels, key=lambda x: abs(x - target_level))
+        if abs(closest_level - target_level) <= 5:  # Within 5 hPa tolerance
+            level_map[i] = closest_level
+    
+    logger.info(f"Level mapping: {level_map}")
+    
+    # Process each matched level
+    for i, target_level in level_map.items():
+        try:
+            # Find messages for this level
+            u_data = next(msg for lvl, msg in u_messages if lvl == target_level).values
+            v_data = next(msg for lvl, msg in v_messages if lvl == target_level).values
+            
+            # Resample the data
+            u_resampled = u_data[::2, ::2]
+            v_resampled = v_data[::2, ::2]
+            
+            dataset[0][i] = u_resampled
+            dataset[1][i] = v_resampled
+            logger.info(f"Successfully processed level {target_level} into position {i}")
+        except Exception as e:
+            logger.error(f"Error processing level {target_level}: {str(e)}")
+            continue
+    
+    grbs.close()
+    return dataset
+
+def valid_dataset(dataset):
+    """Whether every component and level of a decoded dataset is finite and was filled in."""
+    levels = np.abs(dataset).reshape(dataset.shape[0], dataset.shape[1], -1)
+    return bool(np.isfinite(levels).all() and (levels.max(axis=2) > 0).all())
+
+def timed_decode(grib_file):
+    """decode_grib for the process pool; returns (dataset, seconds spent decoding)."""
+    start = time.time()
+    return decode_grib(grib_file), time.time() - start
+
+def cycle_prefix(cycle):
+    """S3 key prefix of a cycle's 0.5 degree GRIB files."""
+    return f"gefs.{cycle.strftime('%Y%m%d')}/{cycle.strftime('%H')}/atmos/pgrb2ap5/"
+
 class GEFSDownloader:
-    def __init__(self):
+    def __init__(self, data_dir="/gefs/gefs", temp_dir="/gefs/temp", staging_dir="/gefs/staging", endpoint_url=None,
+                 download_workers=None, decode_workers=None, max_forecast_hour=None):
+        # endpoint_url points the client at a local S3 stand-in for testing
         self.s3 = boto3.client('s3', 
                              region_name='us-east-1',
+                             endpoint_url=endpoint_url or os.environ.get('GEFS_S3_ENDPOINT'),
                              config=Config(signature_version=UNSIGNED))
         self.bucket = 'noaa-gefs-pds'
-        self.data_dir = "/gefs/gefs"
-        self.temp_dir = "/gefs/temp"
+        self.data_dir = data_dir
+        self.temp_dir = temp_dir
+        self.staging_dir = staging_dir  # Cycles are built here, then published to data_dir
+        self.root = os.path.dirname(os.path.normpath(data_dir))  # Holds whichgefs and serverstatus
+        self.download_workers = download_workers or DOWNLOAD_WORKERS
+        self.decode_workers = decode_workers or DECODE_WORKERS
+        self.max_forecast_hour = MAX_FORECAST_HOUR if max_forecast_hour is None else max_forecast_hour
         self.max_retries = 5
         self.backoff_time = 10
         self.current_prefix = None
         self.base_time = None
+        self.manifest = None
+        self.cube = None
+        self.manifest_dir = staging_dir  # Where the open cube and its manifest live: staging_dir, or data_dir once published
 
         # Ensure directories exist
         os.makedirs(self.data_dir, exist_ok=True)
         os.makedirs(self.temp_dir, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
 
     def find_latest_cycle(self):
         """Find latest available GEFS cycle."""
@@ -52,7 +195,7 @@ class GEFSDownloader:
             cycle = cycle.replace(hour=(cycle.hour - (cycle.hour % 6)), 
                                 minute=0, second=0, microsecond=0)
 
-            prefix = f"gefs.{cycle.strftime('%Y%m%d')}/{cycle.strftime('%H')}/atmos/pgrb2ap5/"
+            prefix = cycle_prefix(cycle)
             logger.info(f"Checking cycle: {cycle}, prefix: {prefix}")
             try:
                 response = self.s3.list_objects_v2(
@@ -71,22 +214,48 @@ class GEFSDownloader:
         return None
 
     def update_status(self, message):
-        """Update the HABSIM status file."""
+        """Update the HABSIM status file, if the message has changed."""
         try:
-            with open('/gefs/serverstatus', 'w') as f:
+            status_file = os.path.join(self.root, 'serverstatus')
+            if os.path.exists(status_file):
+                with open(status_file) as f:
+                    if f.read() == message:
+                        return
+            with open(status_file, 'w') as f:
                 f.write(message)
         except Exception as e:
             logger.error(f"Failed to update status: {str(e)}")
 
+    def served_cycle(self):
+        """The published cycle servers are using, from whichgefs; None if there is none yet."""
+        try:
+            with open(os.path.join(self.root, 'whichgefs')) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
     def update_which_gefs(self):
-        """Update the whichgefs file with current cycle time."""
+        """Atomically update the whichgefs file with current cycle time."""
         if self.base_time:
             try:
-                with open('/gefs/whichgefs', 'w') as f:
+                which_file = os.path.join(self.root, 'whichgefs')
+                with open(which_file + '.tmp', 'w') as f:
                     f.write(self.base_time.strftime("%Y%m%d%H"))
+                os.replace(which_file + '.tmp', which_file)
             except Exception as e:
                 logger.error(f"Failed to update whichgefs: {str(e)}")
 
+    def list_available_hours(self):
+        """Forecast hours of the current cycle whose geavg file is on S3."""
+        prefix = f"{self.current_prefix}geavg.t{self.base_time.strftime('%H')}z.pgrb2a.0p50.f"
+        hours = set()
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                suffix = item['Key'][len(prefix):]
+                if suffix.isdigit():
+                    hours.add(int(suffix))
+        return hours
+
     def download_geavg(self, forecast_time):
         """Download a GEFS average member file for a given forecast time."""
         if not self.current_prefix or not self.base_time:
@@ -98,10 +267,14 @@ class GEFSDownloader:
         grib_file = f"{self.temp_dir}/geavg_{forecast_hours:03d}.grib2"
         
         logger.info(f"Attempting to download: {key}")
+        ranges = self.get_wind_ranges(key)
         
         for attempt in range(self.max_retries):
             try:
-                self.s3.download_file(self.bucket, key, grib_file)
+                if ranges:
+                    self.download_ranges(key, ranges, grib_file)
+                else:
+                    self.s3.download_file(self.bucket, key, grib_file)
                 size = os.path.getsize(grib_file)
                 logger.info(f"Downloaded file size: {size} bytes")
                 
@@ -119,73 +292,217 @@ class GEFSDownloader:
                 
         return None
 
+    def get_wind_ranges(self, key):
+        """
+        Read the .idx inventory of a GRIB file and return coalesced byte ranges covering
+        only the u/v messages on PRESSURE_LEVELS, or None if the inventory is unavailable.
+        """
+        try:
+            idx = self.s3.get_object(Bucket=self.bucket, Key=key + ".idx")['Body'].read().decode()
+        except Exception as e:
+            logger.warning(f"No usable inventory for {key}, downloading whole file: {str(e)}")
+            return None
+        ranges = select_ranges(parse_idx(idx), WIND_VARIABLES, [f"{level} mb" for level in PRESSURE_LEVELS])
+        if not ranges:
+            logger.warning(f"Inventory for {key} lists no wind messages, downloading whole file")
+            return None
+        return ranges
+
+    def download_ranges(self, key, ranges, grib_file):
+        """Fetch byte ranges of a GRIB file with ranged GETs and concatenate them into a minimal GRIB stream."""
+        total = 0
+        with open(grib_file, 'wb') as f:
+            for start, end in ranges:
+                byte_range = f"bytes={start}-" if end is None else f"bytes={start}-{end}"
+                body = self.s3.get_object(Bucket=self.bucket, Key=key, Range=byte_range)['Body'].read()
+                f.write(body)
+                total += len(body)
+        logger.info(f"Fetched {total} bytes of wind messages in {len(ranges)} ranged requests")
+
     def grib_to_array(self, grib_file, forecast_time):
         """Convert GRIB2 file to numpy array in HABSIM format."""
         try:
-            grbs = pygrib.open(grib_file)
-            
-            # Initialize array with shape (2, 26, 181, 360) for u and v winds
-            dataset = np.zeros((2, len(PRESSURE_LEVELS), 181, 360))
-            
-            # Get all messages for u and v components
-            u_messages = sorted([(g.level, g) for g in grbs.select(shortName='u', typeOfLevel='isobaricInhPa')])
-            grbs.seek(0)  # Reset file pointer
-            v_messages = sorted([(g.level, g) for g in grbs.select(shortName='v', typeOfLevel='isobaricInhPa')])
-            
-            # Log available levels
-            available_levels = sorted(list(set([u[0] for u in u_messages])))
-            logger.info(f"Available pressure levels in file: {available_levels}")
-            
-            # Create a mapping from PRESSURE_LEVELS indices to available data indices
-            level_map = {}
-            for i, target_level in enumerate(PRESSURE_LEVELS):
-                # Find closest available level
-                closest_level = min(available_levels, key=lambda x: abs(x - target_level))
-                if abs(closest_level - target_level) <= 5:  # Within 5 hPa tolerance
-                    level_map[i] = closest_level
-            
-            logger.info(f"Level mapping: {level_map}")
-            
-            # Process each matched level
-            for i, target_level in level_map.items():
-                try:
-                    # Find messages for this level
-                    u_data = next(msg for lvl, msg in u_messages if lvl == target_level).values
-                    v_data = next(msg for lvl, msg in v_messages if lvl == target_level).values
-                    
-                    # Resample the data
-                    u_resampled = u_data[::2, ::2]
-                    v_resampled = v_data[::2, ::2]
-                    
-                    dataset[0][i] = u_resampled
-                    dataset[1][i] = v_resampled
-                    logger.info(f"Successfully processed level {target_level} into position {i}")
-                except Exception as e:
-                    logger.error(f"Error processing level {target_level}: {str(e)}")
-                    continue
-            
-            grbs.close()
-            
-            # Save for all 20 model numbers
-            base_str = self.base_time.strftime("%Y%m%d%H")
-            forecast_str = forecast_time.strftime("%Y%m%d%H")
-            for model_num in range(1, 21):
-                output_file = f"{self.data_dir}/{base_str}_{forecast_str}_{str(model_num).zfill(2)}.npy"
-                np.save(output_file, dataset)
-                logger.info(f"Saved processed data to {output_file}")
-            
+            dataset = decode_grib(grib_file)
+            # geavg is the only member downloaded, so all 20 model numbers share its slot
+            self.write_timestep(forecast_time, dataset)
             return True
-            
         except Exception as e:
             logger.error(f"Failed to process GRIB file: {str(e)}")
             return False
 
+    def open_cube(self, forecast_hours):
+        """
+        Open the staged datacube covering the given forecast hours, creating it if needed.
+        An existing staged cube with the same time axis is reopened so finished hours are kept.
+        """
+        base_str = self.base_time.strftime("%Y%m%d%H")
+        times = [(self.base_time + timedelta(hours=hour)).strftime("%Y%m%d%H") for hour in forecast_hours]
+        cube_file = f"{base_str}_cube.npy"
+        cube_path = os.path.join(self.staging_dir, cube_file)
+
+        encoding = manifest.new_encoding(STORAGE_DTYPE)
+        existing = manifest.load_manifest(self.staging_dir, base_str)
+        if (existing and existing.get("cube") == cube_file and existing["times"] == times
+                and manifest.get_encoding(existing) == encoding and os.path.exists(cube_path)):
+            self.manifest = existing
+            self.cube = np.load(cube_path, mmap_mode='r+')
+            self.manifest_dir = self.staging_dir
+            self.verify_complete()
+            logger.info(f"Reopened datacube {cube_file} with {len(existing['complete'])}/{len(times)} hours written")
+            return
+
+        shape = (max(MEMBERS.values()) + 1, len(times), 2, len(PRESSURE_LEVELS), 181, 360)
+        self.cube = np.lib.format.open_memmap(cube_path, mode='w+', dtype=encoding["dtype"], shape=shape)
+        self.manifest_dir = self.staging_dir
+        self.manifest = manifest.new_cube_manifest(base_str, cube_file, times, MEMBERS, encoding)
+        manifest.save_manifest(self.staging_dir, base_str, self.manifest)
+        logger.info(f"Created {encoding['dtype']} datacube {cube_file} with shape {shape}")
+
+    def open_published(self, forecast_hours):
+        """
+        Reopen the current cycle in data_dir if it has already been published with the same
+        time axis, so its remaining hours are written in place. Returns whether it was.
+        """
+        base_str = self.base_time.strftime("%Y%m%d%H")
+        times = [(self.base_time + timedelta(hours=hour)).strftime("%Y%m%d%H") for hour in forecast_hours]
+        existing = manifest.load_manifest(self.data_dir, base_str)
+        if not existing or existing.get("times") != times or not existing.get("cube"):
+            return False
+        cube_path = os.path.join(self.data_dir, existing["cube"])
+        if not os.path.exists(cube_path):
+            return False
+        self.manifest = existing
+        self.cube = np.load(cube_path, mmap_mode='r+')
+        self.manifest_dir = self.data_dir
+        self.verify_complete()
+        return True
+
+    def write_marker(self):
+        """Path of the file present while hours are being written into the open cube."""
+        return os.path.join(self.manifest_dir, f"{self.manifest['cycle']}_writing")
+
+    def verify_complete(self):
+        """
+        After an interrupted run, unmark hours whose stored data no longer matches the
+        checksum taken when they were written. A cube whose last run finished its writes,
+        or whose manifest has every hour, is trusted without rereading it.
+        """
+        marker = self.write_marker()
+        if not os.path.exists(marker):
+            return
+        times = self.manifest["times"]
+        checksums = self.manifest.get("checksums", {})
+        if len(self.manifest["complete"]) < len(times):
+            logger.info("Previous run was interrupted; verifying written hours")
+            for key, checksum in list(checksums.items()):
+                forecast_str, slot = key.split('_')
+                if zlib.crc32(np.ascontiguousarray(self.cube[int(slot), times.index(forecast_str)])) != checksum:
+                    logger.warning(f"Checksum mismatch for {forecast_str} slot {slot}; it will be downloaded again")
+                    del checksums[key]
+                    if forecast_str in self.manifest["complete"]:
+                        self.manifest["complete"].remove(forecast_str)
+                    manifest.save_manifest(self.manifest_dir, self.manifest["cycle"], self.manifest)
+        os.remove(marker)
+
+    def pending_hours(self, forecast_hours):
+        return [hour for hour in forecast_hours
+                if (self.base_time + timedelta(hours=hour)).strftime("%Y%m%d%H") not in self.manifest["complete"]]
+
+    def requested_hours(self, forecast_hours, todo):
+        """
+        The hours of todo to write in on-demand mode: those up to PUBLISH_HOURS, then those the
+        server has queued for the current cycle, in (priority, hour) order.
+        """
+        base_str = self.base_time.strftime("%Y%m%d%H")
+        times = {(self.base_time + timedelta(hours=hour)).strftime("%Y%m%d%H"): hour for hour in forecast_hours}
+        priorities = {times[forecast]: priority for (cycle, forecast), priority in ingest.pending(INGEST_QUEUE_DIR).items()
+                      if cycle == base_str and forecast in times}
+        requested = sorted((hour for hour in todo if hour in priorities and hour > PUBLISH_HOURS),
+                           key=lambda hour: (priorities[hour], hour))
+        return [hour for hour in todo if hour <= PUBLISH_HOURS] + requested
+
+    def remove_requests(self, forecast_hours):
+        """
+        Drop queued requests of the current cycle that are written or not one of its forecast
+        times, and those for cycles older than the one servers are using. Requests for the
+        served cycle are kept while a newer one is staged; see write_served_requests.
+        """
+        base_str = self.base_time.strftime("%Y%m%d%H")
+        times = {(self.base_time + timedelta(hours=hour)).strftime("%Y%m%d%H") for hour in forecast_hours}
+        served = self.served_cycle()
+        for cycle, forecast in ingest.pending(INGEST_QUEUE_DIR):
+            if cycle == base_str:
+                stale = forecast not in times or forecast in self.manifest["complete"]
+            else:
+                stale = served is None or cycle < served
+            if stale:
+                ingest.remove(INGEST_QUEUE_DIR, cycle, forecast)
+
+    def write_served_requests(self, forecast_hours):
+        """
+        While a newer cycle is staged, write the hours servers have requested of the published
+        cycle they are still using, so their lookups are not left pending until it is replaced.
+        """
+        served = self.served_cycle()
+        if served is None or served == self.base_time.strftime("%Y%m%d%H"):
+            return
+        state = (self.base_time, self.current_prefix, self.manifest, self.cube, self.manifest_dir)
+        try:
+            self.base_time = datetime.strptime(served, "%Y%m%d%H")
+            self.current_prefix = cycle_prefix(self.base_time)
+            if not self.open_published(forecast_hours):
+                return
+            pending = self.pending_hours(forecast_hours)
+            available = self.list_available_hours()
+            todo = self.requested_hours(forecast_hours, [hour for hour in pending if hour in available])
+            if todo:
+                logger.info(f"Served cycle {served}: {len(todo)} requested hours to write")
+                self.write_hours(todo)
+            self.remove_requests(forecast_hours)
+        finally:
+            self.base_time, self.current_prefix, self.manifest, self.cube, self.manifest_dir = state
+
+    def write_timestep(self, forecast_time, dataset, slot=0):
+        """
+        Write one member's forecast timestep into the open datacube and mark it complete in the
+        manifest, with a checksum of the stored values.
+        """
+        forecast_str = forecast_time.strftime("%Y%m%d%H")
+        encoded = manifest.encode(dataset, manifest.get_encoding(self.manifest))
+        self.cube[slot, self.manifest["times"].index(forecast_str)] = encoded
+        self.cube.flush()
+        self.manifest.setdefault("checksums", {})[f"{forecast_str}_{slot}"] = zlib.crc32(np.ascontiguousarray(encoded))
+        if forecast_str not in self.manifest["complete"]:
+            self.manifest["complete"].append(forecast_str)
+        manifest.save_manifest(self.manifest_dir, self.manifest["cycle"], self.manifest)
+        logger.info(f"Saved processed data for {forecast_str} to datacube slot {slot}")
+
+    def publish(self):
+        """
+        Publish the staged cycle: move the cube, then its manifest, into the data directory
+        and finally point whichgefs at the cycle. Each step is an atomic rename, so servers
+        only ever see the previous cycle or the complete new one.
+        """
+        cycle = self.manifest["cycle"]
+        self.cube.flush()
+        self.cube = None
+        os.replace(os.path.join(self.staging_dir, self.manifest["cube"]),
+                   os.path.join(self.data_dir, self.manifest["cube"]))
+        os.replace(manifest.manifest_path(self.staging_dir, cycle), manifest.manifest_path(self.data_dir, cycle))
+        self.update_which_gefs()
+        logger.info(f"Published cycle {cycle} with {len(self.manifest['complete'])}/{len(self.manifest['times'])} hours")
+
     def cleanup_old_files(self):
-        """Remove files older than 384 hours (16 days)."""
+        """Remove files older than 384 hours (16 days), and staged files of other cycles."""
         try:
             current_time = datetime.utcnow()
+            current_cycle = self.base_time.strftime("%Y%m%d%H")
+            for filename in os.listdir(self.staging_dir):
+                if not filename.startswith(current_cycle):
+                    os.remove(os.path.join(self.staging_dir, filename))
+                    logger.info(f"Removed stale staged file: {filename}")
             for filename in os.listdir(self.data_dir):
-                if filename.endswith('.npy'):
+                if filename.endswith('.npy') or filename.endswith('_manifest.json'):
                     file_time = datetime.strptime(filename.split('_')[0], "%Y%m%d%H")
                     if (current_time - file_time).total_seconds() > 384 * 3600:
                         os.remove(os.path.join(self.data_dir, filename))
@@ -193,52 +510,131 @@ class GEFSDownloader:
         except Exception as e:
             logger.error(f"Failed to cleanup old files: {str(e)}")
 
+    def process_forecast_hours(self, forecast_hours):
+        """
+        Download, decode and write forecast hours as an overlapping pipeline: S3 transfers
+        run in a thread pool, GRIB decoding in a process pool, and each decoded hour is
+        written to the datacube as soon as it is ready. Returns the number of hours written.
+        """
+        success_count = 0
+        stage_totals = {'download': 0.0, 'decode': 0.0, 'write': 0.0}
+        start = time.time()
+
+        # Decoders are spawned rather than forked: download threads and log handlers may hold locks
+        with ThreadPoolExecutor(self.download_workers) as downloads, \
+                ProcessPoolExecutor(self.decode_workers, mp_context=multiprocessing.get_context('spawn')) as decoders:
+            stages = {}
+            for hour in forecast_hours:
+                forecast_time = self.base_time + timedelta(hours=hour)
+                stages[downloads.submit(self.timed_download, forecast_time)] = ('download', hour, None)
+            pending = set(stages)
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, hour, grib_file = stages.pop(future)
+                    forecast_time = self.base_time + timedelta(hours=hour)
+                    try:
+                        if stage == 'download':
+                            grib_file, seconds = future.result()
+                            stage_totals['download'] += seconds
+                            logger.info(f"Forecast hour {hour}: download {seconds:.1f}s")
+                            if grib_file is None:
+                                logger.error(f"Failed to download file for forecast hour {hour}")
+                                continue
+                            decode = decoders.submit(timed_decode, grib_file)
+                            stages[decode] = ('decode', hour, grib_file)
+                            pending.add(decode)
+                        else:
+                            dataset, seconds = future.result()
+                            stage_totals['decode'] += seconds
+                            if not valid_dataset(dataset):
+                                logger.error(f"Forecast hour {hour} has missing or invalid levels; not saving it")
+                                continue
+                            write_start = time.time()
+                            self.write_timestep(forecast_time, dataset)
+                            stage_totals['write'] += time.time() - write_start
+                            logger.info(f"Forecast hour {hour}: decode {seconds:.1f}s, write {time.time() - write_start:.1f}s")
+                            success_count += 1
+                    except Exception as e:
+                        logger.error(f"Failed to process forecast hour {hour}: {str(e)}")
+                    finally:
+                        if stage == 'decode' and os.path.exists(grib_file):
+                            # Cleanup temporary grib file
+                            os.remove(grib_file)
+
+        logger.info(f"Pipeline finished {success_count}/{len(forecast_hours)} hours in {time.time() - start:.1f}s; "
+                    f"stage totals: download {stage_totals['download']:.1f}s, decode {stage_totals['decode']:.1f}s, "
+                    f"write {stage_totals['write']:.1f}s "
+                    f"({self.download_workers} download threads, {self.decode_workers} decode processes)")
+        return success_count
+
+    def write_hours(self, forecast_hours):
+        """Write forecast hours into the open cube, marked as in progress until they are flushed."""
+        # The marker outlives an interrupted run, so the next one verifies what was written
+        with open(self.write_marker(), 'w'):
+            pass
+        self.process_forecast_hours(forecast_hours)
+        self.cube.flush()
+        os.remove(self.write_marker())
+
+    def timed_download(self, forecast_time):
+        """download_geavg for the transfer pool; returns (grib file or None, seconds spent)."""
+        start = time.time()
+        return self.download_geavg(forecast_time), time.time() - start
+
     def run(self):
-        """Main execution method."""
+        """
+        Sync the latest cycle: write the forecast hours that are on S3 but not yet in its
+        datacube, resuming a staged or published cube of the same cycle. A new cycle is
+        published once hours 0 through PUBLISH_HOURS are written. In ON_DEMAND mode later
+        hours are only written once the server requests them, including those of the cycle
+        still being served while a newer one is staged. Returns False on failure.
+        """
         try:
-            logger.info("Starting GEFS download process")
-            self.update_status("Data refreshing. Sims may be slower than usual.")
-            
             cycle = self.find_latest_cycle()
             if cycle is None:
                 logger.error("No available GEFS cycles found")
-                self.update_status("Error: No GEFS cycles available")
                 return False
 
-            success_count = 0
-            forecast_hours = list(range(0, 25, 6))  # 0 to 24 hours in 6-hour steps
-            
-            logger.info(f"Downloading GEFS files for cycle {cycle}")
-            
-            for hour in forecast_hours:
-                forecast_time = cycle + timedelta(hours=hour)
-                grib_file = self.download_geavg(forecast_time)
-                
-                if grib_file:
-                    if self.grib_to_array(grib_file, forecast_time):
-                        success_count += 1
-                    # Cleanup temporary grib file
-                    os.remove(grib_file)
-                else:
-                    logger.error(f"Failed to download file for forecast hour {hour}")
+            forecast_hours = list(range(0, self.max_forecast_hour + 1, 6))
+            published = self.open_published(forecast_hours)
+            if not published:
+                self.open_cube(forecast_hours)
+            pending = self.pending_hours(forecast_hours)
+            if ON_DEMAND:
+                self.remove_requests(forecast_hours)
+            if not pending:
+                logger.info(f"Cycle {cycle} is complete")
+                return True
+
+            available = self.list_available_hours()
+            todo = [hour for hour in pending if hour in available]
+            if ON_DEMAND:
+                todo = self.requested_hours(forecast_hours, todo)
+            logger.info(f"Cycle {cycle}: {len(forecast_hours) - len(pending)}/{len(forecast_hours)} hours written, "
+                        f"{len(todo)} more to write")
+            if todo:
+                self.write_hours(todo)
+            if ON_DEMAND:
+                self.remove_requests(forecast_hours)
+                if not published:
+                    self.write_served_requests(forecast_hours)
 
-            if success_count > 0:
-                logger.info(f"Successfully processed {success_count}/{len(forecast_hours)} files")
-                self.update_which_gefs()
+            publish_hours = [hour for hour in forecast_hours if hour <= PUBLISH_HOURS]
+            if not published and not self.pending_hours(publish_hours):
+                self.publish()
                 self.cleanup_old_files()
                 self.update_status("Ready")
-                return True
-            else:
-                logger.error("No files successfully processed")
-                self.update_status("Error: No files processed")
-                return False
+            return True
 
         except Exception as e:
             logger.error(f"Error in download process: {str(e)}")
             self.update_status(f"Error: {str(e)}")
             return False
         finally:
-            # Cleanup temp directory
+            self.cube = None
+            # Leftover GRIB files are partial downloads
             shutil.rmtree(self.temp_dir)
             os.makedirs(self.temp_dir, exist_ok=True)
 
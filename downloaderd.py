@@ -5,6 +5,9 @@ from datetime import datetime, timedelta
 import logging
 import subprocess
 from pathlib import Path
+import config
+import ingest
+import manifest
 
 # Configure logging
 logging.basicConfig(
@@ -22,11 +25,17 @@ mount = True
 path = "/gefs/gefs/" if mount else "./gefs/"
 whichpath = '/gefs/whichgefs' if mount else 'whichgefs'
 statuspath = '/gefs/serverstatus' if mount else 'serverstatus'
+queuepath = config.INGEST_QUEUE_DIR
 refresh_interval = 300  # 5 minutes
+queue_interval = 2  # How often to check for on-demand ingest requests while waiting (seconds)
 
 def update_status(message):
-    """Update the HABSIM status file."""
+    """Update the HABSIM status file, if the message has changed."""
     try:
+        if os.path.exists(statuspath):
+            with open(statuspath) as f:
+                if f.read() == message:
+                    return
         with open(statuspath, "w") as f:
             f.write(message)
     except Exception as e:
@@ -48,14 +57,32 @@ def get_current_cycle():
 def validate_data(timestamp):
     """Check if data files exist and are valid for a given timestamp."""
     base_name = timestamp.strftime("%Y%m%d%H")
+    cycle_manifest = manifest.load_manifest(path, base_name)
     # Check a few key forecast hours
     for hour in [0, 6, 12]:
         forecast = timestamp + timedelta(hours=hour)
-        file_path = Path(path) / f"{base_name}_{forecast.strftime('%Y%m%d%H')}_01.npy"
+        if cycle_manifest is None:
+            file_name = f"{base_name}_{forecast.strftime('%Y%m%d%H')}_01.npy"
+        elif not manifest.has_forecast(cycle_manifest, forecast.strftime('%Y%m%d%H')):
+            return False
+        elif cycle_manifest.get("cube"):
+            file_name = cycle_manifest["cube"]
+        else:
+            file_name = manifest.get_member_file(cycle_manifest, forecast.strftime('%Y%m%d%H'), 1)
+        file_path = Path(path) / file_name
         if not file_path.exists() or file_path.stat().st_size < 1000:
             return False
     return True
 
+def wait_for_requests(seen):
+    """
+    Wait up to refresh_interval, returning early once the server queues an on-demand ingest
+    request not in seen.
+    """
+    deadline = time.time() + refresh_interval
+    while time.time() < deadline and not set(ingest.pending(queuepath)) - seen:
+        time.sleep(queue_interval)
+
 def run_downloader():
     """Run the downloader script and handle errors."""
     try:
@@ -94,13 +121,14 @@ def main():
             else:
                 logger.warning("No current cycle found")
 
-            # Run downloader
-            update_status("Data refreshing. Sims may be slower than usual.")
+            # Run downloader; it only fetches forecast hours missing from the cycle's manifest,
+            # so this is cheap when nothing new has been published
+            seen = set(ingest.pending(queuepath))
             if run_downloader():
                 # Verify new data
                 new_cycle = get_current_cycle()
                 if new_cycle and validate_data(new_cycle):
-                    logger.info(f"Successfully downloaded and verified data for {new_cycle}")
+                    logger.info(f"Verified data for {new_cycle}")
                     update_status("Ready")
                 else:
                     logger.error("Data validation failed")
@@ -109,9 +137,9 @@ def main():
                 logger.error("Download process failed")
                 update_status("Error: Download failed")
 
-            # Wait before next check
+            # Wait before next check, or until the server requests forecast hours the last run did not see
             logger.info(f"Waiting {refresh_interval} seconds before next check")
-            time.sleep(refresh_interval)
+            wait_for_requests(seen)
 
         except KeyboardInterrupt:
             logger.info("Received shutdown signal")
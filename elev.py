@@ -1,34 +1,230 @@
-import numpy as np
-import math
+"""
+Elevation lookups on a global grid of `resolution` points per degree, row 0 at the north pole.
+
+Elevations are read from a tiled store (ELEVATION_TILES_DIR, written by convert_elev.py) whose
+compressed tiles are loaded on demand into a bounded cache, or else from a memory-mapped
+ELEVATION_FILE. With neither, every elevation is 0. Longitudes wrap; points beyond the poles
+are 0. Negative elevations (below sea level) are reported as 0.
+"""
+import json
 import os
-from config import ELEVATION_FILE
+import logging
+import zlib
+import numpy as np
+import cache
+from config import ELEVATION_FILE, ELEVATION_TILES_DIR, ELEVATION_CACHE_BYTES, ELEVATION_PYRAMID_BLOCKS
 
 resolution = 120  # points per degree
+logger = logging.getLogger(__name__)
+
+class TileStore:
+    """
+    Tiled elevation grid: index.json (grid and tile shape, dtype), offsets.npy (byte offset
+    and length of each tile, by tile row and column) and tiles.bin (zlib-compressed tiles).
+    """
+    def __init__(self, directory, max_bytes=ELEVATION_CACHE_BYTES):
+        with open(os.path.join(directory, 'index.json')) as f:
+            index = json.load(f)
+        self.shape = tuple(index['shape'])
+        self.tile = index['tile']
+        self.dtype = np.dtype(index['dtype'])
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        self.fd = os.open(os.path.join(directory, 'tiles.bin'), os.O_RDONLY)
+        self.tiles = cache.LRUCache(max_bytes=max_bytes)
+        self.last = (None, None, None)  # Most recent (tile row, tile column, tile) of lookup_one
+
+    def get_tile(self, ty, tx):
+        return self.tiles.get_or_load((ty, tx), lambda: self.load_tile(ty, tx))
+
+    def load_tile(self, ty, tx):
+        offset, length = self.offsets[ty, tx]
+        rows = min(self.tile, self.shape[0] - ty * self.tile)
+        cols = min(self.tile, self.shape[1] - tx * self.tile)
+        blob = os.pread(self.fd, int(length), int(offset))
+        return np.frombuffer(zlib.decompress(blob), dtype=self.dtype).reshape(rows, cols)
+
+    def lookup(self, y, x):
+        """Values at integer row and column arrays, grouped into one gather per tile."""
+        result = np.empty(y.shape)
+        ty, tx = y // self.tile, x // self.tile
+        tile_ids = ty * self.offsets.shape[1] + tx
+        for tile_id in np.unique(tile_ids):
+            sel = tile_ids == tile_id
+            t_y, t_x = divmod(int(tile_id), self.offsets.shape[1])
+            result[sel] = self.get_tile(t_y, t_x)[y[sel] - t_y * self.tile, x[sel] - t_x * self.tile]
+        return result
+
+    def region_max(self, y0, y1, x0, x1):
+        """Max over rows y0:y1 and columns x0:x1, which must lie within one tile."""
+        ty, tx = y0 // self.tile, x0 // self.tile
+        return self.get_tile(ty, tx)[y0 - ty * self.tile:y1 - ty * self.tile, x0 - tx * self.tile:x1 - tx * self.tile].max()
+
+    def lookup_one(self, y, x):
+        ty, tx = y // self.tile, x // self.tile
+        last_y, last_x, tile = self.last
+        if ty != last_y or tx != last_x:
+            tile = self.get_tile(ty, tx)
+            self.last = (ty, tx, tile)
+        return tile[y - ty * self.tile, x - tx * self.tile]
+
+class ArrayStore:
+    """A whole elevation grid as one (memory-mapped) array."""
+    def __init__(self, data):
+        self.shape = data.shape
+        self.data = data
+
+    def lookup(self, y, x):
+        return self.data[y, x]
+
+    def region_max(self, y0, y1, x0, x1):
+        return self.data[y0:y1, x0:x1].max()
+
+    def lookup_one(self, y, x):
+        return self.data[y, x]
+
+class EmptyStore:
+    shape = (180 * resolution, 360 * resolution)
+
+    def lookup(self, y, x):
+        return np.zeros(y.shape)
+
+    def region_max(self, y0, y1, x0, x1):
+        return 0
+
+    def lookup_one(self, y, x):
+        return 0
+
+class MaxPyramid:
+    """
+    Max elevation over square blocks of the grid at several block sizes (ELEVATION_PYRAMID_BLOCKS).
+    Levels are read from max_{block}.npy files written by convert_elev.py when present,
+    and otherwise filled in block by block on first use (NaN marks blocks not yet computed).
+    Maxima are floored at 0, like the elevations getElevation reports.
+    """
+    def __init__(self, store, directory=None):
+        self.store = store
+        self.levels = []
+        for block in ELEVATION_PYRAMID_BLOCKS:
+            filename = None if directory is None else os.path.join(directory, f'max_{block}.npy')
+            if filename is not None and os.path.exists(filename):
+                level = np.maximum(np.load(filename), 0).astype(np.float32)
+            else:
+                level = np.full((-(-store.shape[0] // block), -(-store.shape[1] // block)), np.nan, dtype=np.float32)
+            self.levels.append((block, level))
+
+    def block_max(self, level, by, bx, block):
+        value = level.item(by, bx)
+        if value != value:  # NaN: not computed yet
+            value = level[by, bx] = max(0, self.store.region_max(by * block, (by + 1) * block, bx * block, (bx + 1) * block))
+        return value
+
+    def clear(self, y, x, alt):
+        """Whether alt is above every elevation in some pyramid block containing grid point (y, x)."""
+        for block, level in self.levels:
+            if alt >= self.block_max(level, y // block, x // block, block):
+                return True
+        return False
+
+    def clear_batch(self, y, x, alts):
+        clear = np.zeros(y.shape, dtype=bool)
+        for block, level in self.levels:
+            todo = np.flatnonzero(~clear)
+            if len(todo) == 0:
+                break
+            by, bx = y[todo] // block, x[todo] // block
+            values = level[by, bx]
+            for i in np.flatnonzero(np.isnan(values)):
+                values[i] = self.block_max(level, by[i], bx[i], block)
+            clear[todo] = alts[todo] >= values
+        return clear
+
+def open_store():
+    if os.path.exists(os.path.join(ELEVATION_TILES_DIR, 'index.json')):
+        try:
+            store = TileStore(ELEVATION_TILES_DIR)
+            logger.info("Loaded elevation tiles from %s", ELEVATION_TILES_DIR)
+            return store
+        except Exception as e:
+            logger.error("Error loading elevation tiles: %s", e)
+    try:
+        store = ArrayStore(np.load(ELEVATION_FILE, 'r'))
+        logger.info("Loaded elevation data from %s", ELEVATION_FILE)
+        return store
+    except FileNotFoundError:
+        logger.warning("Could not find elevation data %s or %s; elevations will be 0", ELEVATION_TILES_DIR, ELEVATION_FILE)
+    except Exception as e:
+        logger.error("Error loading elevation data: %s", e)
+    return EmptyStore()
 
-# Load elevation data with error handling
-try:
-    data = np.load(ELEVATION_FILE, 'r')
-    print(f"Successfully loaded elevation data from {ELEVATION_FILE}")
-except FileNotFoundError:
-    print(f"Warning: Could not find elevation file {ELEVATION_FILE}")
-    # Create a small empty dataset as fallback
-    data = np.zeros((180 * resolution, 360 * resolution))
-except Exception as e:
-    print(f"Error loading elevation data: {str(e)}")
-    data = np.zeros((180 * resolution, 360 * resolution))
+store = open_store()
+rows, cols = store.shape
+pyramid = MaxPyramid(store, ELEVATION_TILES_DIR if isinstance(store, TileStore) else None)
+
+def grid_index(lat, lon):
+    """Row and column of the grid point nearest (lat, lon), for lat within [-90, 90]."""
+    x = int(round(((lon + 180) % 360) * resolution)) % cols
+    y = min(max(int(round((90 - lat) * resolution)) - 1, 0), rows - 1)
+    return y, x
 
 def getElevation(lat, lon):
     """
     Get elevation for a given latitude and longitude.
     Returns elevation in meters, or 0 if coordinates are invalid.
     """
-    try:
-        x = int(round((lon + 180) * resolution))
-        y = int(round((90 - lat) * resolution)) - 1
-        return max(0, data[y, x])
-    except IndexError:
-        print(f"Warning: Coordinates out of range - lat: {lat}, lon: {lon}")
+    if not -90 <= lat <= 90:
+        logger.debug("Coordinates out of range - lat: %s, lon: %s", lat, lon)
         return 0
+    y, x = grid_index(lat, lon)
+    try:
+        return max(0, store.lookup_one(y, x))
     except Exception as e:
-        print(f"Error getting elevation: {str(e)}")
+        logger.error("Error getting elevation: %s", e)
         return 0
+
+def getElevation_batch(lats, lons, interpolate=False):
+    """
+    Vectorized getElevation for arrays of latitudes and longitudes. With interpolate,
+    elevations are bilinearly interpolated between grid points instead of taken from
+    the nearest one.
+    """
+    lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+    valid = (lats >= -90) & (lats <= 90)
+    result = np.zeros(lats.shape)
+    fx = ((lons[valid] + 180) % 360) * resolution
+    fy = (90 - lats[valid]) * resolution - 1
+    if not interpolate:
+        x = np.rint(fx).astype(int) % cols
+        y = np.clip(np.rint(fy).astype(int), 0, rows - 1)
+        result[valid] = store.lookup(y, x)
+    else:
+        x0 = np.floor(fx).astype(int)
+        y0 = np.clip(np.floor(fy).astype(int), 0, rows - 1)
+        wx = fx - x0
+        wy = np.clip(fy - y0, 0, 1)
+        x0, x1 = x0 % cols, (x0 + 1) % cols
+        y1 = np.minimum(y0 + 1, rows - 1)
+        top = store.lookup(y0, x0) * (1 - wx) + store.lookup(y0, x1) * wx
+        bottom = store.lookup(y1, x0) * (1 - wx) + store.lookup(y1, x1) * wx
+        result[valid] = top * (1 - wy) + bottom * wy
+    return np.maximum(result, 0)
+
+def below_ground(lat, lon, alt):
+    """
+    getElevation(lat, lon) > alt, skipping the elevation lookup when the max-elevation
+    pyramid shows alt is above all terrain around the point. Returns (below, looked_up).
+    """
+    if -90 <= lat <= 90 and pyramid.clear(*grid_index(lat, lon), alt):
+        return False, False
+    return getElevation(lat, lon) > alt, True
+
+def below_ground_batch(lats, lons, alts):
+    """Vectorized below_ground; returns (below, looked_up) boolean arrays."""
+    lats, lons, alts = np.broadcast_arrays(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float), np.asarray(alts, dtype=float))
+    valid = np.flatnonzero((lats >= -90) & (lats <= 90))
+    x = np.rint(((lons[valid] + 180) % 360) * resolution).astype(int) % cols
+    y = np.clip(np.rint((90 - lats[valid]) * resolution).astype(int) - 1, 0, rows - 1)
+    looked_up = np.ones(lats.shape, dtype=bool)
+    looked_up[valid[pyramid.clear_batch(y, x, alts[valid])]] = False
+    below = np.zeros(lats.shape, dtype=bool)
+    below[looked_up] = getElevation_batch(lats[looked_up], lons[looked_up]) > alts[looked_up]
+    return below, looked_up
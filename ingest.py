@@ -0,0 +1,44 @@
+"""
+Queue of on-demand ingest requests, shared by the server and the downloader through a directory.
+
+A request for one forecast time (YYYYMMDDHH) of a cycle is an empty file named
+{cycle}_{time}_{priority}. Priority 0 marks data a simulation is waiting on; higher
+priorities are times fetched ahead of demand. The downloader writes requested times
+in (priority, time) order and removes the requests it has satisfied.
+"""
+import os
+
+def request(queue_dir, cycle, forecast, priority):
+    """Queue a forecast time of cycle at priority."""
+    os.makedirs(queue_dir, exist_ok=True)
+    with open(os.path.join(queue_dir, f"{cycle}_{forecast}_{priority}"), 'w'):
+        pass
+
+def pending(queue_dir):
+    """Queued requests as {(cycle, time): best priority}."""
+    try:
+        names = os.listdir(queue_dir)
+    except FileNotFoundError:
+        return {}
+    requests = {}
+    for name in names:
+        fields = name.split('_')
+        if len(fields) != 3 or not all(field.isdigit() for field in fields):
+            continue
+        key, priority = (fields[0], fields[1]), int(fields[2])
+        requests[key] = min(priority, requests.get(key, priority))
+    return requests
+
+def remove(queue_dir, cycle, forecast):
+    """Remove every request for a forecast time of cycle."""
+    prefix = f"{cycle}_{forecast}_"
+    try:
+        names = os.listdir(queue_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.startswith(prefix):
+            try:
+                os.remove(os.path.join(queue_dir, name))
+            except FileNotFoundError:
+                pass
@@ -4,6 +4,9 @@ var rawpathcache = [];
 var circleslist = [];
 var currpaths = new Array();
 var waypointsToggle = true;
+// Models whose forecast hours are still being downloaded come back as "pending"; they are retried this often, this many times
+var PENDING_RETRY_MS = 10000;
+var PENDING_RETRIES = 6;
 
 function initMap() {
     map = new google.maps.Map(document.getElementById('map'), {
@@ -242,19 +245,56 @@ async function simulate() {
 
     var onlyonce = true;
     if (checkNumPos(allValues) && checkasc(asc, alt, equil)) {
-        for (i = 1; i < 21; i++) {
-            var url2 = url + "&model=" + i;
-            console.log(url2);
-            await fetch(url2).then(res => res.json()).then(function(resjson) {
-                if (resjson === "error") {
-                    if (onlyonce) {
-                        alert("ERROR: Please make sure your entire flight is within the forecast window (Dec 31 - Jan 15).");
-                        onlyonce = false;
+        // All 20 models come back over one streamed response, one JSON line per model as it finishes
+        var streamurl = url.replace("?", "/stream?");
+        var models = null;  // All of them on the first request, then those still pending
+        for (var attempt = 0; ; attempt++) {
+            var pending = [];
+            var requesturl = models ? streamurl + "&models=" + models.join(",") : streamurl;
+            console.log(requesturl);
+            var reader = (await fetch(requesturl)).body.getReader();
+            var decoder = new TextDecoder();
+            var buffer = "";
+            while (true) {
+                const {done, value} = await reader.read();
+                if (value) {
+                    buffer += decoder.decode(value, {stream: true});
+                }
+                var lines = buffer.split("\n");
+                buffer = done ? "" : lines.pop();
+                for (const line of lines) {
+                    if (!line.trim()) {
+                        continue;
+                    }
+                    var result = JSON.parse(line);
+                    var resjson = result.path;
+                    if (resjson === "pending") {
+                        pending.push(result.model);
+                    } else if (resjson === "error") {
+                        if (onlyonce) {
+                            alert("ERROR: Please make sure your entire flight is within the forecast window (Dec 31 - Jan 15).");
+                            onlyonce = false;
+                        }
+                    } else {
+                        showpath(resjson);
                     }
-                } else {
-                    showpath(resjson);
                 }
-            });
+                if (done) {
+                    break;
+                }
+            }
+            if (pending.length === 0) {
+                break;
+            }
+            if (attempt === PENDING_RETRIES) {
+                alert("Forecast data for " + pending.length + " model(s) is still downloading. Please try again in a few minutes.");
+                break;
+            }
+            if (attempt === 0) {
+                console.log("Forecast data still downloading for models " + pending.join(",") + "; retrying");
+            }
+            models = pending;
+            await new Promise(resolve => setTimeout(resolve, PENDING_RETRY_MS));
         }
         onlyonce = true;
     }
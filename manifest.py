@@ -0,0 +1,84 @@
+"""
+Per-cycle manifest for the GEFS data directory.
+
+A cycle is stored in one of two layouts:
+
+- datacube: a single `{cycle}_cube.npy` array of shape
+  (member slot, time, component, level, lat, lon). The manifest records the
+  cube file ("cube"), its 6-hourly time axis ("times", YYYYMMDDHH), the member
+  slot of each model number ("members", "01".."20" -> slot), the forecast
+  times written so far ("complete"), a CRC32 of each written time and slot
+  ("checksums", "{time}_{slot}" -> crc) and how values are stored ("encoding").
+  Models with identical data share a slot.
+- files: one array per distinct member and forecast time. "files" maps each
+  forecast time and model number to the data file holding that member, and
+  identical members share a single file.
+
+Cube values are stored as float64, float32, or int16 holding
+round((value - offset) / scale). With the default WIND_SCALE the int16
+quantization error is at most WIND_SCALE / 2 = 0.005 m/s, well below the
+precision GEFS winds are packed at in GRIB.
+"""
+import json
+import os
+import numpy as np
+
+WIND_SCALE = 0.01  # m/s per int16 step
+
+def manifest_path(data_dir, cycle):
+    return os.path.join(data_dir, f"{cycle}_manifest.json")
+
+def new_manifest(cycle):
+    return {"cycle": cycle, "files": {}}
+
+def new_cube_manifest(cycle, cube, times, members, encoding):
+    return {"cycle": cycle, "cube": cube, "times": times, "members": members, "complete": [], "encoding": encoding}
+
+def new_encoding(dtype):
+    """Describe how arrays are stored: 'float64', 'float32' or scaled 'int16'."""
+    if dtype == 'int16':
+        return {"dtype": "int16", "scale": WIND_SCALE, "offset": 0.0}
+    return {"dtype": np.dtype(dtype).name}
+
+def get_encoding(manifest):
+    return manifest.get("encoding", {"dtype": "float64"})
+
+def encode(dataset, encoding):
+    """Convert a float array to its stored representation."""
+    if encoding["dtype"] == 'int16':
+        info = np.iinfo(np.int16)
+        quantized = np.rint((dataset - encoding["offset"]) / encoding["scale"])
+        return np.clip(quantized, info.min, info.max).astype(np.int16)
+    return dataset.astype(encoding["dtype"])
+
+def decode(stored, encoding):
+    """Convert stored values (any slice of a stored array) back to m/s."""
+    if encoding["dtype"] == 'int16':
+        return stored * encoding["scale"] + encoding["offset"]
+    return stored
+
+def load_manifest(data_dir, cycle):
+    """Load a cycle's manifest, or None if the cycle has none (legacy layout)."""
+    try:
+        with open(manifest_path(data_dir, cycle), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_manifest(data_dir, cycle, manifest):
+    """Write a cycle's manifest atomically so readers never see a partial file."""
+    path = manifest_path(data_dir, cycle)
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+def get_member_file(manifest, forecast, model):
+    """Return the file name holding (forecast, model), or None if it is not in the manifest."""
+    return manifest["files"].get(forecast, {}).get(str(model).zfill(2))
+
+def has_forecast(manifest, forecast):
+    """Check whether a forecast time (YYYYMMDDHH) has been written for the cycle."""
+    if manifest.get("cube"):
+        return forecast in manifest["complete"]
+    return forecast in manifest["files"]
@@ -0,0 +1,162 @@
+"""
+Process-wide counters, gauges and histograms, rendered in Prometheus text format by app.py's /metrics.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds
+TIME_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+registry = []
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        with self.lock:
+            return self.values.get(labels, 0)
+
+    def add(self, values):
+        """Add values drained from another process's counter."""
+        with self.lock:
+            for labels, value in values.items():
+                self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}" for key, value in values]
+
+class Gauge(Metric):
+    """
+    Value read at render time from fn(), which returns a number or a {label tuple: number} dict.
+    Pass kind="counter" for running totals kept elsewhere.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labels=(), kind=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        if kind is not None:
+            self.kind = kind
+
+    def samples(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+                for key, value in sorted(values.items()) if value is not None]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def add(self, values):
+        """Add values drained from another process's histogram with the same buckets."""
+        with self.lock:
+            for labels, counts in values.items():
+                current = self.values.setdefault(labels, [0] * (len(self.buckets) + 2))
+                for i, count in enumerate(counts):
+                    current[i] += count
+
+    def total(self, *labels):
+        """Sum of the values observed under labels."""
+        with self.lock:
+            counts = self.values.get(labels)
+            return counts[-1] if counts else 0
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, list(counts)) for key, counts in self.values.items())
+        lines = []
+        for key, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                le = format_labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{le} {total}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {total}")
+        return lines
+
+def drain():
+    """
+    Take the counter and histogram values recorded since the last drain, as {name: values},
+    leaving them empty. Worker processes hand these to the server, which add()s them to its own.
+    """
+    drained = {}
+    for metric in registry:
+        if isinstance(metric, (Counter, Histogram)):
+            with metric.lock:
+                values, metric.values = metric.values, {}
+            if values:
+                drained[metric.name] = values
+    return drained
+
+def merge(drained):
+    """Add values from another process's drain() to the metrics registered here."""
+    metrics = {metric.name: metric for metric in registry}
+    for name, values in drained.items():
+        if name in metrics:
+            metrics[name].add(values)
+
+def render():
+    """Render every registered metric in Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,130 @@
+"""
+Monte Carlo landing predictions: perturbed rise/coast/fall flights run through
+workers.simulate_ensemble, summarized as a landing density grid, percentiles
+and a confidence ellipse instead of full paths.
+"""
+import math
+from datetime import datetime
+import numpy as np
+import simulate
+import workers
+
+MAX_SAMPLES = 20000  # Flights per request, across all members
+MIN_RATE = 0.1  # m/s, floor for sampled ascent and descent rates
+CHI2_95 = 5.991  # 95% quantile of chi-squared with 2 degrees of freedom
+PERCENTILES = (5, 25, 50, 75, 95)
+
+def sample(rng, mean, sd, n, low=None):
+    """Draw n values from a normal distribution, clipped below at low."""
+    values = mean + sd * rng.standard_normal(n) if sd > 0 else np.full(n, float(mean))
+    return values if low is None else np.maximum(values, low)
+
+@simulate.pin_snapshot
+def run(timestamp, lat, lon, alt, equil, eqtime, asc, desc, models, samples, coeff=1,
+        equil_sd=0, eqtime_sd=0, asc_sd=0, desc_sd=0, coeff_sd=0, seed=None, step=240):
+    """
+    Run samples perturbed flights for each model. Burst/float altitude (equil), float time
+    in hrs (eqtime), ascent and descent rates and drift coefficient are drawn from normal
+    distributions with the given means and standard deviations.
+    Returns the (n, 8) landing points of every flight in simulate's point format, or "error"
+    if any could not be flown.
+    """
+    models = np.repeat(np.asarray(models, dtype=int), samples)
+    n = len(models)
+    if n > MAX_SAMPLES:
+        raise ValueError(f"At most {MAX_SAMPLES} flights per request")
+    rng = np.random.default_rng(seed)
+    equil = sample(rng, equil, equil_sd, n, low=alt)
+    eqtime = sample(rng, eqtime, eqtime_sd, n, low=0)
+    asc = sample(rng, asc, asc_sd, n, low=MIN_RATE)
+    desc = sample(rng, desc, desc_sd, n, low=MIN_RATE)
+    coeff = sample(rng, coeff, coeff_sd, n, low=0)
+    landings = fly(timestamp, lat, lon, alt, equil, eqtime, asc, desc, models, coeff, step)
+    if isinstance(landings, str) or np.isnan(landings[:, 0]).any():
+        return "error"
+    return landings
+
+def fly(timestamp, lat, lon, alt, equil, eqtime, asc, desc, models, coeff=1, step=240):
+    """
+    Rise/coast/fall flights for many members in three batched ensemble runs. Every argument
+    but step may be a scalar or a per-flight array matching models.
+    Returns the (n, 8) landing points in simulate's point format, or "error". Flights that
+    run out of wind data are NaN rows, and are not flown further.
+    """
+    models = np.atleast_1d(np.asarray(models, dtype=int))
+    if isinstance(timestamp, datetime):
+        timestamp = simulate.ensure_utc(timestamp).timestamp()
+    timestamp, lat, lon, alt, equil, eqtime, asc, desc, coeff = (
+        np.broadcast_to(np.asarray(x, dtype=float), models.shape).copy()
+        for x in (timestamp, lat, lon, alt, equil, eqtime, asc, desc, coeff))
+    landings = np.full((len(models), 8), np.nan)
+    flying = np.arange(len(models))
+    for stage in ('rise', 'coast', 'fall'):
+        i = flying
+        if stage == 'rise':
+            rate, hours, elevation = asc[i], (equil[i] - alt[i]) / asc[i] / 3600, False
+        elif stage == 'coast':
+            rate, hours, elevation = 0, eqtime[i], True
+        else:
+            rate, hours, elevation = -desc[i], alt[i] / desc[i] / 3600, True
+        points = workers.simulate_ensemble(timestamp[i], lat[i], lon[i], rate, step, hours, alt[i], models[i],
+                                           coefficient=coeff[i], elevation=elevation, final=True)
+        if isinstance(points, str):
+            return "error"
+        ok = ~np.isnan(points[:, 0])
+        flying, points = i[ok], points[ok]
+        timestamp[flying], lat[flying], lon[flying], alt[flying] = points[:, :4].T
+        if len(flying) == 0:
+            break
+    landings[flying] = points
+    return landings
+
+def wrap(lon):
+    """Longitude(s) in degrees wrapped to [-180, 180)."""
+    return (lon + 180) % 360 - 180
+
+def summarize(landings, res):
+    """
+    Summarize landing points: mean position, time and distance percentiles, a 95%
+    confidence ellipse and a density grid of res-degree cells. Longitudes are reported
+    within [-180, 180).
+    """
+    times, lats, lons = landings[:, 0], landings[:, 1], landings[:, 2]
+    # Unwrap longitudes around the first landing so a cluster across the antimeridian stays together
+    lons = (lons - lons[0] + 180) % 360 - 180 + lons[0]
+    mean_lat, mean_lon = lats.mean(), lons.mean()
+
+    # Local east/north offsets in meters from the mean landing point
+    north = np.radians(lats - mean_lat) * simulate.EARTH_RADIUS
+    east = np.radians(lons - mean_lon) * simulate.EARTH_RADIUS * math.cos(math.radians(mean_lat))
+    distance = np.hypot(north, east)
+
+    if len(landings) > 2:
+        eigenvalues, eigenvectors = np.linalg.eigh(np.cov(east, north))
+    else:
+        eigenvalues, eigenvectors = np.zeros(2), np.eye(2)
+    major = eigenvectors[:, 1]
+    ellipse = {
+        'semi_major': math.sqrt(max(eigenvalues[1], 0) * CHI2_95),
+        'semi_minor': math.sqrt(max(eigenvalues[0], 0) * CHI2_95),
+        'azimuth': math.degrees(math.atan2(major[0], major[1])) % 180,  # Major axis, degrees clockwise from north
+    }
+
+    lat_i = np.floor(lats / res).astype(int)
+    lon_i = np.floor(lons / res).astype(int)
+    cells, counts = np.unique(np.stack([lat_i, lon_i], axis=1), axis=0, return_counts=True)
+    density = [[(i + 0.5) * res, wrap((j + 0.5) * res), count / len(landings)] for (i, j), count in zip(cells.tolist(), counts.tolist())]
+
+    return {
+        'samples': len(landings),
+        'mean': [mean_lat, wrap(mean_lon)],
+        'percentiles': {
+            'p': list(PERCENTILES),
+            'lat': np.percentile(lats, PERCENTILES).tolist(),
+            'lon': wrap(np.percentile(lons, PERCENTILES)).tolist(),
+            'time': np.percentile(times, PERCENTILES).tolist(),
+            'distance': np.percentile(distance, PERCENTILES).tolist(),
+        },
+        'ellipse': ellipse,
+        'density': {'res': res, 'cells': density},
+    }
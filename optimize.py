@@ -0,0 +1,113 @@
+"""
+Launch optimizer: search launch time, ascent rate and float altitude and duration for flights
+that land nearest a target, by a coarse batched sweep of the parameter ranges followed by
+local refinement of the best candidates. Every evaluation runs all its candidate flights
+together through montecarlo.fly. The search flies one member; the final candidates are
+flown by every member to report their ensemble landing spread.
+"""
+import itertools
+import numpy as np
+import montecarlo
+import simulate
+import sweep
+
+PARAMS = ('launch', 'asc', 'equil', 'eqtime')  # Launch epoch seconds, ascent m/s, float altitude m, float hrs
+COARSE_POINTS = 6  # Grid points per searched parameter in the coarse sweep
+REFINE_ROUNDS = 8  # Pattern search rounds; each halves the step of candidates that did not improve
+SEEDS = 8  # Best distinct coarse points refined
+
+def miss_distances(landings, target):
+    """Distance in meters from each landing point to the target (lat, lon)."""
+    lats, lons = landings[:, 1], (landings[:, 2] - target[1] + 180) % 360 - 180 + target[1]
+    return np.hypot(*sweep.offsets(lats, lons, target[0], target[1]))
+
+def evaluate(candidates, site, desc, target, models, step):
+    """
+    Fly each (launch, asc, equil, eqtime) candidate for each model. Returns (landings,
+    misses) of shape (candidates, models, 8) and (candidates, models); flights that would
+    run past the forecast or into hours not yet written, or could not be flown, have infinite miss.
+    """
+    n, m = len(candidates), len(models)
+    landings = np.full((n, m, 8), np.nan)
+    misses = np.full((n, m), np.inf)
+    launch, asc, equil, eqtime = candidates.T
+    valid = np.flatnonzero(simulate.get_covered(launch, sweep.flight_end(launch, site[2], equil, eqtime, asc, desc, step)))
+    if len(valid) == 0:
+        return landings, misses
+    flights = np.repeat(valid, m)
+    result = montecarlo.fly(launch[flights], site[0], site[1], site[2], equil[flights], eqtime[flights], asc[flights],
+                            desc, np.tile(models, len(valid)), step=step)
+    if isinstance(result, str):
+        return landings, misses
+    landings[valid] = result.reshape(len(valid), m, 8)
+    misses[valid] = np.nan_to_num(miss_distances(result, target), nan=np.inf).reshape(len(valid), m)
+    return landings, misses
+
+def refine(seeds, steps, lows, highs, evaluate_one):
+    """
+    Pattern search from each seed: try a step up and down in every parameter, move to the
+    best neighbour if it is closer, otherwise halve the steps. All seeds' neighbours are
+    evaluated together each round. Returns the refined points and their misses.
+    """
+    points = seeds.copy()
+    steps = np.tile(steps, (len(points), 1))
+    misses = evaluate_one(points)
+    moves = np.concatenate([np.eye(len(PARAMS)), -np.eye(len(PARAMS))])
+    for __ in range(REFINE_ROUNDS):
+        neighbours = np.clip(points[:, None, :] + moves[None] * steps[:, None, :], lows, highs)
+        neighbour_misses = evaluate_one(neighbours.reshape(-1, len(PARAMS))).reshape(len(points), len(moves))
+        best = neighbour_misses.argmin(axis=1)
+        improved = neighbour_misses[np.arange(len(points)), best] < misses
+        points[improved] = neighbours[improved, best[improved]]
+        misses[improved] = neighbour_misses[improved, best[improved]]
+        steps[~improved] /= 2
+    return points, misses
+
+@simulate.pin_snapshot
+def run(site, target, ranges, desc, models, candidates=5, radius=5000, step=240):
+    """
+    Find launches from site (lat, lon, alt) landing nearest target (lat, lon). ranges maps each
+    of PARAMS to an inclusive (low, high) range; equal bounds fix a parameter. Returns up to
+    candidates results, nearest first, each with every model's landing point, the mean landing,
+    its miss distance (m), the 95th percentile spread (m) and the fraction of models landing
+    within radius meters of the target.
+    """
+    lows = np.array([float(ranges[name][0]) for name in PARAMS])
+    highs = np.array([float(ranges[name][1]) for name in PARAMS])
+    if (lows > highs).any() or lows[1] <= 0 or lows[2] < site[2] or lows[3] < 0:
+        raise ValueError("Invalid parameter ranges")
+    models = np.asarray(models, dtype=int)
+    search_model = models[:1]
+
+    def evaluate_one(points):
+        return evaluate(points, site, desc, target, search_model, step)[1][:, 0]
+
+    axes = [np.linspace(low, high, COARSE_POINTS) if high > low else np.array([low]) for low, high in zip(lows, highs)]
+    grid = np.array(list(itertools.product(*axes)))
+    coarse = evaluate_one(grid)
+    order = np.argsort(coarse)
+    seeds = grid[order[:SEEDS]][np.isfinite(coarse[order[:SEEDS]])]
+    if len(seeds) == 0:
+        return []
+    spacing = (highs - lows) / (COARSE_POINTS - 1)
+    points, misses = refine(seeds, spacing / 2, lows, highs, evaluate_one)
+
+    # Drop duplicates that converged to the same launch, then fly the best with every member
+    __, unique = np.unique(np.round(points, 3), axis=0, return_index=True)
+    best = unique[np.argsort(misses[unique])][:candidates]
+    landings, member_misses = evaluate(points[best], site, desc, target, models, step)
+    results = []
+    for point, flights, misses in zip(points[best], landings, member_misses):
+        if not np.isfinite(misses).all():
+            continue
+        summary = sweep.summarize_launch(point[0], site, flights)
+        mean = np.array([[0, summary['mean'][0], summary['mean'][1]]])
+        results.append({
+            **dict(zip(PARAMS, point.tolist())),
+            'landings': summary['landings'],
+            'mean': summary['mean'],
+            'miss': float(miss_distances(mean, target)[0]),
+            'spread': summary['spread'],
+            'hit_fraction': float((misses <= radius).mean()),
+        })
+    return sorted(results, key=lambda result: result['miss'])
@@ -0,0 +1,153 @@
+"""
+Compact encodings of simulated paths for API responses.
+
+A result is a path (a list of simulate's [time, lat, lon, alt, u, v, du, dv] points) or
+nested lists of paths, e.g. /spaceshot's 20 x [rise, coast, fall]. Paths can be
+decimated and reduced to selected fields, then encoded as:
+- json: the original list of points per path
+- columnar: JSON with one list per field per path
+- binary: a little-endian uint32 header length, a JSON header {"fields", "dtype", "shape"}
+  where shape mirrors the nesting with the point count of each path, then each path's
+  columns as consecutive float64 arrays
+- msgpack: the columnar structure in MessagePack, if the msgpack package is installed
+
+Wind fields (encode_grid) use the same json and binary framing; see /windfield.
+"""
+import heapq
+import json
+import struct
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FIELDS = ('time', 'lat', 'lon', 'alt', 'u', 'v', 'du', 'dv')
+FORMATS = ('json', 'columnar', 'binary', 'msgpack')
+GRID_FORMATS = ('json', 'binary')
+MIMETYPES = {'json': 'application/json', 'columnar': 'application/json',
+             'binary': 'application/octet-stream', 'msgpack': 'application/msgpack'}
+EARTH_RADIUS = 6.371e6
+
+def is_path(node):
+    """Whether node is a path rather than a list of paths; an empty list is an empty path."""
+    if len(node) == 0:
+        return True
+    return len(node[0]) > 0 and not isinstance(node[0][0], (list, tuple))
+
+def map_paths(result, fn):
+    """Apply fn to every path in a nested result, keeping the nesting."""
+    if is_path(result):
+        return fn(result)
+    return [map_paths(node, fn) for node in result]
+
+def map_paths_arrays(paths, fn):
+    """map_paths over nested path arrays, as returned by prepare()."""
+    if isinstance(paths, np.ndarray):
+        return fn(paths)
+    return [map_paths_arrays(node, fn) for node in paths]
+
+def parse_fields(fields):
+    """Column indices for a comma-separated field list (None for all fields)."""
+    if not fields:
+        return list(range(len(FIELDS)))
+    names = fields.split(',')
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return [FIELDS.index(name) for name in names]
+
+def to_meters(points):
+    """Local (north, east, up) coordinates in meters of (lat, lon, alt) rows, relative to the first."""
+    lat0 = np.radians(points[0, 0])
+    north = np.radians(points[:, 0] - points[0, 0]) * EARTH_RADIUS
+    east = np.radians(points[:, 1] - points[0, 1]) * EARTH_RADIUS * np.cos(lat0)
+    return np.column_stack((north, east, points[:, 2] - points[0, 2]))
+
+def segment_distances(xyz, start, end):
+    """Distances of xyz[start+1:end] from the segment xyz[start]-xyz[end]."""
+    a, b, p = xyz[start], xyz[end], xyz[start+1:end]
+    ab = b - a
+    length2 = ab @ ab
+    s = np.zeros(len(p)) if length2 == 0 else np.clip((p - a) @ ab / length2, 0, 1)
+    return np.linalg.norm(p - a - s[:, None] * ab, axis=1)
+
+def decimate(path, max_points=None, tolerance=None):
+    """
+    Douglas-Peucker simplification of an (n, 8) path array in 3D: keeps the endpoints,
+    then repeatedly the point farthest from the simplified path, until every dropped
+    point is within tolerance meters or max_points are kept.
+    """
+    n = len(path)
+    if n <= 2 or (max_points is None and tolerance is None):
+        return path
+    limit = n if max_points is None else max(2, max_points)
+    tolerance = 0 if tolerance is None else tolerance
+    xyz = to_meters(path[:, 1:4])
+    keep = [0, n - 1]
+    heap = []  # (-distance, index of the farthest point, segment start, segment end)
+
+    def split(start, end):
+        if end - start >= 2:
+            distances = segment_distances(xyz, start, end)
+            i = int(np.argmax(distances))
+            heapq.heappush(heap, (-distances[i], start + 1 + i, start, end))
+
+    split(0, n - 1)
+    while heap and len(keep) < limit and -heap[0][0] > tolerance:
+        __, i, start, end = heapq.heappop(heap)
+        keep.append(i)
+        split(start, i)
+        split(i, end)
+    return path[sorted(keep)]
+
+def prepare(result, fields=None, max_points=None, tolerance=None):
+    """Decimate each path and select fields; returns nested (n, len(fields)) arrays."""
+    columns = parse_fields(fields)
+
+    def prepare_path(path):
+        points = np.asarray(path, dtype=float).reshape(-1, len(FIELDS))
+        return decimate(points, max_points, tolerance)[:, columns]
+
+    return map_paths(result, prepare_path), [FIELDS[i] for i in columns]
+
+def columnar(paths, names):
+    return map_paths_arrays(paths, lambda points: {name: points[:, i].tolist() for i, name in enumerate(names)})
+
+def encode(result, format='json', fields=None, max_points=None, tolerance=None):
+    """Encode a nested path result; returns (bytes, mimetype)."""
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format: {format}")
+    paths, names = prepare(result, fields, max_points, tolerance)
+    if format == 'json':
+        body = json.dumps(map_paths_arrays(paths, lambda points: points.tolist()))
+    elif format == 'columnar':
+        body = json.dumps(columnar(paths, names))
+    elif format == 'msgpack':
+        if msgpack is None:
+            raise ValueError("msgpack format requires the msgpack package")
+        body = msgpack.packb(columnar(paths, names))
+    else:
+        arrays = []
+        shape = map_paths_arrays(paths, lambda points: arrays.append(points.T.astype('<f8').tobytes()) or len(points))
+        header = json.dumps({'fields': names, 'dtype': '<f8', 'shape': shape}).encode()
+        body = struct.pack('<I', len(header)) + header + b''.join(arrays)
+    return body.encode() if isinstance(body, str) else body, MIMETYPES[format]
+
+def encode_grid(lats, lons, grids, format='json'):
+    """
+    Encode named (len(lats), len(lons)) arrays; returns (bytes, mimetype). json is
+    {"lats", "lons", name: rows...}; binary is a header {"lats", "lons", "fields", "dtype",
+    "shape"} framed as for paths, then each field as a float32 array in row-major order.
+    """
+    if format not in GRID_FORMATS:
+        raise ValueError(f"Unknown format: {format}")
+    if format == 'json':
+        body = json.dumps({'lats': lats.tolist(), 'lons': lons.tolist(),
+                           **{name: grid.tolist() for name, grid in grids.items()}}).encode()
+    else:
+        header = json.dumps({'lats': lats.tolist(), 'lons': lons.tolist(), 'fields': list(grids),
+                             'dtype': '<f4', 'shape': [len(lats), len(lons)]}).encode()
+        body = struct.pack('<I', len(header)) + header + b''.join(grid.astype('<f4').tobytes() for grid in grids.values())
+    return body, MIMETYPES[format]
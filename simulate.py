@@ -1,11 +1,23 @@
 import os
+import mmap
 import numpy as np 
 import math
 import elev
 import bisect
 import time
+import functools
+import logging
+import itertools
+import threading
+import cache
+import ingest
+import manifest
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
-from config import GEFS_DIR, WHICH_GEFS_FILE, MOUNT_ENABLED
+from config import GEFS_DIR, WHICH_GEFS_FILE, MOUNT_ENABLED, DATA_CACHE_MAX_ENTRIES, DATA_CACHE_MAX_BYTES, DATA_PREFETCH, \
+    INGEST_ON_DEMAND, INGEST_QUEUE_DIR, INGEST_WAIT_SECONDS, INGEST_LOOKAHEAD
 
 EARTH_RADIUS = float(6.371e6)
 DATA_STEP = 6 # hrs
@@ -39,9 +51,296 @@ GEFS_ALT_DIFFS = [-4396, -2571, -3239, -2134, -2262, -2572, -1824, -1421, -1199,
        -1047,  -931,  -842,  -769,  -710,  -659,  -615,  -579,  -546, \
         -517,  -492,  -468,  -227,  -222,  -217,  -212]
 
-filecache = {}
 suffix = ".npy"
 currgefs = None  # Will be set by refresh()
+currsnapshot = None  # CycleSnapshot of currgefs
+refresh_listeners = []
+snapshot_versions = itertools.count()
+datacache = cache.LRUCache(DATA_CACHE_MAX_ENTRIES, DATA_CACHE_MAX_BYTES)  # (snapshot version, data key) -> array
+prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+PREFETCH_FRACTION = 0.25  # Prefetch the next timestep once within this fraction of DATA_STEP of it
+INGEST_POLL_SECONDS = 0.5  # Manifest polling interval while waiting for on-demand ingest
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = metrics.Histogram("habsim_stage_seconds", "Time spent in each stage of the prediction hot path.", ("stage",))
+SIMULATION_STEPS = metrics.Histogram("habsim_simulation_steps", "Integration steps per simulated flight.", ("kind",),
+                                     buckets=(10, 30, 100, 300, 1000, 3000, 10000, 30000))
+WIND_EVALUATIONS = metrics.Counter("habsim_wind_evaluations_total", "Wind field evaluations by single-flight integrators.",
+                                   ("method",))
+TERRAIN_CHECKS = metrics.Counter("habsim_terrain_checks_total",
+                                 "Ground checks, by whether the max-elevation pyramid let them skip the elevation lookup.",
+                                 ("lookup",))
+INGEST_WAITS = metrics.Counter("habsim_ingest_waits_total", "Lookups that waited for on-demand ingest, by outcome.", ("outcome",))
+for stat in ('entries', 'bytes'):
+    metrics.Gauge(f"habsim_data_cache_{stat}", f"GEFS data cache {stat}.", lambda stat=stat: cache_stats()[stat])
+metrics.Gauge("habsim_data_cache_events_total", "GEFS data cache hits, misses and evictions.",
+              lambda: {(event,): cache_stats()[event] for event in ('hits', 'misses', 'evictions')},
+              labels=("event",), kind="counter")
+pinned = threading.local()  # Snapshot pinned by the simulation running on this thread
+refreshlock = threading.Lock()
+
+class DataPending(Exception):
+    """Forecast data queued for on-demand ingest was not written within INGEST_WAIT_SECONDS."""
+
+class CycleSnapshot:
+    """
+    One published GEFS cycle: its id, manifest and open data handles.
+
+    A snapshot is built (and warmed) once and never switches cycles. Simulations pin
+    the snapshot current when they start (see use_snapshot) and keep using it even
+    after refresh() swaps in a newer one; a retired snapshot drops its data handles
+    when its last user releases it.
+    """
+    def __init__(self, cycle):
+        self.cycle = cycle
+        self.version = next(snapshot_versions)
+        self.datakeys = {}  # (timestamp, model) -> data key in datacache, shared by identical members
+        self.prefetched = set()
+        self.requested = {}  # Datacube time index -> (best priority queued for on-demand ingest, when to queue it again)
+        self.refcount = 0
+        self.retired = False
+        self.closed = False
+        self.lock = threading.Lock()
+        self.revision = manifest_revision(cycle)  # Taken before reading, so a later update is never missed
+        self.manifest = manifest.load_manifest(GEFS_DIR, cycle) or {}
+        self.cube = self.open_cube() if self.manifest.get("cube") else None
+
+    def open_cube(self):
+        """Map the cycle datacube and build its index."""
+        filename = os.path.join(GEFS_DIR, self.manifest["cube"])
+        try:
+            data = np.load(filename, "r")
+        except FileNotFoundError:
+            logger.warning("Datacube not found: %s", filename)
+            return None
+        times = self.manifest["times"]
+        slots = np.full(max(int(m) for m in self.manifest["members"]) + 1, -1)
+        for model, slot in self.manifest["members"].items():
+            slots[int(model)] = slot
+        return {
+            'data': data,
+            'encoding': manifest.get_encoding(self.manifest),
+            'start': ensure_utc(datetime.strptime(times[0], "%Y%m%d%H")).timestamp(),
+            'complete': np.isin(times, self.manifest["complete"]),
+            'slots': slots,
+        }
+
+    def update(self):
+        """
+        Pick up hours written since the snapshot was opened. The downloader writes into
+        the published datacube in place, so only the manifest is reread and the complete
+        mask extended. Returns False if the cycle has no datacube or its layout changed,
+        which needs a new snapshot.
+        """
+        cube = self.cube
+        revision = manifest_revision(self.cycle)
+        latest = manifest.load_manifest(GEFS_DIR, self.cycle) or {}
+        if cube is None or latest.get("cube") != self.manifest["cube"] or latest.get("times") != self.manifest["times"]:
+            return False
+        cube['complete'] = cube['complete'] | np.isin(latest["times"], latest.get("complete", []))
+        self.manifest, self.revision = latest, revision
+        return True
+
+    def warm(self):
+        """Open the cycle's data files and ask the kernel to read them ahead."""
+        if self.cube is not None:
+            prefault(self.cube['data'])
+            return
+        for members in self.manifest.get("files", {}).values():
+            for member_file in members.values():
+                key = ('file', os.path.join(GEFS_DIR, member_file))
+                data = datacache.get_or_load((self.version, key), lambda: self.load(key))
+                if data is not None:
+                    prefault(data)
+
+    def acquire(self):
+        """Register a user; fails if the snapshot has already been closed."""
+        with self.lock:
+            if self.closed:
+                return False
+            self.refcount += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.refcount -= 1
+            if self.retired and self.refcount == 0:
+                self.close()
+
+    def retire(self):
+        """Mark the snapshot as superseded; it closes once no simulation is using it."""
+        with self.lock:
+            self.retired = True
+            if self.refcount == 0:
+                self.close()
+
+    def close(self):
+        self.closed = True
+        self.datakeys = {}
+        self.cube = None
+        datacache.discard(lambda key: key[0] == self.version)
+
+    def valid_range(self):
+        """Get the timezone-aware (start, end) of the cycle's data."""
+        current_cycle = ensure_utc(datetime.strptime(self.cycle, "%Y%m%d%H"))
+        return current_cycle, current_cycle + timedelta(hours=384)
+
+    def covered(self, starts, ends):
+        """
+        Whether the cycle has the data for flights from epoch seconds starts to ends: within
+        the valid range and, for a datacube, within its time axis on hours already written.
+        Winds at a time are interpolated from the hours before and after it, so the hour
+        after ends must be written too. With INGEST_ON_DEMAND unwritten hours count, as
+        they are fetched when flown.
+        """
+        start, end = self.valid_range()
+        starts, ends = np.broadcast_arrays(np.asarray(starts, dtype=float), np.asarray(ends, dtype=float))
+        covered = (starts >= start.timestamp()) & (ends <= end.timestamp())
+        cube = self.cube
+        if cube is None:
+            return covered
+        complete = cube['complete']
+        first = np.floor((starts - cube['start']) / (DATA_STEP * 3600)).astype(int)
+        last = np.floor((ends - cube['start']) / (DATA_STEP * 3600)).astype(int) + 1
+        covered &= (first >= 0) & (last < len(complete))
+        if not INGEST_ON_DEMAND:
+            unwritten = np.concatenate(([0], np.cumsum(~complete)))
+            first, last = np.clip(first, 0, len(complete) - 1), np.clip(last, 0, len(complete) - 1)
+            covered &= unwritten[last + 1] == unwritten[first]
+        return covered
+
+    def get_file(self, timestamp, model):
+        key = self.datakeys.get((timestamp, model))
+        if key is None:
+            key = self.resolve(timestamp, model)
+            if key is None:
+                return None
+            self.datakeys[(timestamp, model)] = key
+        return datacache.get_or_load((self.version, key), lambda: self.load(key))
+
+    def resolve(self, timestamp, model):
+        """Find the data key holding (timestamp, model): a historical file, a datacube index, or a member file."""
+        name = timestamp.strftime("%Y%m%d%H")
+        base_date = name[:8]  # Gets YYYYMMDD part
+        logger.debug("Resolving data for base date %s, timestamp %s", base_date, name)
+        if timestamp.year < 2019:
+            return ('historical', os.path.join(GEFS_DIR, name + suffix))
+        if self.cube is not None:
+            index = self.get_cube_index(timestamp.timestamp(), model)
+            if index is None:
+                logger.debug("No datacube entry for %s, model %s", name, model)
+                return None
+            return ('cube',) + index
+        filename = self.get_member_filename(name, model)
+        if filename is None:
+            logger.debug("No manifest entry for %s, model %s", name, model)
+            return None
+        return ('file', filename)
+
+    def load(self, key):
+        """Load the array for a data key; None if its file is missing."""
+        with STAGE_SECONDS.time("file_load"):
+            return self.load_data(key)
+
+    def load_data(self, key):
+        if key[0] == 'cube':
+            # A zero-copy view unless the cube is quantized, in which case this decodes a copy
+            return manifest.decode(self.cube['data'][key[1:]], self.cube['encoding'])
+        logger.debug("Loading GEFS file %s", key[1])
+        try:
+            return np.load(key[1], "r")
+        except FileNotFoundError:
+            logger.warning("GEFS file not found: %s", key[1])
+            return None
+
+    def prefetch(self, timestamp, model):
+        """Page in the data for (timestamp, model) on the background prefetch thread, once per snapshot."""
+        if not DATA_PREFETCH or (timestamp, model) in self.prefetched:
+            return
+        self.prefetched.add((timestamp, model))
+        prefetcher.submit(self.touch, timestamp, model)
+
+    def touch(self, timestamp, model):
+        if self.closed:
+            return
+        if timestamp.year >= 2019 and self.cube is not None:
+            index = self.get_cube_index(timestamp.timestamp(), model, wait=False)
+            data = None if index is None else self.cube['data'][index]
+        else:
+            data = self.get_file(timestamp, model)
+        if data is not None:
+            touch_pages(data)
+
+    def get_member_filename(self, name, model):
+        """
+        Resolve a forecast time (YYYYMMDDHH) and model to a data file path through the
+        cycle manifest. Identical members resolve to the same file. Cycles without a
+        manifest use the legacy one-file-per-model layout.
+        """
+        if not self.manifest:
+            return os.path.join(GEFS_DIR, f"{self.cycle}_{name}_{str(model).zfill(2)}{suffix}")
+        member_file = manifest.get_member_file(self.manifest, name, model)
+        if member_file is None:
+            return None
+        return os.path.join(GEFS_DIR, member_file)
+
+    def get_cube_index(self, epoch, model, wait=True):
+        """
+        Return the (member slot, time index) of a written member in the datacube, or None.
+        A time not written yet is fetched on demand (see fetch).
+        """
+        tidx = int((epoch - self.cube['start']) // (DATA_STEP * 3600))
+        slots, complete = self.cube['slots'], self.cube['complete']
+        if not (0 <= model < len(slots) and 0 <= tidx < len(complete)):
+            return None
+        if slots[model] < 0 or not (complete[tidx] or self.fetch([tidx], wait)):
+            return None
+        return int(slots[model]), tidx
+
+    def fetch(self, tidxs, wait=True):
+        """
+        With INGEST_ON_DEMAND, queue the unwritten datacube time indices tidxs for the
+        downloader, followed by the INGEST_LOOKAHEAD times after them at a lower priority.
+        With wait, wait up to INGEST_WAIT_SECONDS for them to be written and raise
+        DataPending if they are not. Returns whether they are written.
+        """
+        cube = self.cube
+        if not INGEST_ON_DEMAND or cube is None:
+            return False
+        missing = sorted({int(t) for t in tidxs if not cube['complete'][t]})
+        if not missing:
+            return True
+        ahead = range(missing[-1] + 1, min(missing[-1] + 1 + INGEST_LOOKAHEAD, len(cube['complete'])))
+        times = self.manifest["times"]
+        now = time.monotonic()
+        for t, priority in [(t, 0 if wait else 1) for t in missing] + [(t, 1) for t in ahead if not cube['complete'][t]]:
+            # A request still unanswered after a full wait is queued again, in case the downloader dropped it
+            queued, expires = self.requested.get(t, (priority + 1, now))
+            if queued > priority or expires <= now:
+                self.requested[t] = (priority, now + INGEST_WAIT_SECONDS)
+                ingest.request(INGEST_QUEUE_DIR, self.cycle, times[t], priority)
+        if not wait:
+            return False
+
+        # The downloader writes into the published datacube in place, so only the manifest needs rereading
+        deadline = time.monotonic() + INGEST_WAIT_SECONDS
+        while not cube['complete'][missing].all():
+            if time.monotonic() >= deadline:
+                INGEST_WAITS.inc("pending")
+                raise DataPending(f"Forecast times {', '.join(times[t] for t in missing)} of cycle {self.cycle} are being fetched")
+            time.sleep(INGEST_POLL_SECONDS)
+            latest = manifest.load_manifest(GEFS_DIR, self.cycle) or {}
+            cube['complete'] = cube['complete'] | np.isin(times, latest.get("complete", []))
+        INGEST_WAITS.inc("ready")
+        return True
+
+def manifest_revision(cycle):
+    """Modification time of a cycle's manifest, which changes as the downloader fills in hours; None if it has none."""
+    try:
+        return os.stat(manifest.manifest_path(GEFS_DIR, cycle)).st_mtime_ns
+    except FileNotFoundError:
+        return None
 
 def ensure_utc(dt):
     """Ensure datetime object has UTC timezone."""
@@ -49,45 +348,121 @@ def ensure_utc(dt):
         return dt.replace(tzinfo=timezone.utc)
     return dt
 
+def get_snapshot():
+    """Get the snapshot pinned by the running simulation, or else the current one (None if no cycle)."""
+    snapshot = getattr(pinned, 'snapshot', None)
+    if snapshot is None:
+        if currsnapshot is None:
+            refresh()  # Try to load from file
+        snapshot = currsnapshot
+    return snapshot
+
+@contextmanager
+def use_snapshot():
+    """
+    Pin the current cycle snapshot to this thread for the duration of the block, so a
+    simulation reads one cycle from start to finish. Nested uses share the outer pin.
+    """
+    snapshot = getattr(pinned, 'snapshot', None)
+    if snapshot is not None:
+        yield snapshot
+        return
+    snapshot = get_snapshot()
+    while snapshot is not None and not snapshot.acquire():
+        snapshot = currsnapshot  # Retired and closed between lookup and acquire
+    pinned.snapshot = snapshot
+    try:
+        yield snapshot
+    finally:
+        pinned.snapshot = None
+        if snapshot is not None:
+            snapshot.release()
+
+def pin_snapshot(func):
+    """Decorator running func under use_snapshot()."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with use_snapshot():
+            return func(*args, **kwargs)
+    return wrapper
+
 def check_time_valid(simtime):
     """Check if simulation time is within valid data range."""
-    if not currgefs:
-        refresh()  # Try to load from file
-        if not currgefs:
-            return False
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return False
     
     # Make sure input time has timezone info
     simtime = ensure_utc(simtime)
-    
-    # Create timezone-aware current_cycle and end time
-    current_cycle = ensure_utc(datetime.strptime(currgefs, "%Y%m%d%H"))
-    valid_start = current_cycle
-    valid_end = current_cycle + timedelta(hours=384)
-    
-    print(f"DEBUG: Checking time validity:")
-    print(f"DEBUG: Input time: {simtime}")
-    print(f"DEBUG: Valid range: {valid_start} to {valid_end}")
-    print(f"DEBUG: Is valid: {valid_start <= simtime <= valid_end}")
-    
-    return valid_start <= simtime <= valid_end
+    valid_start, valid_end = snapshot.valid_range()
+    valid = valid_start <= simtime <= valid_end
+    if not valid:
+        logger.debug("Time %s outside valid range %s to %s", simtime, valid_start, valid_end)
+    return valid
+
+def get_valid_range():
+    """Get the timezone-aware (start, end) of the current cycle's data."""
+    return get_snapshot().valid_range()
+
+def get_covered(starts, ends):
+    """Whether the current cycle has the data for flights from epoch seconds starts to ends."""
+    return get_snapshot().covered(starts, ends)
 
 def refresh():
-    global currgefs
+    """
+    Check whichgefs for a newly published cycle, or the current cycle's manifest for
+    newly written hours. A snapshot of the new cycle is opened and warmed before it
+    replaces the current one; simulations still running on the old snapshot finish on it.
+    New hours of the current cycle are added to its snapshot in place. Returns whether
+    the current snapshot was replaced.
+    """
     try:
         with open(WHICH_GEFS_FILE, 'r') as f:
             s = f.readline().strip()
-        if s != currgefs:
-            reset()
-            currgefs = s
-            return True
-        return False
     except FileNotFoundError:
-        print(f"Warning: Could not open {WHICH_GEFS_FILE}")
+        logger.warning("Could not open %s", WHICH_GEFS_FILE)
+        return False
+    if not s:
         return False
+    if s == currgefs:
+        snapshot = currsnapshot
+        if snapshot is None or snapshot.revision == manifest_revision(s) or snapshot.update():
+            return False
+        return load_cycle(s, force=True)
+    return load_cycle(s)
+
+def load_cycle(cycle, force=False):
+    """
+    Open and warm a snapshot of cycle and make it current. Returns False if it already
+    was, unless force is set to reload it.
+    """
+    global currgefs, currsnapshot
+    with refreshlock:
+        if cycle == currgefs and not force:
+            return False
+        snapshot = CycleSnapshot(cycle)
+        snapshot.warm()
+        old, currsnapshot, currgefs = currsnapshot, snapshot, cycle
+    if old is not None:
+        old.retire()
+    for listener in refresh_listeners:
+        listener(cycle)
+    return True
+
+def on_refresh(listener):
+    """Register listener(cycle) to be called whenever refresh() switches to a new cycle."""
+    refresh_listeners.append(listener)
+    return listener
 
 def reset():
-    global filecache
-    filecache = {}
+    """Replace the current snapshot with a freshly opened one of the same cycle."""
+    global currsnapshot
+    with refreshlock:
+        if currgefs is None:
+            return
+        old, currsnapshot = currsnapshot, CycleSnapshot(currgefs)
+    if old is not None:
+        old.retire()
 
 def get_basetime(simtime):
     """Get base time with timezone consistency."""
@@ -95,38 +470,35 @@ def get_basetime(simtime):
     base = datetime(simtime.year, simtime.month, simtime.day, 
                    int(math.floor(simtime.hour / 6) * 6),
                    tzinfo=timezone.utc)
-    print(f"DEBUG: get_basetime input: {simtime}, output: {base}")
-    print(f"DEBUG: Current currgefs value: {currgefs}")
     return base
 
 def get_file(timestamp, model):
     """Get GEFS file with timezone-aware timestamp handling."""
     timestamp = ensure_utc(timestamp)
-    print(f"DEBUG: get_file attempt - timestamp: {timestamp}, model: {model}")
-    
-    if (timestamp, model) not in filecache.keys():
-        name = timestamp.strftime("%Y%m%d%H")
-        base_date = name[:8]  # Gets YYYYMMDD part
-        print(f"DEBUG: Trying to load file for base date: {base_date}, timestamp: {name}")
-        
-        if timestamp.year < 2019:
-            print(f"DEBUG: Loading historical file {name}")
-            try:
-                filecache[(timestamp, model)] = np.load(os.path.join(GEFS_DIR, name + suffix), "r")
-                print(f"DEBUG: Successfully loaded file {name}")
-            except FileNotFoundError:
-                print(f"DEBUG: Historical file not found")
-                return None
-        else:
-            filename = os.path.join(GEFS_DIR, f"{currgefs}_{name}_{str(model).zfill(2)}{suffix}")
-            print(f"DEBUG: Loading GEFS file {filename}")
-            try:
-                filecache[(timestamp, model)] = np.load(filename, "r")
-                print(f"DEBUG: Successfully loaded file {filename}")
-            except FileNotFoundError:
-                print(f"DEBUG: File not found: {filename}")
-                return None
-    return filecache[(timestamp,model)]
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    return snapshot.get_file(timestamp, model)
+
+def cache_stats():
+    """Get the GEFS data cache's size and hit/miss/eviction counters."""
+    return datacache.stats()
+
+def get_cube():
+    """Get the current cycle's datacube, or None if the cycle is stored as separate files."""
+    snapshot = get_snapshot()
+    return None if snapshot is None else snapshot.cube
+
+def touch_pages(data):
+    """Read one value per page of an array so its pages are resident."""
+    flat = np.asarray(data).reshape(-1)
+    flat[::max(1, mmap.PAGESIZE // flat.itemsize)].sum()
+
+def prefault(data):
+    """Ask the kernel to read a memory-mapped array ahead of use."""
+    mm = getattr(data, '_mmap', None)
+    if mm is not None and hasattr(mm, 'madvise'):
+        mm.madvise(mmap.MADV_WILLNEED)
 
 def get_wind_helper(lat_res, lon_res, level_res, time_res, model, diffs):
     lat_i, lat_f = lat_res
@@ -134,21 +506,34 @@ def get_wind_helper(lat_res, lon_res, level_res, time_res, model, diffs):
     level_i, level_f = level_res
     timestamp, time_f = time_res
     
-    data1 = get_file(timestamp, model)
-    if data1 is None:
-        return None, None, None, None
-        
-    data2 = get_file(timestamp + timedelta(hours=6), model)
-    if data2 is None:
-        return None, None, None, None
+    snapshot = get_snapshot()
+    if snapshot is not None and time_f < PREFETCH_FRACTION:
+        snapshot.prefetch(timestamp + timedelta(hours=2 * DATA_STEP), model)
+    if timestamp.year >= 2019 and snapshot is not None and snapshot.cube is not None:
+        # Both time neighbours come from one contiguous slice of the datacube
+        index1 = snapshot.get_cube_index(timestamp.timestamp(), model)
+        index2 = snapshot.get_cube_index(timestamp.timestamp() + DATA_STEP * 3600, model)
+        if index1 is None or index2 is None:
+            return None, None, None, None
+        slot, tidx = index1
+        cubes = snapshot.cube['data'][slot, tidx:tidx+2, :, level_i:level_i+2, lat_i:lat_i+2, lon_i:lon_i+2]
+        cube1, cube2 = manifest.decode(cubes, snapshot.cube['encoding'])
+    else:
+        data1 = get_file(timestamp, model)
+        if data1 is None:
+            return None, None, None, None
+            
+        data2 = get_file(timestamp + timedelta(hours=6), model)
+        if data2 is None:
+            return None, None, None, None
+
+        cube1 = data1[:,level_i:level_i+2,lat_i:lat_i+2, lon_i:lon_i+2]
+        cube2 = data2[:,level_i:level_i+2,lat_i:lat_i+2, lon_i:lon_i+2]
 
     pressure_filter = np.array([level_f, 1-level_f]).reshape(1,2)
     lat_filter = np.array([lat_f, 1-lat_f]).reshape(1,1,2,1)
     lon_filter = np.array([lon_f, 1-lon_f]).reshape(1,1,1,2)
     
-    cube1 = data1[:,level_i:level_i+2,lat_i:lat_i+2, lon_i:lon_i+2]
-    cube2 = data2[:,level_i:level_i+2,lat_i:lat_i+2, lon_i:lon_i+2]
-    
     line1 = np.sum(cube1 * lat_filter * lon_filter, axis=(2,3))
     line2 = np.sum(cube2 * lat_filter * lon_filter, axis=(2,3))
 
@@ -205,70 +590,560 @@ def lin_to_angular_velocities(lat, lon, u, v):
     dlon = math.degrees(u / (EARTH_RADIUS * math.cos(math.radians(lat))))
     return dlat, dlon
 
+@pin_snapshot
 def get_wind(simtime, lat, lon, alt, model, levels):
     simtime = ensure_utc(simtime)
     # First check if time is valid
     if not check_time_valid(simtime):
-        print(f"DEBUG: Time {simtime} outside valid range")
         return "error", "error", "error", "error"
 
     bounds = get_bounds_and_fractions(lat, lon, alt, simtime, levels)  
     diffs = GEFS_ALT_DIFFS if levels == GEFS else GFSHIST_ALT_DIFFS
-    u, v, du, dv = get_wind_helper(*bounds, model, diffs)
+    with STAGE_SECONDS.time("interpolation"):
+        u, v, du, dv = get_wind_helper(*bounds, model, diffs)
     if u is None:
         return "error", "error", "error", "error"
     return u, v, du, dv
 
-def simulate(simtime, lat, lon, rate, step, max_duration, alt, model, coefficient=1, elevation=True):
-    print(f"DEBUG: Starting simulation at time {simtime}")
+INTEGRATORS = ('euler', 'midpoint', 'rk4', 'adaptive')
+ADAPTIVE_TOLERANCE = 10  # m of estimated position error per adaptive step
+MIN_STEP, MAX_STEP = 1, 3600  # s, bounds on adaptive step sizes
+EVENT_ITERATIONS = 12  # Bisections locating a ground intersection within a step
+
+# Butcher tableaus (nodes, stage coefficients, weights, embedded weights for error control).
+# 'adaptive' is Bogacki-Shampine 3(2), whose last stage is the next step's first.
+TABLEAUS = {
+    'midpoint': ((0, 0.5), ((), (0.5,)), (0, 1), None),
+    'rk4': ((0, 0.5, 0.5, 1), ((), (0.5,), (0, 0.5), (0, 0, 1)), (1/6, 1/3, 1/3, 1/6), None),
+    'adaptive': ((0, 0.5, 0.75, 1), ((), (0.5,), (0, 0.75), (2/9, 1/3, 4/9)),
+                 (2/9, 1/3, 4/9, 0), (7/24, 1/4, 1/3, 1/8)),
+}
+
+@pin_snapshot
+def simulate(simtime, lat, lon, rate, step, max_duration, alt, model, coefficient=1, elevation=True,
+             method="euler", tolerance=ADAPTIVE_TOLERANCE):
+    """
+    Simulate a flight with constant vertical rate. method is one of INTEGRATORS:
+    'euler' takes fixed steps and stops at the first point past the end time or below
+    ground; 'midpoint' and 'rk4' take fixed steps and 'adaptive' sizes its steps
+    (starting from step) to keep the position error of each below tolerance meters.
+    These three end exactly at the end time or the ground intersection.
+    """
+    if method not in INTEGRATORS:
+        raise ValueError(f"Unknown integrator: {method}")
     simtime = ensure_utc(simtime)
-    base_time = get_basetime(datetime.strptime(currgefs, "%Y%m%d%H").replace(tzinfo=timezone.utc))
-    print(f"DEBUG: Base model time: {base_time}")
-    
+    if logger.isEnabledFor(logging.DEBUG):
+        snapshot = get_snapshot()
+        logger.debug("Starting simulation at %s on cycle %s", simtime, None if snapshot is None else snapshot.cycle)
+
     # Check simulation time range validity
     if not check_time_valid(simtime):
-        print(f"DEBUG: Start time {simtime} outside valid range")
         return "error"
 
     # Check if end time will be valid
     end = simtime + timedelta(hours=max_duration)
     if not check_time_valid(end):
-        print(f"DEBUG: End time {end} outside valid range")
         return "error"
-
-    print(f"DEBUG: Flight time: {simtime}")
-    print(f"DEBUG: Flight end time: {end}")
     
     levels = GFSHIST if simtime.year < 2019 else GEFS
-    path = list()
+    cell = CellCache(model, levels)
+    t, end = simtime.timestamp(), end.timestamp()
+    if method == "euler":
+        path = integrate_euler(cell, t, end, lat, lon, alt, rate, step, coefficient, elevation)
+    else:
+        path = integrate_rk(cell, TABLEAUS[method], t, end, (lat, lon, alt), rate, step, coefficient, elevation, tolerance)
+    if path == "error":
+        return "error"
     
+    STAGE_SECONDS.observe(cell.wind_elapsed, "interpolation")
+    WIND_EVALUATIONS.inc(method, amount=cell.evaluations)
+    if elevation:
+        STAGE_SECONDS.observe(cell.elev_elapsed, "elevation")
+        TERRAIN_CHECKS.inc("skipped", amount=cell.terrain_skips)
+        TERRAIN_CHECKS.inc("performed", amount=cell.terrain_lookups)
+    SIMULATION_STEPS.observe(len(path), "single")
+    return path
+
+def integrate_euler(cell, t, end, lat, lon, alt, rate, step, coefficient, elevation):
+    path = list()
     while True:
-        u, v, du, dv = get_wind(simtime, lat, lon, alt, model, levels)
-        if u == "error":
+        u, v, du, dv = cell.get_wind(t, lat, lon, alt)
+        if u is None:
             return "error"
             
-        path.append((simtime.timestamp(), lat, lon, alt, u, v, du, dv))
-        if simtime >= end or (elevation and elev.getElevation(lat, lon) > alt):
+        path.append((t, lat, lon, alt, u, v, du, dv))
+        if t >= end or (elevation and cell.below_ground(lat, lon, alt)):
             break
         dlat, dlon = lin_to_angular_velocities(lat, lon, u, v)
         alt = alt + step * rate
         lat = lat + dlat * step * coefficient
         lon = lon + dlon * step * coefficient
-        simtime = simtime + timedelta(seconds=step)
-    
+        t = t + step
+    return path
+
+def get_rates(cell, t, state, rate, coefficient):
+    """Time derivative of (lat, lon, alt) and the wind at state, or (None, None) if data is missing."""
+    lat, lon, alt = state
+    wind = cell.get_wind(t, lat, lon, alt)
+    if wind[0] is None:
+        return None, None
+    dlat, dlon = lin_to_angular_velocities(lat, lon, wind[0], wind[1])
+    return (dlat * coefficient, dlon * coefficient, rate), wind
+
+def position_error(error, lat):
+    """Length in meters of a (lat, lon, alt) error."""
+    dy = math.radians(error[0]) * EARTH_RADIUS
+    dx = math.radians(error[1]) * EARTH_RADIUS * math.cos(math.radians(lat))
+    return math.sqrt(dy * dy + dx * dx + error[2] * error[2])
+
+def integrate_rk(cell, tableau, t, end, state, rate, step, coefficient, elevation, tolerance):
+    nodes, stages, weights, embedded = tableau
+    k1, wind = get_rates(cell, t, state, rate, coefficient)
+    if k1 is None:
+        return "error"
+    path = [(t, *state, *wind)]
+    if elevation and cell.below_ground(*state):
+        return path
+
+    h = step
+    while t < end:
+        last = h >= end - t
+        if last:
+            h = end - t
+        ks = [k1]
+        for c, a in zip(nodes[1:], stages[1:]):
+            stage = tuple(y + h * sum(ai * k[j] for ai, k in zip(a, ks)) for j, y in enumerate(state))
+            k, stage_wind = get_rates(cell, t + c * h, stage, rate, coefficient)
+            if k is None:
+                return "error"
+            ks.append(k)
+        new = tuple(y + h * sum(b * k[j] for b, k in zip(weights, ks)) for j, y in enumerate(state))
+
+        if embedded is not None:
+            error = position_error([h * sum((b - e) * k[j] for b, e, k in zip(weights, embedded, ks)) for j in range(3)], state[0])
+            factor = 0.9 * (tolerance / error) ** (1/3) if error > 0 else 5
+            if error > tolerance and h > MIN_STEP:
+                h = max(MIN_STEP, h * max(0.2, factor))
+                continue
+            k1, wind = ks[-1], stage_wind  # Last stage was evaluated at (t + h, new)
+        else:
+            k1, wind = get_rates(cell, t + h, new, rate, coefficient)
+            if k1 is None:
+                return "error"
+
+        if elevation and cell.below_ground(*new):
+            t, new = locate_ground(cell, t, h, state, new)
+            wind = cell.get_wind(t, *new)
+            if wind[0] is None:
+                return "error"
+            path.append((t, *new, *wind))
+            break
+
+        t = end if last else t + h
+        state = new
+        path.append((t, *state, *wind))
+        if embedded is not None:
+            h = min(MAX_STEP, h * min(5, max(0.2, factor)))
     return path
 
+def locate_ground(cell, t, h, start, end):
+    """
+    Bisect for where the straight segment from start (above ground) to end (below
+    ground) meets the terrain; returns the time and state just below ground.
+    """
+    lo, hi = 0.0, 1.0
+    for __ in range(EVENT_ITERATIONS):
+        mid = (lo + hi) / 2
+        lat, lon, alt = (a + mid * (b - a) for a, b in zip(start, end))
+        if cell.below_ground(lat, lon, alt):
+            hi = mid
+        else:
+            lo = mid
+    return t + hi * h, tuple(a + hi * (b - a) for a, b in zip(start, end))
+
+class CellCache:
+    """
+    Wind and terrain lookups along one simulate() flight. The corners of the current
+    grid cell and forecast interval are kept between lookups, so consecutive steps
+    inside the same cell only recompute the interpolation weights.
+    """
+    def __init__(self, model, levels):
+        self.model = model
+        self.levels = levels
+        self.diffs = GEFS_ALT_DIFFS if levels == GEFS else GFSHIST_ALT_DIFFS
+        self.snapshot = get_snapshot()
+        self.key = None
+        self.corners = None
+        self.prefetched = None
+        self.evaluations = 0  # get_wind calls
+        self.wind_elapsed = 0  # Seconds spent in get_wind
+        self.elev_elapsed = 0  # Seconds spent in below_ground
+        self.terrain_lookups = 0  # Ground checks that needed an elevation lookup
+        self.terrain_skips = 0  # Ground checks settled by the max-elevation pyramid
+
+    def below_ground(self, lat, lon, alt):
+        start = time.perf_counter()
+        below, looked_up = elev.below_ground(lat, lon, alt)
+        if looked_up:
+            self.terrain_lookups += 1
+        else:
+            self.terrain_skips += 1
+        self.elev_elapsed += time.perf_counter() - start
+        return below
+
+    def get_wind(self, t, lat, lon, alt):
+        """get_wind at epoch seconds t; returns Nones if the data is missing."""
+        start = time.perf_counter()
+        self.evaluations += 1
+        colat = 90 - lat
+        lat_i, lat_f = int(math.floor(colat)), 1 - colat % 1
+        lon = lon % 360
+        lon_i, lon_f = int(math.floor(lon)), 1 - lon % 1
+        level_i, level_f = get_pressure_bound(alt, self.levels)
+        step = DATA_STEP * 3600
+        base = math.floor(t / step) * step
+        time_f = 1 - (t - base) / step
+
+        if time_f < PREFETCH_FRACTION and base != self.prefetched and self.snapshot is not None:
+            self.prefetched = base
+            self.snapshot.prefetch(datetime.fromtimestamp(base + 2 * step, timezone.utc), self.model)
+        key = (base, level_i, lat_i, lon_i)
+        if key != self.key:
+            self.key = key
+            self.corners = get_cell(base, self.model, level_i, lat_i, lon_i, self.levels)
+        if self.corners is None:
+            self.wind_elapsed += time.perf_counter() - start
+            return None, None, None, None
+
+        # corners[time][component][level] is a 2x2 lat/lon block
+        lines = [[0, 0], [0, 0]]
+        for c in range(2):
+            for l in range(2):
+                (a, b), (d, e) = self.corners[0][c][l]
+                line1 = (a * lon_f + b * (1 - lon_f)) * lat_f + (d * lon_f + e * (1 - lon_f)) * (1 - lat_f)
+                (a, b), (d, e) = self.corners[1][c][l]
+                line2 = (a * lon_f + b * (1 - lon_f)) * lat_f + (d * lon_f + e * (1 - lon_f)) * (1 - lat_f)
+                lines[c][l] = line1 * time_f + line2 * (1 - time_f)
+
+        dh = self.diffs[level_i]
+        u = lines[0][0] * level_f + lines[0][1] * (1 - level_f)
+        v = lines[1][0] * level_f + lines[1][1] * (1 - level_f)
+        self.wind_elapsed += time.perf_counter() - start
+        return u, v, (lines[0][1] - lines[0][0]) / dh, (lines[1][1] - lines[1][0]) / dh
+
+def get_cell(base, model, level_i, lat_i, lon_i, levels):
+    """
+    Get the (time, component, level, lat, lon) corners of one grid cell as nested
+    lists of floats, or None if its data is missing.
+    """
+    args = [np.array([x]) for x in (base, model, level_i, lat_i, lon_i)]
+    cube = get_cube()
+    if levels == GEFS and cube is not None:
+        corners = get_cube_corners(cube, *args)[0]
+    else:
+        corners = get_file_corners(*args)[0]
+    if np.isnan(corners).any():
+        return None
+    return corners.tolist()
+
+def alt_to_hpa_array(altitude):
+    """Vectorized alt_to_hpa."""
+    altitude = np.asarray(altitude, dtype=float)
+    low = np.power(np.maximum(1 - altitude/44330.7, 0), 5.2558) * 101325
+    high = np.exp(altitude / -6341.73) * 128241
+    return np.where(altitude < 11000, low, high) / 100.0
+
+def get_pressure_bounds(alts, levels):
+    """Vectorized get_pressure_bound; returns (level indices, level fractions)."""
+    levels_arr = np.asarray(levels, dtype=float)
+    n = len(levels_arr)
+    pressure = alt_to_hpa_array(alts)
+    pressure_i = np.searchsorted(levels_arr, pressure, side='left')
+    inner = np.clip(pressure_i, 1, n - 1)
+    frac = (levels_arr[inner] - pressure) / (levels_arr[inner] - levels_arr[inner - 1])
+    level_i = np.where(pressure_i == n, n - 2, np.where(pressure_i == 0, 0, inner - 1))
+    level_f = np.where(pressure_i == n, 0.0, np.where(pressure_i == 0, 1.0, frac))
+    return level_i, level_f
+
+def get_corners(data, level_i, lat_i, lon_i):
+    """Gather the (component, level, lat, lon) 2x2x2x2 cubes around each point."""
+    pair = np.arange(2)
+    comp = pair.reshape(1, 2, 1, 1, 1)
+    lev = level_i.reshape(-1, 1, 1, 1, 1) + pair.reshape(1, 1, 2, 1, 1)
+    lat = np.minimum(lat_i.reshape(-1, 1, 1, 1, 1) + pair.reshape(1, 1, 1, 2, 1), data.shape[2] - 1)
+    lon = np.minimum(lon_i.reshape(-1, 1, 1, 1, 1) + pair.reshape(1, 1, 1, 1, 2), data.shape[3] - 1)
+    return data[comp, lev, lat, lon]
+
+def get_cube_corners(cube, base, models, level_i, lat_i, lon_i):
+    """
+    Gather the (time, component, level, lat, lon) corners around each point from
+    the datacube in a single indexed read. Points without data are NaN.
+    """
+    corners = np.full((len(base), 2, 2, 2, 2, 2), np.nan)
+    data, slots, complete = cube['data'], cube['slots'], cube['complete']
+    tidx = ((base - cube['start']) // (DATA_STEP * 3600)).astype(int)
+    in_range = (models >= 0) & (models < len(slots)) & (tidx >= 0) & (tidx + 1 < len(complete))
+    ok = np.flatnonzero(in_range)
+    ok = ok[slots[models[ok]] >= 0]
+    written = complete[tidx[ok]] & complete[tidx[ok] + 1]
+    if not written.all() and get_snapshot().fetch(np.concatenate((tidx[ok[~written]], tidx[ok[~written]] + 1))):
+        written[:] = True
+    ok = ok[written]
+    if len(ok) == 0:
+        return corners
+
+    pair = np.arange(2)
+    slot = slots[models[ok]].reshape(-1, 1, 1, 1, 1, 1)
+    t = tidx[ok].reshape(-1, 1, 1, 1, 1, 1) + pair.reshape(1, 2, 1, 1, 1, 1)
+    comp = pair.reshape(1, 1, 2, 1, 1, 1)
+    lev = level_i[ok].reshape(-1, 1, 1, 1, 1, 1) + pair.reshape(1, 1, 1, 2, 1, 1)
+    lat = np.minimum(lat_i[ok].reshape(-1, 1, 1, 1, 1, 1) + pair.reshape(1, 1, 1, 1, 2, 1), data.shape[4] - 1)
+    lon = np.minimum(lon_i[ok].reshape(-1, 1, 1, 1, 1, 1) + pair.reshape(1, 1, 1, 1, 1, 2), data.shape[5] - 1)
+    corners[ok] = manifest.decode(data[slot, t, comp, lev, lat, lon], cube['encoding'])
+    return corners
+
+def get_file_corners(base, models, level_i, lat_i, lon_i):
+    """
+    Gather the (time, component, level, lat, lon) corners around each point from
+    per-timestep files. Points are grouped by forecast timestep and by underlying
+    data arrays, so each group costs one gathered lookup. Points without data are NaN.
+    """
+    corners = np.full((len(base), 2, 2, 2, 2, 2), np.nan)
+    for b in np.unique(base):
+        in_base = base == b
+        timestamp = datetime.fromtimestamp(b, timezone.utc)
+        groups = {}
+        for model in np.unique(models[in_base]):
+            data1 = get_file(timestamp, int(model))
+            data2 = get_file(timestamp + timedelta(hours=DATA_STEP), int(model))
+            if data1 is None or data2 is None:
+                continue
+            key = (id(data1), id(data2))
+            groups.setdefault(key, (data1, data2, []))[2].append(model)
+        for data1, data2, group_models in groups.values():
+            sel = np.flatnonzero(in_base & np.isin(models, group_models))
+            corners[sel, 0] = get_corners(data1, level_i[sel], lat_i[sel], lon_i[sel])
+            corners[sel, 1] = get_corners(data2, level_i[sel], lat_i[sel], lon_i[sel])
+    return corners
+
+def get_wind_vectorized(times, lats, lons, alts, models, levels):
+    """
+    Vectorized get_wind over arrays of epoch seconds, positions and models.
+    Returns (u, v, du/dh, dv/dh) arrays; points whose data is missing are NaN.
+    """
+    times = np.asarray(times, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    models = np.asarray(models, dtype=int)
+    diffs = np.asarray(GEFS_ALT_DIFFS if levels == GEFS else GFSHIST_ALT_DIFFS, dtype=float)
+
+    colat = 90 - lats
+    lat_i = np.floor(colat).astype(int)
+    lat_f = 1 - colat % 1
+    lon = lons % 360
+    lon_i = np.floor(lon).astype(int)
+    lon_f = 1 - lon % 1
+    level_i, level_f = get_pressure_bounds(alts, levels)
+
+    step = DATA_STEP * 3600
+    base = np.floor(times / step) * step
+    time_f = 1 - (times - base) / step
+
+    snapshot = get_snapshot()
+    near = time_f < PREFETCH_FRACTION
+    if snapshot is not None and near.any():
+        for b, model in set(zip(base[near].tolist(), models[near].tolist())):
+            snapshot.prefetch(datetime.fromtimestamp(b + 2 * step, timezone.utc), model)
+
+    cube = get_cube()
+    if levels == GEFS and cube is not None:
+        corners = get_cube_corners(cube, base, models, level_i, lat_i, lon_i)
+    else:
+        corners = get_file_corners(base, models, level_i, lat_i, lon_i)
+
+    lat_w = np.stack([lat_f, 1 - lat_f], axis=1).reshape(-1, 1, 1, 1, 2, 1)
+    lon_w = np.stack([lon_f, 1 - lon_f], axis=1).reshape(-1, 1, 1, 1, 1, 2)
+    lines = np.sum(corners * lat_w * lon_w, axis=(4, 5))
+    tf = time_f.reshape(-1, 1, 1)
+    lines = lines[:, 0] * tf + lines[:, 1] * (1 - tf)
+
+    dh = diffs[level_i]
+    u = lines[:, 0, 0] * level_f + lines[:, 0, 1] * (1 - level_f)
+    v = lines[:, 1, 0] * level_f + lines[:, 1, 1] * (1 - level_f)
+    du = (lines[:, 0, 1] - lines[:, 0, 0]) / dh
+    dv = (lines[:, 1, 1] - lines[:, 1, 0]) / dh
+    return u, v, du, dv
+
+@pin_snapshot
+def get_wind_batch(times, lats, lons, alts, models, levels=None):
+    """
+    Batched get_wind. times are epoch seconds; all arguments may be scalars or
+    equal-length arrays. Returns (u, v, du/dh, dv/dh) arrays, with NaN for points
+    outside the valid data range or whose data files are missing.
+    """
+    times, lats, lons, alts, models = np.broadcast_arrays(
+        np.asarray(times, dtype=float), np.asarray(lats, dtype=float),
+        np.asarray(lons, dtype=float), np.asarray(alts, dtype=float), np.asarray(models, dtype=int))
+    times, lats, lons, alts, models = [np.ravel(x) for x in (times, lats, lons, alts, models)]
+    result = tuple(np.full(len(times), np.nan) for __ in range(4))
+    if len(times) == 0 or get_snapshot() is None:
+        return result
+
+    valid_start, valid_end = get_valid_range()
+    valid = (times >= valid_start.timestamp()) & (times <= valid_end.timestamp())
+    if valid.any():
+        if levels is None:
+            levels = GFSHIST if valid_start.year < 2019 else GEFS
+        with STAGE_SECONDS.time("interpolation"):
+            winds = get_wind_vectorized(times[valid], lats[valid], lons[valid], alts[valid], models[valid], levels)
+        for out, values in zip(result, winds):
+            out[valid] = values
+    return result
+
+@pin_snapshot
+def get_wind_field(simtime, lat_range, lon_range, alt, model, levels=None, stride=1):
+    """
+    u and v winds on the grid points of a lat/lon box at one altitude and time, for wind maps.
+    lat_range and lon_range are (first, last) whole degrees, inclusive; lon_range may cross the
+    antimeridian, e.g. (170, 190). stride takes every stride-th grid point. Only the box at the
+    two bracketing pressure levels and forecast times is read from the data.
+    Returns (lats, lons, u, v) with lats north to south and u, v of shape (len(lats), len(lons)),
+    or None if the time is outside the valid range or the data is missing.
+    """
+    simtime = ensure_utc(simtime)
+    if not check_time_valid(simtime):
+        return None
+    if not (-90 <= lat_range[0] <= lat_range[1] <= 90 and lon_range[0] <= lon_range[1] < lon_range[0] + 360):
+        raise ValueError("Invalid lat/lon box")
+    if levels is None:
+        levels = GFSHIST if simtime.year < 2019 else GEFS
+    lats = np.arange(int(lat_range[1]), int(lat_range[0]) - 1, -stride)
+    lons = np.arange(int(lon_range[0]), int(lon_range[1]) + 1, stride)
+    first_row, first_col = 90 - lats[0], lons[0] % 360
+    rows = slice(first_row, 90 - lats[-1] + 1, stride)
+    if first_col + lons[-1] - lons[0] < 360:
+        cols = slice(first_col, first_col + lons[-1] - lons[0] + 1, stride)
+    else:
+        cols = lons % 360  # Crosses 0 E, so gathered rather than sliced
+    level_i, level_f = get_pressure_bound(alt, levels)
+
+    step = DATA_STEP * 3600
+    base = math.floor(simtime.timestamp() / step) * step
+    time_f = 1 - (simtime.timestamp() - base) / step
+    snapshot = get_snapshot()
+    if levels == GEFS and snapshot.cube is not None:
+        index1 = snapshot.get_cube_index(base, model)
+        index2 = snapshot.get_cube_index(base + step, model)
+        if index1 is None or index2 is None:
+            return None
+        slot, tidx = index1
+        box = snapshot.cube['data'][slot, tidx:tidx+2, :, level_i:level_i+2, rows]
+        box1, box2 = manifest.decode(box[..., cols], snapshot.cube['encoding'])
+    else:
+        timestamp = datetime.fromtimestamp(base, timezone.utc)
+        data1 = get_file(timestamp, model)
+        data2 = get_file(timestamp + timedelta(hours=DATA_STEP), model)
+        if data1 is None or data2 is None:
+            return None
+        box1 = data1[:, level_i:level_i+2, rows][..., cols]
+        box2 = data2[:, level_i:level_i+2, rows][..., cols]
+
+    field = box1 * time_f + box2 * (1 - time_f)
+    u, v = field[:, 0] * level_f + field[:, 1] * (1 - level_f)
+    return lats, lons, u, v
+
+@pin_snapshot
+def simulate_ensemble(simtime, lat, lon, rate, step, max_duration, alt, models, coefficient=1, elevation=True, final=False):
+    """
+    Run simulate() for many members at once, stepping all of them in one NumPy pass.
+    simtime is a datetime or epoch seconds; simtime, lat, lon, rate, max_duration,
+    alt and coefficient may be scalars or per-member arrays matching models.
+    Members stop individually on ground contact or at their end time.
+    Returns a list of paths in the same format as simulate(), one per member, or "error".
+    With final=True, returns only each member's last point as an (n, 8) array, in which
+    members that ran out of wind data are NaN rows rather than failing the whole batch.
+    """
+    models = np.atleast_1d(np.asarray(models, dtype=int))
+    n = len(models)
+
+    def per_member(x):
+        return np.broadcast_to(np.asarray(x, dtype=float), (n,)).copy()
+
+    if isinstance(simtime, datetime):
+        simtime = ensure_utc(simtime).timestamp()
+    t = per_member(simtime)
+    lat, lon, alt = per_member(lat), per_member(lon), per_member(alt)
+    rate, coefficient = per_member(rate), per_member(coefficient)
+    end = t + per_member(max_duration) * 3600
+
+    start = datetime.fromtimestamp(t.min(), timezone.utc)
+    if not check_time_valid(start) or not check_time_valid(datetime.fromtimestamp(end.max(), timezone.utc)):
+        logger.debug("Ensemble flight window outside valid range")
+        return "error"
+
+    levels = GFSHIST if start.year < 2019 else GEFS
+    active = np.ones(n, dtype=bool)
+    records = []
+    last = np.empty((n, 8))
+    steps = np.zeros(n, dtype=int)
+
+    while active.any():
+        idx = np.flatnonzero(active)
+        with STAGE_SECONDS.time("interpolation"):
+            u, v, du, dv = get_wind_vectorized(t[idx], lat[idx], lon[idx], alt[idx], models[idx], levels)
+        missing = np.isnan(u)
+        if missing.any():
+            if not final:
+                return "error"
+            last[idx[missing]] = np.nan
+            active[idx[missing]] = False
+            idx, u, v, du, dv = idx[~missing], u[~missing], v[~missing], du[~missing], dv[~missing]
+        rows = np.column_stack((t[idx], lat[idx], lon[idx], alt[idx], u, v, du, dv))
+        steps[idx] += 1
+        if final:
+            last[idx] = rows
+        else:
+            records.append((idx, rows))
+
+        done = t[idx] >= end[idx]
+        if elevation:
+            with STAGE_SECONDS.time("elevation"):
+                below, looked_up = elev.below_ground_batch(lat[idx], lon[idx], alt[idx])
+            done |= below
+            lookups = int(looked_up.sum())
+            TERRAIN_CHECKS.inc("skipped", amount=len(idx) - lookups)
+            TERRAIN_CHECKS.inc("performed", amount=lookups)
+        active[idx[done]] = False
+
+        move = idx[~done]
+        u, v = u[~done], v[~done]
+        dlat = np.degrees(v / EARTH_RADIUS)
+        dlon = np.degrees(u / (EARTH_RADIUS * np.cos(np.radians(lat[move]))))
+        alt[move] += step * rate[move]
+        lat[move] += dlat * step * coefficient[move]
+        lon[move] += dlon * step * coefficient[move]
+        t[move] += step
+
+    for count in steps:
+        SIMULATION_STEPS.observe(count, "ensemble")
+    if final:
+        return last
+    members = np.concatenate([r[0] for r in records])
+    rows = np.concatenate([r[1] for r in records])
+    order = np.argsort(members, kind='stable')
+    splits = np.cumsum(steps)[:-1]
+    return [path.tolist() for path in np.split(rows[order], splits)]
+
 def refreshdaemon():
     """Daemon to refresh GEFS data cache."""
     while True:
         if refresh():
-            print('Cache reset by daemon.')
+            logger.info("Switched to GEFS cycle %s", currgefs)
         time.sleep(60)
 
 def start_refresh_daemon():
     """Start the refresh daemon if not already running."""
-    from threading import Thread
-    Thread(target=refreshdaemon).start()
+    threading.Thread(target=refreshdaemon, daemon=True).start()
 
 # Force initial load of currgefs on module import
 refresh()
@@ -0,0 +1,83 @@
+"""
+Launch-window sweeps: one rise/coast/fall flight profile over a grid of launch times x
+sites x GEFS members, run together as batched ensembles (montecarlo.fly) and summarized
+per launch by its members' landing points instead of full paths.
+"""
+import math
+import numpy as np
+import montecarlo
+import simulate
+
+MAX_FLIGHTS = montecarlo.MAX_SAMPLES  # Launch times x sites x members per request
+
+def flight_hours(alt, equil, eqtime, asc, desc):
+    """Planned duration in hrs of a flight launched at alt."""
+    return (equil - alt) / asc / 3600 + eqtime + equil / desc / 3600
+
+def flight_end(launch, alt, equil, eqtime, asc, desc, step):
+    """
+    Latest epoch seconds a flight launched at launch from alt may need winds for: its planned
+    end, plus a step of overshoot in each of rise, coast and fall and the longer fall from an
+    overshot rise.
+    """
+    return launch + flight_hours(alt, equil, eqtime, asc, desc) * 3600 + step * (3 + asc / desc)
+
+def offsets(lats, lons, lat0, lon0):
+    """East and north offsets in meters of points from (lat0, lon0); lons must be unwrapped around lon0."""
+    north = np.radians(lats - lat0) * simulate.EARTH_RADIUS
+    east = np.radians(lons - lon0) * simulate.EARTH_RADIUS * math.cos(math.radians(lat0))
+    return east, north
+
+def summarize_launch(timestamp, site, landings):
+    """Landing points of one launch's members, their mean and spread, and the drift from the site."""
+    times, lats, lons = landings[:, 0], landings[:, 1], landings[:, 2]
+    lons = (lons - site[1] + 180) % 360 - 180 + site[1]
+    mean_lat, mean_lon = lats.mean(), lons.mean()
+    spread = np.hypot(*offsets(lats, lons, mean_lat, mean_lon))
+    drift = math.hypot(*offsets(np.array(mean_lat), np.array(mean_lon), site[0], site[1]))
+    return {
+        'timestamp': timestamp,
+        'site': list(site),
+        'landings': np.column_stack((times, lats, (lons + 180) % 360 - 180)).tolist(),
+        'mean': [mean_lat, (mean_lon + 180) % 360 - 180],
+        'flight_time': float(times.mean() - timestamp) / 3600,  # hrs
+        'drift': drift,  # m from the site to the mean landing
+        'spread': float(np.percentile(spread, 95)),  # m from the mean landing, 95th percentile
+    }
+
+@simulate.pin_snapshot
+def run(timestamps, sites, models, equil, eqtime, asc, desc, step=240):
+    """
+    Fly the profile from every (lat, lon, alt) site at every launch timestamp (epoch seconds)
+    for each model. Launches whose flight would leave the forecast's valid range or run into
+    hours not yet written, or any of whose members could not be flown, are "error".
+    Returns one summary per launch, ordered by timestamp and then site, or "error".
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    sites = np.asarray(sites, dtype=float).reshape(-1, 3)
+    models = np.asarray(models, dtype=int)
+    if len(timestamps) * len(sites) * len(models) > MAX_FLIGHTS:
+        raise ValueError(f"At most {MAX_FLIGHTS} flights per request")
+
+    launch_t = np.repeat(timestamps, len(sites))
+    launch_site = np.tile(np.arange(len(sites)), len(timestamps))
+    alts = sites[launch_site, 2]
+    equils = np.maximum(equil, alts)
+    valid = simulate.get_covered(launch_t, flight_end(launch_t, alts, equils, eqtime, asc, desc, step))
+
+    launches = np.flatnonzero(valid)
+    results = ["error"] * len(launch_t)
+    if len(launches) == 0:
+        return results
+    flight = np.repeat(launches, len(models))  # Launch of each flight
+    s = launch_site[flight]
+    landings = montecarlo.fly(launch_t[flight], sites[s, 0], sites[s, 1], sites[s, 2], equils[flight],
+                              eqtime, asc, desc, np.tile(models, len(launches)), step=step)
+    if isinstance(landings, str):
+        return "error"
+    for i, launch in enumerate(launches):
+        members = landings[i * len(models):(i + 1) * len(models)]
+        if np.isnan(members[:, 0]).any():
+            continue
+        results[launch] = summarize_launch(float(launch_t[launch]), sites[launch_site[launch]].tolist(), members)
+    return results
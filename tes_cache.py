@@ -0,0 +1,82 @@
+import os
+import tempfile
+import numpy as np
+import cache
+
+def test_lru_entries():
+    """The least recently used entry goes first; reads count as use"""
+    lru = cache.LRUCache(max_entries=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    assert lru.get('a') == 1
+    lru.put('c', 3)
+    print(lru.stats())
+    assert 'b' not in lru and 'a' in lru and 'c' in lru
+    assert lru.get('b') is None and lru.get('b', 0) == 0
+    stats = lru.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 2, 1)
+
+def test_lru_bytes():
+    """Byte bounds count nbytes; an entry larger than the bound is still kept alone"""
+    lru = cache.LRUCache(max_bytes=1000)
+    for key in range(3):
+        lru.put(key, np.zeros(50))  # 400 bytes
+    print(lru.stats())
+    assert list(lru.entries) == [1, 2] and lru.bytes == 800
+    lru.put(1, np.zeros(25))  # Replacing an entry updates its size
+    assert lru.bytes == 600
+    lru.put('big', np.zeros(200))
+    assert list(lru.entries) == ['big'] and lru.bytes == 1600
+    lru.clear()
+    assert len(lru) == 0 and lru.bytes == 0
+
+def test_get_or_load():
+    """Loads run once per key, and None results are not cached"""
+    lru = cache.LRUCache(max_entries=4)
+    loads = []
+
+    def load(value):
+        loads.append(value)
+        return value
+    assert lru.get_or_load('x', lambda: load(5)) == 5
+    assert lru.get_or_load('x', lambda: load(6)) == 5
+    assert lru.get_or_load('y', lambda: load(None)) is None
+    assert lru.get_or_load('y', lambda: load(None)) is None
+    print("Loads:", loads)
+    assert loads == [5, None, None] and 'y' not in lru
+
+def test_result_entries():
+    """Result cache entries sized by body length, dropped per cycle"""
+    lru = cache.LRUCache(max_bytes=10, sizeof=lambda entry: len(entry[0]))
+    lru.put(('singlezpb', 1, '2024123012'), (b'xxxx', 'application/json', {}))
+    lru.put(('spaceshot', 2, '2024123018'), (b'xxxxx', 'application/json', {}))
+    assert lru.bytes == 9
+    lru.discard(lambda key: key[-1] != '2024123018')
+    print(lru.stats())
+    assert list(lru.entries) == [('spaceshot', 2, '2024123018')] and lru.bytes == 5
+
+def test_disk_store():
+    """Stored results survive a new store, ignore damaged files and are dropped with their cycle"""
+    directory = tempfile.mkdtemp()
+    store = cache.DiskStore(directory)
+    store.put('2024123012', ('singlezpb', 1), b'body')
+    store.put('2024123018', ('singlezpb', 1), b'newer')
+    store = cache.DiskStore(directory)
+    assert store.get('2024123012', ('singlezpb', 1)) == b'body'
+    assert store.get('2024123012', ('singlezpb', 2)) is None
+
+    with open(store.path('2024123018', ('singlezpb', 1)), 'wb') as f:
+        f.write(b'truncated')
+    assert store.get('2024123018', ('singlezpb', 1), 'missing') == 'missing'
+
+    store.retain('2024123018')
+    print("Groups left:", os.listdir(directory))
+    assert os.listdir(directory) == ['2024123018']
+    assert store.get('2024123012', ('singlezpb', 1)) is None
+
+if __name__ == "__main__":
+    test_lru_entries()
+    test_lru_bytes()
+    test_get_or_load()
+    test_result_entries()
+    test_disk_store()
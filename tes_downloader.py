@@ -0,0 +1,182 @@
+import os
+import re
+import struct
+import tempfile
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from xml.sax.saxutils import escape
+import numpy as np
+import benchmark
+import downloader
+import ingest
+import manifest
+
+BUCKET = 'noaa-gefs-pds'
+
+class S3StandIn(BaseHTTPRequestHandler):
+    """The S3 calls the downloader makes (ListObjectsV2 and ranged GetObject), served from a dict of keys."""
+    objects = {}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        bucket, __, key = url.path.lstrip('/').partition('/')
+        if bucket != BUCKET:
+            return self.send_error(404)
+        if not key:
+            prefix = parse_qs(url.query).get('prefix', [''])[0]
+            keys = sorted(k for k in self.objects if k.startswith(prefix))
+            contents = ''.join(f"<Contents><Key>{escape(k)}</Key><Size>{len(self.objects[k])}</Size></Contents>" for k in keys)
+            body = (f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                    f'<Name>{BUCKET}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(keys)}</KeyCount>'
+                    f'<MaxKeys>1000</MaxKeys><IsTruncated>false</IsTruncated>{contents}</ListBucketResult>').encode()
+            return self.reply(200, body, 'application/xml')
+        data = self.objects.get(unquote(key))
+        if data is None:
+            return self.reply(404, b'<Error><Code>NoSuchKey</Code></Error>', 'application/xml')
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match is None:
+            return self.reply(200, data)
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        self.reply(206, data[start:end + 1], headers={'Content-Range': f"bytes {start}-{end}/{len(data)}"})
+
+    def reply(self, status, body, mimetype='binary/octet-stream', headers={}):
+        self.send_response(status)
+        self.send_header('Content-Type', mimetype)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def grib_with_idx(path, forecast_hour):
+    """A GRIB2 file of winds followed by one vertical velocity message, and its wgrib2-style inventory."""
+    benchmark.write_grib(path, forecast_hour)
+    with open(path, 'ab') as f:
+        f.write(benchmark.grib2_message(8, 500, np.zeros((361, 720)), forecast_hour))
+    with open(path, 'rb') as f:
+        data = f.read()
+    names = [(variable, level) for variable in ('UGRD', 'VGRD') for level in benchmark.LEVELS] + [('VVEL', 500)]
+    lines, offset = [], 0
+    for n, (variable, level) in enumerate(names, 1):
+        lines.append(f"{n}:{offset}:d=2024010100:{variable}:{level} mb:{forecast_hour} hour fcst:ENS=mean")
+        offset += struct.unpack('>Q', data[offset + 8:offset + 16])[0]  # GRIB2 total message length
+    assert offset == len(data)
+    return data, "\n".join(lines).encode()
+
+def test_parse_idx():
+    """Sub-messages share their parent's offset; ranges end before the next distinct offset"""
+    idx = "\n".join([
+        "1:0:d=2024123012:HGT:10 mb:anl:ENS=mean",
+        "2:100:d=2024123012:UGRD:10 mb:anl:ENS=mean",
+        "3.1:250:d=2024123012:UGRD:20 mb:anl:ENS=mean",
+        "3.2:250:d=2024123012:VGRD:20 mb:anl:ENS=mean",
+        "4:400:d=2024123012:TMP:20 mb:anl:ENS=mean",
+        "5:500:d=2024123012:VGRD:30 mb:anl:ENS=mean",
+    ])
+    entries = downloader.parse_idx(idx)
+    print(entries)
+    assert entries[2][3] == 400 and entries[3][3] == 400
+    assert entries[-1][3] is None
+    ranges = downloader.select_ranges(entries, ('UGRD', 'VGRD'), ['10 mb', '20 mb', '30 mb'])
+    print(ranges)
+    assert ranges == [(100, 399), (500, None)]
+    assert downloader.select_ranges(entries, ('UGRD',), ['20 mb']) == [(250, 399)]
+
+def test_ingest_queue():
+    """Requests keep their best priority, are written in (priority, hour) order and are dropped once written or stale"""
+    queue = tempfile.mkdtemp()
+    cycle = '2024123012'
+    ingest.request(queue, cycle, '2024123118', 1)
+    ingest.request(queue, cycle, '2024123118', 0)
+    ingest.request(queue, cycle, '2025010100', 1)
+    ingest.request(queue, cycle, '2024123112', 1)
+    ingest.request(queue, cycle, '2025010212', 0)
+    ingest.request(queue, '2024123006', '2024123100', 0)  # The cycle servers still use
+    ingest.request(queue, '2024123000', '2024123100', 0)  # An older cycle
+    open(os.path.join(queue, 'partial.tmp'), 'w').close()
+    pending = ingest.pending(queue)
+    print(pending)
+    assert len(pending) == 6 and pending[(cycle, '2024123118')] == 0
+
+    queue_dir, downloader.INGEST_QUEUE_DIR = downloader.INGEST_QUEUE_DIR, queue
+    try:
+        sync = downloader.GEFSDownloader(data_dir=os.path.join(queue, 'gefs'), temp_dir=os.path.join(queue, 'temp'),
+                                         staging_dir=os.path.join(queue, 'staging'))
+        sync.base_time = datetime(2024, 12, 30, 12)
+        forecast_hours = list(range(0, 385, 6))
+        todo = [hour for hour in forecast_hours if hour != 6]
+        order = sync.requested_hours(forecast_hours, todo)
+        print("Write order:", order)
+        # Hours 30 and 72 are awaited (priority 0), 36 is lookahead; 24 is published up front by default
+        assert order == [hour for hour in todo if hour <= downloader.PUBLISH_HOURS] + \
+            [hour for hour in (30, 72, 36) if hour > downloader.PUBLISH_HOURS]
+
+        with open(os.path.join(queue, 'whichgefs'), 'w') as f:
+            f.write('2024123006')
+        sync.manifest = {"complete": ['2024123112']}
+        sync.remove_requests(forecast_hours)
+        left = sorted(ingest.pending(queue))
+        print("Left:", left)
+        assert left == [('2024123006', '2024123100'), (cycle, '2024123118'), (cycle, '2025010100'), (cycle, '2025010212')]
+    finally:
+        downloader.INGEST_QUEUE_DIR = queue_dir
+
+def test_pipeline():
+    """Ingest a small cycle through a local S3 stand-in: staged while incomplete, then published"""
+    root = tempfile.mkdtemp()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), S3StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    now = datetime.utcnow()
+    cycle = now.replace(hour=now.hour - now.hour % 6, minute=0, second=0, microsecond=0)
+    prefix = f"gefs.{cycle.strftime('%Y%m%d')}/{cycle.strftime('%H')}/atmos/pgrb2ap5/geavg.t{cycle.strftime('%H')}z.pgrb2a.0p50.f"
+    gribs = {hour: grib_with_idx(os.path.join(root, f'f{hour:03d}.grib2'), hour) for hour in (0, 6, 12)}
+
+    def upload(hour):
+        S3StandIn.objects[f"{prefix}{hour:03d}"], S3StandIn.objects[f"{prefix}{hour:03d}.idx"] = gribs[hour]
+
+    def run():
+        ingest = downloader.GEFSDownloader(data_dir=os.path.join(root, 'gefs'), temp_dir=os.path.join(root, 'temp'),
+                                           staging_dir=os.path.join(root, 'staging'), max_forecast_hour=12, decode_workers=2,
+                                           endpoint_url=f"http://127.0.0.1:{server.server_address[1]}")
+        assert ingest.run()
+    cycle_str = cycle.strftime("%Y%m%d%H")
+    upload(0)
+    upload(6)
+    run()
+    staged = manifest.load_manifest(os.path.join(root, 'staging'), cycle_str)
+    print("Staged:", staged["complete"])
+    assert len(staged["complete"]) == 2
+    assert not os.path.exists(os.path.join(root, 'whichgefs'))
+    assert not os.path.exists(os.path.join(root, 'staging', f"{cycle_str}_writing"))
+
+    # A run interrupted mid-write leaves its marker; the next one rechecks and rewrites damaged hours
+    staged_cube = np.load(os.path.join(root, 'staging', staged["cube"]), mmap_mode='r+')
+    staged_cube[0, 0] = 0
+    staged_cube.flush()
+    del staged_cube
+    open(os.path.join(root, 'staging', f"{cycle_str}_writing"), 'w').close()
+    upload(12)
+    run()
+    with open(os.path.join(root, 'whichgefs')) as f:
+        assert f.read() == cycle_str
+    published = manifest.load_manifest(os.path.join(root, 'gefs'), cycle_str)
+    print("Published:", sorted(published["complete"]))
+    assert len(published["complete"]) == 3
+    cube = np.load(os.path.join(root, 'gefs', published["cube"]), 'r')
+    for i, hour in enumerate((0, 6, 12)):
+        winds = manifest.decode(cube[0, i], manifest.get_encoding(published))
+        error = np.abs(winds - benchmark.synthetic_winds(hour // 6, 0)).max()
+        print(f"f{hour:03d}: max error {error:.4f} m/s")
+        assert error < 0.02
+    server.shutdown()
+
+if __name__ == "__main__":
+    test_parse_idx()
+    test_ingest_queue()
+    test_pipeline()
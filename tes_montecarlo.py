@@ -0,0 +1,32 @@
+import numpy as np
+import montecarlo
+
+def landings_around(lat, lon, n=200, sd=0.05, seed=0):
+    """n landing points scattered around (lat, lon), in simulate's point format"""
+    rng = np.random.default_rng(seed)
+    landings = np.zeros((n, 8))
+    landings[:, 0] = 1700000000 + rng.uniform(3, 4, n) * 3600
+    landings[:, 1] = lat + rng.normal(0, sd, n)
+    landings[:, 2] = (lon + rng.normal(0, sd, n) + 180) % 360 - 180
+    return landings
+
+def test_summarize():
+    """Mean, percentiles, ellipse and density of a cluster, including one across the antimeridian"""
+    summary = montecarlo.summarize(landings_around(37.4, -122.1), 0.1)
+    print(summary['mean'], summary['ellipse'])
+    assert summary['samples'] == 200
+    assert np.allclose(summary['mean'], [37.4, -122.1], atol=0.02)
+    assert np.all(np.diff(summary['percentiles']['distance']) >= 0)
+    # sd of 0.05 degrees is ~5.5 km north-south; the 95% semi-axes are ~2.45 sd
+    assert 9000 < summary['ellipse']['semi_minor'] <= summary['ellipse']['semi_major'] < 18000
+    assert abs(sum(cell[2] for cell in summary['density']['cells']) - 1) < 1e-9
+
+    summary = montecarlo.summarize(landings_around(-20, 179.98), 0.1)
+    print(summary['mean'], summary['percentiles']['lon'])
+    assert abs((summary['mean'][1] - 179.98 + 180) % 360 - 180) < 0.02
+    lons = summary['percentiles']['lon'] + [cell[1] for cell in summary['density']['cells']]
+    assert all(-180 <= lon < 180 for lon in lons)
+    assert summary['ellipse']['semi_major'] < 18000  # Not stretched around the globe
+
+if __name__ == "__main__":
+    test_summarize()
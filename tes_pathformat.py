@@ -0,0 +1,63 @@
+import json
+import struct
+import numpy as np
+import pathformat
+
+def make_path():
+    """A 2 h ascent to 20 km then a 1 h descent, one point a minute"""
+    times = np.arange(181) * 60.0
+    alts = np.where(times <= 7200, times / 7200 * 20000, 20000 - (times - 7200) / 3600 * 20000)
+    path = np.zeros((len(times), 8))
+    path[:, 0] = 1700000000 + times
+    path[:, 1] = 37.4 + times * 1e-5
+    path[:, 2] = -122.1
+    path[:, 3] = alts
+    return path
+
+def test_decimate():
+    """Douglas-Peucker keeps the endpoints and the apex and stays within tolerance"""
+    path = make_path()
+    assert pathformat.decimate(path) is path
+    kept = pathformat.decimate(path, tolerance=1)
+    print(f"Tolerance 1 m: {len(kept)}/{len(path)} points")
+    assert [row[0] for row in kept] == [path[0, 0], path[120, 0], path[-1, 0]]
+    assert len(pathformat.decimate(path, max_points=2)) == 2
+    kept = pathformat.decimate(path, max_points=5)
+    assert len(kept) == 5 and path[120, 0] in kept[:, 0]
+    assert len(pathformat.decimate(path[:2], max_points=1)) == 2
+
+def test_encode():
+    """Every format carries the same selected, decimated fields"""
+    path = make_path()
+    result = [[path.tolist(), path[:10].tolist()]]
+    body, mimetype = pathformat.encode(result)
+    assert mimetype == 'application/json'
+    assert np.allclose(json.loads(body)[0][1], path[:10])
+
+    body, __ = pathformat.encode(result, 'columnar', fields='time,alt', tolerance=1)
+    columns = json.loads(body)[0][0]
+    print("Columnar:", columns)
+    assert list(columns) == ['time', 'alt']
+    assert columns['alt'] == [0.0, 20000.0, 0.0]
+
+    body, mimetype = pathformat.encode(result, 'binary', fields='lat,lon')
+    assert mimetype == 'application/octet-stream'
+    length = struct.unpack('<I', body[:4])[0]
+    header = json.loads(body[4:4 + length])
+    print("Binary header:", header)
+    assert header == {'fields': ['lat', 'lon'], 'dtype': '<f8', 'shape': [[181, 10]]}
+    values = np.frombuffer(body[4 + length:], '<f8')
+    assert np.array_equal(values[:181], path[:, 1]) and np.array_equal(values[181:362], path[:, 2])
+    assert len(values) == 2 * (181 + 10)
+
+    for format, fields in (('xml', None), ('json', 'time,speed')):
+        try:
+            pathformat.encode(result, format, fields)
+        except ValueError as e:
+            print("Rejected:", e)
+        else:
+            raise AssertionError(f"format={format} fields={fields} was accepted")
+
+if __name__ == "__main__":
+    test_decimate()
+    test_encode()
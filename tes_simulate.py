@@ -1,4 +1,6 @@
 from datetime import datetime, timezone
+import numpy as np
+import manifest
 import simulate
 
 def test_simulation():
@@ -38,5 +40,20 @@ def test_simulation():
         print("\nFirst point:", path[0])
         print("Last point:", path[-1])
 
+def test_quantization():
+    """Check that compact storage encodings stay within their stated error bounds"""
+    # Winds well beyond anything GEFS reports (jet stream peaks are ~100 m/s)
+    winds = np.random.default_rng(0).uniform(-200, 200, (2, 26, 181, 360))
+    bounds = {'float32': 1e-4, 'int16': manifest.WIND_SCALE / 2}  # m/s
+
+    for dtype, bound in bounds.items():
+        encoding = manifest.new_encoding(dtype)
+        stored = manifest.encode(winds, encoding)
+        error = np.abs(manifest.decode(stored, encoding) - winds).max()
+        print(f"{dtype}: {stored.nbytes / winds.nbytes:.2f}x size, max error {error:.6f} m/s (bound {bound} m/s)")
+        assert stored.dtype == np.dtype(dtype)
+        assert error <= bound + 1e-9
+
 if __name__ == "__main__":
+    test_quantization()
     test_simulation()
@@ -0,0 +1,32 @@
+import numpy as np
+import sweep
+
+def test_summarize_launch():
+    """Sweep summaries measure drift from the site and wrap longitudes"""
+    rng = np.random.default_rng(0)
+    site = [10.0, 179.9, 0.0]
+    landings = np.zeros((20, 8))
+    landings[:, 0] = 1700000000 + rng.uniform(3, 4, 20) * 3600
+    landings[:, 1] = 10.3 + rng.normal(0, 0.05, 20)
+    landings[:, 2] = (-179.8 + rng.normal(0, 0.05, 20) + 180) % 360 - 180
+    summary = sweep.summarize_launch(1700000000.0, site, landings)
+    print({key: summary[key] for key in ('mean', 'flight_time', 'drift', 'spread')})
+    assert summary['site'] == site and len(summary['landings']) == 20
+    assert -180 <= summary['mean'][1] < 180 and abs(summary['mean'][1] + 179.8) < 0.05
+    assert all(-180 <= lon < 180 for __, __, lon in summary['landings'])
+    assert 3 < summary['flight_time'] < 4
+    # 0.3 degrees north and 0.3 east (across the antimeridian) is ~47 km
+    assert 40000 < summary['drift'] < 55000
+    assert 0 < summary['spread'] < 20000
+
+def test_flight_end():
+    """Coverage checks allow for a step of overshoot per stage and the longer fall after the rise"""
+    planned = sweep.flight_hours(0, 25000, 1, 5, 5) * 3600
+    assert planned == 25000 / 5 + 3600 + 25000 / 5
+    end = sweep.flight_end(1700000000, 0, 25000, 1, 5, 5, 240)
+    print(f"Planned {planned:.0f} s, allowed {end - 1700000000:.0f} s")
+    assert end == 1700000000 + planned + 4 * 240
+
+if __name__ == "__main__":
+    test_summarize_launch()
+    test_flight_end()
@@ -0,0 +1,134 @@
+"""
+Pool of worker processes for ensemble and batch requests.
+
+Each worker imports simulate and maps the GEFS data itself, so the data is shared
+through the page cache rather than copied. Tasks carry the cycle and manifest revision
+of the caller's snapshot; a worker on a different one reloads the cycle before running the task.
+Counters and histograms recorded in a worker are returned with each task's result and
+merged into the server's, so /metrics covers work done in the pool.
+simulate_ensemble and get_wind_batch here are drop-in replacements for simulate's
+that split the members or points across the pool, and run in-process when the pool
+is disabled, broken or the request is too small to be worth splitting.
+"""
+import logging
+import math
+import multiprocessing
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+import simulate
+from config import WORKER_PROCESSES
+
+MIN_MEMBERS = 2  # Members per worker task
+MIN_POINTS = 50000  # Wind lookups per worker task
+
+logger = logging.getLogger(__name__)
+pool = None
+processes = 0
+
+def start(workers=WORKER_PROCESSES):
+    """Start the pool. Each worker loads the current cycle as it starts, before taking tasks."""
+    global pool, processes
+    if workers <= 1 or pool is not None:
+        return
+    snapshot = simulate.get_snapshot()
+    version = None if snapshot is None else (snapshot.cycle, snapshot.revision)
+    # Spawned rather than forked: the server process has threads and open memory maps
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=use_version, initargs=(version,))
+    processes = workers
+    logger.info("Started %d worker processes", workers)
+
+def stop():
+    global pool, processes
+    if pool is not None:
+        pool.shutdown(wait=False)
+    pool, processes = None, 0
+
+def use_version(version):
+    """In a worker, switch to the (cycle, manifest revision) of the data, or a later revision of the same cycle."""
+    if version is not None:
+        cycle, revision = version
+        snapshot = simulate.get_snapshot()
+        if snapshot is None or snapshot.cycle != cycle:
+            simulate.load_cycle(cycle, force=True)
+        elif (snapshot.revision or 0) < (revision or 0) and not snapshot.update():
+            simulate.load_cycle(cycle, force=True)
+
+def run_task(version, name, args, kwargs):
+    """
+    Run simulate.name(*args, **kwargs) in a worker on the caller's version of the data.
+    Returns the result with the metrics the worker recorded since its last task, for the
+    server's /metrics.
+    """
+    use_version(version)
+    result = getattr(simulate, name)(*args, **kwargs)
+    return result, metrics.drain()
+
+def fan_out(name, chunks, kwargs):
+    """Run simulate.name over chunks of arguments in the pool; None if the pool is unusable."""
+    snapshot = simulate.get_snapshot()
+    version = (snapshot.cycle, snapshot.revision)
+    try:
+        futures = [pool.submit(run_task, version, name, args, kwargs) for args in chunks]
+        results = []
+        for future in futures:
+            result, samples = future.result()
+            metrics.merge(samples)
+            results.append(result)
+        return results
+    except BrokenProcessPool:
+        logger.error("Worker pool broke; restarting it and running in-process")
+        workers = processes
+        stop()
+        start(workers)
+        return None
+
+def split(n, per_chunk):
+    """Slices dividing n items into at most one chunk per worker, each of at least per_chunk items."""
+    chunks = min(processes, n // per_chunk)
+    if pool is None or chunks <= 1:
+        return None
+    size = math.ceil(n / chunks)
+    return [slice(i, i + size) for i in range(0, n, size)]
+
+@simulate.pin_snapshot
+def simulate_ensemble(simtime, lat, lon, rate, step, max_duration, alt, models, coefficient=1, elevation=True, final=False):
+    """simulate.simulate_ensemble, with the members split across the worker pool."""
+    models = np.atleast_1d(np.asarray(models, dtype=int))
+    slices = split(len(models), MIN_MEMBERS)
+    if isinstance(simtime, datetime):
+        simtime = simulate.ensure_utc(simtime).timestamp()
+    arrays = [simtime, lat, lon, rate, max_duration, alt, coefficient]
+    results = None
+    if slices is not None:
+        arrays = [np.broadcast_to(np.asarray(x, dtype=float), models.shape) for x in arrays]
+        chunks = []
+        for s in slices:
+            t, la, lo, r, dur, a, c = (x[s] for x in arrays)
+            chunks.append((t, la, lo, r, step, dur, a, models[s], c, elevation, final))
+        results = fan_out('simulate_ensemble', chunks, {})
+    if results is None:
+        t, la, lo, r, dur, a, c = arrays
+        return simulate.simulate_ensemble(t, la, lo, r, step, dur, a, models, c, elevation, final)
+    if any(isinstance(result, str) for result in results):
+        return "error"
+    if final:
+        return np.concatenate(results)
+    return [path for result in results for path in result]
+
+@simulate.pin_snapshot
+def get_wind_batch(times, lats, lons, alts, models, levels=None):
+    """simulate.get_wind_batch, with the points split across the worker pool."""
+    arrays = [np.ravel(x) for x in np.broadcast_arrays(
+        np.asarray(times, dtype=float), np.asarray(lats, dtype=float), np.asarray(lons, dtype=float),
+        np.asarray(alts, dtype=float), np.asarray(models, dtype=int))]
+    slices = split(len(arrays[0]), MIN_POINTS)
+    results = None
+    if slices is not None:
+        results = fan_out('get_wind_batch', [[x[s] for x in arrays] + [levels] for s in slices], {})
+    if results is None:
+        return simulate.get_wind_batch(*arrays, levels)
+    return tuple(np.concatenate(values) for values in zip(*results))